@@ -1,8 +1,12 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import os
+import json
+import base64
 import logging
+from datetime import datetime
 from werkzeug.utils import secure_filename
+from werkzeug.serving import is_running_from_reloader
 from marshmallow import ValidationError
 import traceback
 
@@ -10,6 +14,17 @@ from config import Config
 from database import init_database, db_manager
 from face_service_mediapipe import face_service
 from minio_service import minio_service
+from index_manager import ivfflat_index_manager
+from gallery import face_gallery
+from image_dedup import image_dedup
+from embedding_cache import embedding_cache
+from gallery_snapshot import build_snapshot
+from batch_scheduler import recognition_scheduler
+from checkin_outbox import checkin_dispatcher
+from upload_queue import upload_queue
+from attendance_writer import attendance_writer
+from attendance_partitions import attendance_partition_manager
+from extraction_engine import in_extraction_worker
 from schemas import (
     FaceEnrollRequestSchema,
     FaceUpdateRequestSchema, 
@@ -58,6 +73,38 @@ def handle_error(error_msg, status_code=400):
         'error': error_msg
     }), status_code
 
+def get_positive_int_param(name):
+    """Read an optional positive integer from form data or query string"""
+    value = request.form.get(name, type=int)
+    if value is None:
+        value = request.args.get(name, type=int)
+    if value is not None and value <= 0:
+        raise ValueError(f'{name} must be greater than 0')
+    return value
+
+def get_margin_threshold_param():
+    """Read an optional non-negative margin threshold from form data or query string"""
+    value = request.form.get('margin_threshold', type=float)
+    if value is None:
+        value = request.args.get('margin_threshold', type=float)
+    if value is not None and value < 0:
+        raise ValueError('margin_threshold must not be negative')
+    return value
+
+def encode_log_cursor(recognized_at, log_id):
+    """Opaque keyset cursor of an attendance log row: (recognized_at, id) of the last row of a page"""
+    payload = json.dumps([recognized_at.isoformat(), log_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_log_cursor(token):
+    """(recognized_at, id) of a cursor from encode_log_cursor; ValueError if malformed"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        recognized_at, log_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return datetime.fromisoformat(recognized_at), int(log_id)
+    except (ValueError, TypeError, UnicodeError) as e:
+        raise ValueError('Invalid cursor') from e
+
 @app.errorhandler(ValidationError)
 def handle_validation_error(error):
     """Handle marshmallow validation errors"""
@@ -188,44 +235,81 @@ def recognize_face():
         # Optional device_code (from form or header)
         device_code = request.form.get('device_code') or request.headers.get('X-Device-Code')
 
+        # Optional HNSW ef_search / IVFFlat probes overrides (pgvector search mode)
+        ef_search = get_positive_int_param('ef_search')
+        probes = get_positive_int_param('probes')
+
+        # Optional top-k candidates and best-to-second-best margin threshold
+        top_k = get_positive_int_param('top_k')
+        margin_threshold = get_margin_threshold_param()
+
         # Read image data
         image_data = file.read()
         if len(image_data) == 0:
             return handle_error('Empty image file')
 
         # Recognize face (and log attendance on success)
-        result = face_service.recognize_face(image_data, device_code=device_code)
-
-        # Nếu nhận diện thành công -> gọi API check-in chấm công timesheet bên ngoài
-        if result.get("success") and result.get("employee_code"):
-            import os
-            import requests
-            CHECKIN_URL = os.environ.get("CHECKIN_URL", "https://api-ns.quannh.click/api/user-timesheet/check-in")
-
-            username = result["employee_code"]
-
-            headers = {
-                "Content-Type": "application/json"
-            }
-            payload = {"username": username}
-            try:
-                resp = requests.post(CHECKIN_URL, headers=headers, json=payload, timeout=7)
-                if resp.status_code == 200:
-                    result["checkin"] = True
-                else:
-                    result["checkin"] = False
-                    result["checkin_error"] = resp.text
-            except Exception as ex:
-                result["checkin"] = False
-                result["checkin_error"] = str(ex)
+        # Check-in chấm công timesheet được ghi vào outbox cùng attendance log, gửi ở background
+        result = face_service.recognize_face(image_data, device_code=device_code,
+                                             ef_search=ef_search, probes=probes,
+                                             top_k=top_k, margin_threshold=margin_threshold)
 
         # Return result using schema
         return jsonify(recognition_response_schema.dump(result))
 
+    except ValueError as e:
+        return handle_error(str(e), 400)
     except Exception as e:
         logger.error(f"Error in recognize_face: {str(e)}")
         return handle_error('Failed to recognize face', 500)
 
+@app.route('/api/face/recognize/batch', methods=['POST'])
+def recognize_face_batch():
+    """
+    API nhận diện nhiều ảnh trong một request (gate controller gửi nhiều frame)
+    Expects: multipart/form-data with repeated 'images' files
+    Trả về kết quả theo đúng thứ tự ảnh gửi lên
+    """
+    try:
+        files = request.files.getlist('images')
+        if not files:
+            return handle_error('No image files provided')
+
+        if len(files) > Config.BATCH_MAX_IMAGES:
+            return handle_error(f'Too many images. Maximum: {Config.BATCH_MAX_IMAGES}')
+
+        images = []
+        for file in files:
+            if file.filename == '' or not allowed_file(file.filename):
+                return handle_error(f'Invalid file: {file.filename}. Allowed: png, jpg, jpeg, gif, bmp')
+            image_data = file.read()
+            if len(image_data) == 0:
+                return handle_error(f'Empty image file: {file.filename}')
+            images.append(image_data)
+
+        device_code = request.form.get('device_code') or request.headers.get('X-Device-Code')
+        ef_search = get_positive_int_param('ef_search')
+        probes = get_positive_int_param('probes')
+        top_k = get_positive_int_param('top_k')
+        margin_threshold = get_margin_threshold_param()
+
+        # Check-in một lần cho mỗi nhân viên được nhận diện trong batch (qua outbox)
+        results = face_service.recognize_faces_batch(images, device_code=device_code,
+                                                     ef_search=ef_search, probes=probes,
+                                                     top_k=top_k, margin_threshold=margin_threshold)
+
+        return jsonify({
+            'success': True,
+            'data': recognition_response_schema.dump(results, many=True),
+            'count': len(results)
+        })
+
+    except ValueError as e:
+        return handle_error(str(e), 400)
+    except Exception as e:
+        logger.error(f"Error in recognize_face_batch: {str(e)}")
+        return handle_error('Failed to recognize faces', 500)
+
 @app.route('/api/face/embeddings', methods=['GET'])
 def get_face_embeddings():
     """
@@ -251,8 +335,9 @@ def get_face_embeddings():
 @app.route('/api/attendance/logs', methods=['GET'])
 def list_attendance_logs():
     """
-    API lấy lịch sử chấm công
-    Query params: employee_code, device_code, date_from, date_to, limit (default 100)
+    API lấy lịch sử chấm công, mới nhất trước, phân trang theo keyset (recognized_at, id)
+    Query params: employee_code, device_code, date_from, date_to, limit (default 100),
+    cursor (giá trị next_cursor của trang trước; next_cursor = null khi hết dữ liệu)
     """
     try:
         employee_code = request.args.get('employee_code')
@@ -260,22 +345,35 @@ def list_attendance_logs():
         date_from = request.args.get('date_from')  # ISO date/time
         date_to = request.args.get('date_to')
         limit = int(request.args.get('limit', 100))
+        cursor = request.args.get('cursor')
+        if limit <= 0:
+            return handle_error('limit must be greater than 0', 400)
+        try:
+            after = decode_log_cursor(cursor) if cursor else None
+        except ValueError as e:
+            return handle_error(str(e), 400)
 
         where_clauses = []
         params = []
 
         if employee_code:
-            where_clauses.append("employee_code = %s")
+            where_clauses.append("al.employee_code = %s")
             params.append(employee_code)
         if device_code:
-            where_clauses.append("device_code = %s")
+            where_clauses.append("al.device_code = %s")
             params.append(device_code)
         if date_from:
-            where_clauses.append("recognized_at >= %s")
+            where_clauses.append("al.recognized_at >= %s")
             params.append(date_from)
         if date_to:
-            where_clauses.append("recognized_at <= %s")
+            where_clauses.append("al.recognized_at <= %s")
             params.append(date_to)
+        if after:
+            # Rows strictly after the cursor in (recognized_at DESC, id DESC) order: an index range
+            # scan on idx_att_logs_time_id, so deep pages cost the same as the first one.
+            # The plain bound also prunes the monthly partitions newer than the cursor.
+            where_clauses.append("al.recognized_at <= %s AND (al.recognized_at, al.id) < (%s, %s)")
+            params.extend([after[0], after[0], after[1]])
 
         where_sql = ("WHERE " + " AND ".join(where_clauses)) if where_clauses else ""
 
@@ -285,17 +383,23 @@ def list_attendance_logs():
             FROM attendance_logs al
             LEFT JOIN employees e ON e.employee_code = al.employee_code
             {where_sql}
-            ORDER BY al.recognized_at DESC
+            ORDER BY al.recognized_at DESC, al.id DESC
             LIMIT %s
         """
-        params.append(limit)
+        # One extra row tells whether there is a next page
+        params.append(limit + 1)
 
         rows = db_manager.execute_query(query, tuple(params), fetch=True)
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_log_cursor(rows[-1]['recognized_at'], rows[-1]['id'])
 
         return jsonify({
             'success': True,
             'data': [dict(r) for r in rows],
-            'count': len(rows)
+            'count': len(rows),
+            'next_cursor': next_cursor
         })
     except Exception as e:
         logger.error(f"Error in list_attendance_logs: {str(e)}")
@@ -459,6 +563,7 @@ def check_storage_health():
             })
         
         health = minio_service.health_check()
+        health['upload_queue'] = upload_queue.stats()
         
         return jsonify({
             'success': health['status'] == 'healthy',
@@ -543,14 +648,194 @@ def delete_face_embedding_with_options(face_id):
         logger.error(f"Error in delete_face_embedding: {str(e)}")
         return handle_error('Failed to delete face embedding', 500)
 
+@app.route('/api/admin/vector-index', methods=['GET'])
+def get_vector_index_status():
+    """
+    API xem trạng thái IVFFlat index (drift, recall/latency trước và sau lần rebuild gần nhất)
+    """
+    try:
+        if Config.VECTOR_INDEX_TYPE != 'ivfflat':
+            return handle_error('IVFFlat index is not enabled (VECTOR_INDEX_TYPE)', 404)
+        
+        return jsonify({
+            'success': True,
+            'data': ivfflat_index_manager.status()
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in get_vector_index_status: {str(e)}")
+        return handle_error('Failed to get vector index status', 500)
+
+@app.route('/api/admin/vector-index/rebuild', methods=['POST'])
+def rebuild_vector_index():
+    """
+    API rebuild IVFFlat index (CREATE INDEX CONCURRENTLY + swap)
+    Body: {"force": true} để rebuild kể cả khi drift chưa vượt ngưỡng
+    """
+    try:
+        if Config.VECTOR_INDEX_TYPE != 'ivfflat':
+            return handle_error('IVFFlat index is not enabled (VECTOR_INDEX_TYPE)', 404)
+        
+        data = request.json or {}
+        report = ivfflat_index_manager.rebuild(force=bool(data.get('force', False)))
+        
+        return jsonify({
+            'success': True,
+            'data': report
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in rebuild_vector_index: {str(e)}")
+        return handle_error('Failed to rebuild vector index', 500)
+
+@app.route('/api/admin/attendance-partitions', methods=['GET'])
+def get_attendance_partitions():
+    """
+    API xem các partition theo tháng của attendance_logs (khoảng thời gian, số dòng ước tính, dung lượng) và các bảng đã archive
+    """
+    try:
+        return jsonify({
+            'success': True,
+            'data': attendance_partition_manager.status()
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in get_attendance_partitions: {str(e)}")
+        return handle_error('Failed to get attendance partitions', 500)
+
+@app.route('/api/admin/attendance-partitions/maintain', methods=['POST'])
+def maintain_attendance_partitions():
+    """
+    API chạy bảo trì partition ngay: tạo partition các tháng tới, chuyển dòng khỏi partition default,
+    detach/archive partition quá hạn lưu trữ (ATTENDANCE_RETENTION_MONTHS)
+    """
+    try:
+        return jsonify({
+            'success': True,
+            'data': attendance_partition_manager.maintain()
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in maintain_attendance_partitions: {str(e)}")
+        return handle_error('Failed to maintain attendance partitions', 500)
+
+@app.route('/api/admin/gallery', methods=['GET'])
+def get_gallery_stats():
+    """
+    API xem trạng thái gallery trong bộ nhớ (kiểu lưu trữ, số template, dung lượng)
+    """
+    try:
+        return jsonify({
+            'success': True,
+            'data': face_gallery.stats()
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in get_gallery_stats: {str(e)}")
+        return handle_error('Failed to get gallery stats', 500)
+
+@app.route('/api/admin/models', methods=['GET'])
+def get_model_pool_stats():
+    """
+    API xem trạng thái pool model MediaPipe (số bundle, thời gian chờ), process pool trích xuất embedding
+    và tỉ lệ ảnh trùng (sha256) / cache embedding được bỏ qua trích xuất
+    """
+    try:
+        return jsonify({
+            'success': True,
+            'data': {
+                'model_pool': face_service.models.stats(),
+                'extraction_engine': face_service.extraction_engine.stats(),
+                'image_dedup': image_dedup.stats(),
+                'embedding_cache': embedding_cache.stats()
+            }
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in get_model_pool_stats: {str(e)}")
+        return handle_error('Failed to get model pool stats', 500)
+
+@app.route('/api/admin/recognition-scheduler', methods=['GET'])
+def get_recognition_scheduler_stats():
+    """
+    API xem thống kê micro-batching: độ trễ p50/p99 theo kích thước batch
+    """
+    try:
+        return jsonify({
+            'success': True,
+            'data': recognition_scheduler.stats()
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in get_recognition_scheduler_stats: {str(e)}")
+        return handle_error('Failed to get recognition scheduler stats', 500)
+
+@app.route('/api/admin/db-pool', methods=['GET'])
+def get_db_pool_stats():
+    """
+    API xem trạng thái pool kết nối database: số kết nối đang dùng, số lần chờ và thời gian chờ
+    """
+    try:
+        return jsonify({
+            'success': True,
+            'data': db_manager.pool_stats()
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in get_db_pool_stats: {str(e)}")
+        return handle_error('Failed to get database pool stats', 500)
+
+@app.route('/api/admin/attendance-writer', methods=['GET'])
+def get_attendance_writer_stats():
+    """
+    API xem bộ đệm ghi attendance log: số dòng đang chờ, số lần flush, số dòng trung bình mỗi lần flush, lỗi
+    """
+    try:
+        return jsonify({
+            'success': True,
+            'data': attendance_writer.stats()
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in get_attendance_writer_stats: {str(e)}")
+        return handle_error('Failed to get attendance writer stats', 500)
+
+@app.route('/api/admin/checkin-outbox', methods=['GET'])
+def get_checkin_outbox_status():
+    """
+    API xem hàng đợi check-in timesheet: số event chờ gửi, DEAD, độ trễ gửi (lag)
+    """
+    try:
+        return jsonify({
+            'success': True,
+            'data': checkin_dispatcher.status()
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in get_checkin_outbox_status: {str(e)}")
+        return handle_error('Failed to get check-in outbox status', 500)
+
+@app.route('/api/admin/gallery/snapshot', methods=['POST'])
+def build_gallery_snapshot():
+    """
+    API ghi lại file snapshot gallery (GALLERY_SNAPSHOT_PATH) và báo các worker map lại file mới
+    """
+    try:
+        if not Config.GALLERY_SNAPSHOT_PATH:
+            return handle_error('Gallery snapshot is not enabled (GALLERY_SNAPSHOT_PATH)', 404)
+        
+        return jsonify({
+            'success': True,
+            'data': build_snapshot()
+        })
+        
+    except Exception as e:
+        logger.error(f"Error in build_gallery_snapshot: {str(e)}")
+        return handle_error('Failed to build gallery snapshot', 500)
+
 def get_or_create_employee(employee_code, full_name=None, email=None, department=None, position=None):
     # Check employee tồn tại
-    query_check = """
-                  SELECT id, employee_code, full_name
-                  FROM employees
-                  WHERE employee_code = %s \
-                  """
-    employee = db_manager.execute_one(query_check, (employee_code,))
+    employee = db_manager.execute_prepared(EMPLOYEE_BY_CODE, (employee_code,), fetch='one')
 
     if employee:
         return dict(employee), False  # existed
@@ -571,8 +856,48 @@ def get_or_create_employee(employee_code, full_name=None, email=None, department
 
     return dict(new_employee), True
 
+# Employee lookup of every enrollment (prepared once per pooled connection)
+EMPLOYEE_BY_CODE = db_manager.prepare('employee_by_code', """
+    SELECT id, employee_code, full_name
+    FROM employees
+    WHERE employee_code = %s
+""")
+
 # Database initialization moved to main block
 
+_background_started = False
+
+
+def start_background_workers():
+    """
+    Start the background threads of this server process, once, after init_database().
+    Skipped in the reloader parent of debug mode and in extraction worker processes,
+    which only import this module.
+    """
+    global _background_started
+    if _background_started or in_extraction_worker():
+        return
+    if Config.FLASK_DEBUG and not is_running_from_reloader():
+        return
+    _background_started = True
+
+    # Background IVFFlat drift check / retraining (one rebuild at a time via advisory lock)
+    if Config.VECTOR_INDEX_TYPE == 'ivfflat' and Config.IVFFLAT_AUTO_REBUILD:
+        ivfflat_index_manager.start_scheduler()
+
+    # Monthly attendance_logs partitions created ahead / retired (one worker at a time via advisory lock)
+    attendance_partition_manager.start_scheduler()
+
+    # Background delivery of queued timesheet check-ins (safe in every worker: SKIP LOCKED)
+    if Config.CHECKIN_ENABLED:
+        checkin_dispatcher.start()
+
+    # Background enrollment image uploads (replays images spooled before a restart)
+    upload_queue.start()
+
+    # Buffered attendance log writes (replays WAL segments left by a crashed worker)
+    attendance_writer.start()
+
 if __name__ == '__main__':
     # Initialize database if auto init is enabled
     if Config.AUTO_INIT_DB:
@@ -582,7 +907,9 @@ if __name__ == '__main__':
         except Exception as e:
             logger.error(f"Failed to initialize database: {e}")
             exit(1)
-    
+
+    start_background_workers()
+
     # Run the application
     app.run(
         host=Config.HOST,
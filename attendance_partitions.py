@@ -0,0 +1,277 @@
+import threading
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Tuple
+from zoneinfo import ZoneInfo
+from database import db_manager
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Advisory lock key so only one worker/host changes partitions at a time
+MAINTENANCE_LOCK_KEY = 0x4643414C  # 'FCAL'
+
+PARENT = 'attendance_logs'
+# Catches rows outside every monthly partition; maintenance moves them out
+DEFAULT_PARTITION = 'attendance_logs_default'
+# Unpartitioned attendance_logs of an existing install, renamed by init_database
+LEGACY_TABLE = 'attendance_logs_legacy'
+
+PARTITIONS_QUERY = f"""
+    SELECT c.relname AS name,
+           pg_get_expr(c.relpartbound, c.oid) = 'DEFAULT' AS is_default,
+           (regexp_match(pg_get_expr(c.relpartbound, c.oid), 'FROM \\(''([^'']+)''\\)'))[1]::timestamptz
+               AS lower_bound,
+           (regexp_match(pg_get_expr(c.relpartbound, c.oid), 'TO \\(''([^'']+)''\\)'))[1]::timestamptz
+               AS upper_bound,
+           greatest(c.reltuples, 0)::bigint AS estimated_rows,
+           pg_total_relation_size(c.oid) AS total_bytes
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = to_regclass('{PARENT}')
+    ORDER BY lower_bound NULLS FIRST
+"""
+
+Month = Tuple[int, int]
+
+
+def add_months(month: Month, count: int) -> Month:
+    index = month[0] * 12 + month[1] - 1 + count
+    return index // 12, index % 12 + 1
+
+
+class AttendancePartitionManager:
+    """
+    Monthly range partitions of attendance_logs on recognized_at.
+
+    Month boundaries are midnight of the 1st in Config.TIMEZONE. Maintenance
+    creates the partitions of the current month and the next
+    Config.ATTENDANCE_PARTITIONS_AHEAD months, moves rows that landed in the
+    default partition into their month, and detaches partitions older than
+    Config.ATTENDANCE_RETENTION_MONTHS (archived into
+    Config.ATTENDANCE_ARCHIVE_SCHEMA, or dropped). An unpartitioned table of
+    an existing install is kept as one partition covering everything before
+    the first monthly partition, and ages out like the others.
+    """
+
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._last_report: Optional[Dict[str, Any]] = None
+
+    @property
+    def timezone(self) -> ZoneInfo:
+        return ZoneInfo(Config.TIMEZONE)
+
+    def month_start(self, month: Month) -> datetime:
+        return datetime(month[0], month[1], 1, tzinfo=self.timezone)
+
+    def current_month(self) -> Month:
+        now = datetime.now(self.timezone)
+        return now.year, now.month
+
+    @staticmethod
+    def partition_name(month: Month) -> str:
+        return f"{PARENT}_y{month[0]:04d}m{month[1]:02d}"
+
+    def is_partitioned(self) -> bool:
+        result = db_manager.execute_one(
+            "SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (PARENT,)
+        )
+        return bool(result and result['relkind'] == 'p')
+
+    def partitions(self) -> List[Dict[str, Any]]:
+        return [dict(row) for row in db_manager.execute_query(PARTITIONS_QUERY, fetch=True)]
+
+    def status(self) -> Dict[str, Any]:
+        """Partitions with their bounds and sizes, retention settings and last maintenance report"""
+        partitioned = self.is_partitioned()
+        partitions = self.partitions() if partitioned else []
+        archived = db_manager.execute_query("""
+            SELECT c.relname AS name, pg_total_relation_size(c.oid) AS total_bytes
+            FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = %s AND c.relkind = 'r'
+            ORDER BY c.relname
+        """, (Config.ATTENDANCE_ARCHIVE_SCHEMA,), fetch=True)
+        for partition in partitions:
+            for key in ('lower_bound', 'upper_bound'):
+                if partition[key] is not None:
+                    partition[key] = partition[key].isoformat()
+        return {
+            'partitioned': partitioned,
+            'timezone': Config.TIMEZONE,
+            'partitions_ahead': Config.ATTENDANCE_PARTITIONS_AHEAD,
+            'retention_months': Config.ATTENDANCE_RETENTION_MONTHS,
+            'retention_action': Config.ATTENDANCE_RETENTION_ACTION,
+            'partitions': partitions,
+            'archived': [dict(row) for row in archived],
+            'last_report': self._last_report
+        }
+
+    @contextmanager
+    def _locked_cursor(self):
+        """Cursor holding the maintenance advisory lock; None if another worker holds it"""
+        with db_manager.get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT pg_try_advisory_lock(%s) AS locked", (MAINTENANCE_LOCK_KEY,))
+                locked = cursor.fetchone()['locked']
+                conn.commit()
+                if not locked:
+                    yield None
+                    return
+                try:
+                    yield cursor
+                finally:
+                    conn.rollback()
+                    cursor.execute("SELECT pg_advisory_unlock(%s)", (MAINTENANCE_LOCK_KEY,))
+                    conn.commit()
+
+    def maintain(self) -> Dict[str, Any]:
+        """Attach the legacy table, create upcoming partitions, empty the default one, apply retention"""
+        if not self.is_partitioned():
+            return {'maintained': False, 'reason': f'{PARENT} is not partitioned (run init_database)'}
+
+        with self._locked_cursor() as cursor:
+            if cursor is None:
+                return {'maintained': False, 'reason': 'Maintenance already running in another worker'}
+
+            report = {'maintained': True, 'attached_legacy': self._attach_legacy(cursor),
+                      'created': [], 'archived': [], 'dropped': []}
+
+            current = self.current_month()
+            months = {add_months(current, offset) for offset in range(Config.ATTENDANCE_PARTITIONS_AHEAD + 1)}
+            # Months whose rows fell into the default partition (no partition existed yet)
+            cursor.execute(f"""
+                SELECT DISTINCT extract(year FROM recognized_at AT TIME ZONE %s)::int AS year,
+                                extract(month FROM recognized_at AT TIME ZONE %s)::int AS month
+                FROM {DEFAULT_PARTITION}
+            """, (Config.TIMEZONE, Config.TIMEZONE))
+            months.update((row['year'], row['month']) for row in cursor.fetchall())
+            cursor.connection.commit()
+
+            partitions = self.partitions()
+            for month in sorted(months):
+                if self._create_partition(cursor, month, partitions):
+                    report['created'].append(self.partition_name(month))
+
+            if Config.ATTENDANCE_RETENTION_MONTHS > 0:
+                cutoff = self.month_start(add_months(current, -Config.ATTENDANCE_RETENTION_MONTHS))
+                for partition in self.partitions():
+                    upper = partition['upper_bound']
+                    if partition['is_default'] or upper is None or upper > cutoff:
+                        continue
+                    action = self._retire_partition(cursor, partition['name'])
+                    report[action].append(partition['name'])
+
+        self._last_report = report
+        if report['created'] or report['archived'] or report['dropped'] or report['attached_legacy']:
+            logger.info(f"Attendance partition maintenance: {report}")
+        return report
+
+    def _attach_legacy(self, cursor) -> bool:
+        """Attach the pre-partitioning table as the partition before the first month after its data"""
+        cursor.execute("SELECT to_regclass(%s) AS oid", (LEGACY_TABLE,))
+        if not cursor.fetchone()['oid']:
+            cursor.connection.commit()
+            return False
+        cursor.execute("SELECT 1 AS attached FROM pg_inherits WHERE inhrelid = to_regclass(%s)", (LEGACY_TABLE,))
+        if cursor.fetchone():
+            cursor.connection.commit()
+            return False
+
+        cursor.execute(f"SELECT max(recognized_at) AS last FROM {LEGACY_TABLE}")
+        last = cursor.fetchone()['last']
+        if last is not None:
+            last = last.astimezone(self.timezone)
+            upper = self.month_start(add_months((last.year, last.month), 1))
+        else:
+            upper = self.month_start(self.current_month())
+        # Validation scan of the legacy rows under an exclusive lock on the legacy table only
+        cursor.execute(f"ALTER TABLE {PARENT} ATTACH PARTITION {LEGACY_TABLE} FOR VALUES FROM (MINVALUE) TO (%s)",
+                       (upper,))
+        cursor.connection.commit()
+        logger.info(f"Attached {LEGACY_TABLE} as the partition of {PARENT} before {upper.isoformat()}")
+        return True
+
+    def _create_partition(self, cursor, month: Month, partitions: List[Dict[str, Any]]) -> bool:
+        """Create the partition of a month unless its range is already covered"""
+        lower = self.month_start(month)
+        upper = self.month_start(add_months(month, 1))
+        for partition in partitions:
+            if partition['is_default']:
+                continue
+            starts_before_end = partition['lower_bound'] is None or partition['lower_bound'] < upper
+            if starts_before_end and partition['upper_bound'] > lower:
+                return False
+
+        name = self.partition_name(month)
+        try:
+            cursor.execute(f"SELECT 1 AS found FROM {DEFAULT_PARTITION} "
+                           f"WHERE recognized_at >= %s AND recognized_at < %s LIMIT 1", (lower, upper))
+            if cursor.fetchone() is None:
+                cursor.execute(f"CREATE TABLE {name} PARTITION OF {PARENT} FOR VALUES FROM (%s) TO (%s)",
+                               (lower, upper))
+            else:
+                # CREATE ... PARTITION OF fails while the default partition holds rows of the range
+                cursor.execute(f"CREATE TABLE {name} (LIKE {PARENT} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+                cursor.execute(f"""
+                    WITH moved AS (
+                        DELETE FROM {DEFAULT_PARTITION}
+                        WHERE recognized_at >= %s AND recognized_at < %s
+                        RETURNING *
+                    )
+                    INSERT INTO {name} SELECT * FROM moved
+                """, (lower, upper))
+                logger.info(f"Moved {cursor.rowcount} attendance rows from {DEFAULT_PARTITION} to {name}")
+                cursor.execute(f"ALTER TABLE {PARENT} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)",
+                               (lower, upper))
+            cursor.connection.commit()
+            return True
+        except Exception as e:
+            cursor.connection.rollback()
+            logger.error(f"Failed to create attendance partition {name}: {e}")
+            return False
+
+    def _retire_partition(self, cursor, name: str) -> str:
+        """Detach a partition past retention and archive or drop it; returns the report key"""
+        cursor.execute(f"ALTER TABLE {PARENT} DETACH PARTITION {name}")
+        if Config.ATTENDANCE_RETENTION_ACTION == 'drop':
+            cursor.execute(f"DROP TABLE {name}")
+            action = 'dropped'
+        else:
+            schema = Config.ATTENDANCE_ARCHIVE_SCHEMA
+            cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {schema}")
+            cursor.execute(f"ALTER TABLE {name} SET SCHEMA {schema}")
+            action = 'archived'
+        cursor.connection.commit()
+        logger.info(f"Attendance partition {name} {action} (older than {Config.ATTENDANCE_RETENTION_MONTHS} months)")
+        return action
+
+    def maybe_maintain(self) -> Optional[Dict[str, Any]]:
+        try:
+            return self.maintain()
+        except Exception as e:
+            logger.error(f"Attendance partition maintenance failed: {e}")
+            return None
+
+    def start_scheduler(self):
+        """Run maintenance now and every Config.ATTENDANCE_PARTITION_CHECK_INTERVAL seconds"""
+        if self._thread is not None:
+            return
+
+        def run():
+            self.maybe_maintain()
+            while not self._stop_event.wait(Config.ATTENDANCE_PARTITION_CHECK_INTERVAL):
+                self.maybe_maintain()
+
+        self._thread = threading.Thread(target=run, name='attendance-partition-manager', daemon=True)
+        self._thread.start()
+
+    def stop_scheduler(self):
+        self._stop_event.set()
+        self._thread = None
+
+
+# Global attendance partition manager instance
+attendance_partition_manager = AttendancePartitionManager()
@@ -0,0 +1,410 @@
+import os
+import json
+import time
+import uuid
+import fcntl
+import atexit
+import threading
+import logging
+from collections import deque
+from datetime import datetime, timezone
+from typing import List, Optional, Dict, Any, Sequence
+import psycopg2
+import psycopg2.pool
+from database import db_manager
+from config import Config
+from checkin_outbox import with_checkin_outbox
+
+logger = logging.getLogger(__name__)
+
+# Column order of a buffered row
+COLUMNS = ('employee_code', 'recognized_at', 'device_code', 'confidence', 'distance',
+           'quality_score', 'bbox', 'image_url', 'source')
+
+# Timesheet check-ins are queued in the same statement as the rows they belong to
+INSERT_QUERY = f"INSERT INTO attendance_logs ({', '.join(COLUMNS)}) VALUES %s"
+
+
+def _is_transient(error: Exception) -> bool:
+    """Connection / pool errors: retry the whole batch later"""
+    return isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError, psycopg2.pool.PoolError))
+
+
+class _Batch:
+    """Rows cut from the buffer, with the WAL segment that holds them (None without WAL)"""
+
+    __slots__ = ('rows', 'segment', 'path', 'attempts')
+
+    def __init__(self, rows: List[tuple], segment=None):
+        self.rows = rows
+        self.segment = segment
+        # Kept apart from segment.name: a rewritten segment is renamed over the original
+        self.path = segment.name if segment is not None else None
+        self.attempts = 0
+
+
+class AttendanceWriter:
+    """
+    Buffered writer of attendance_logs rows.
+
+    write() only appends the row (recognized_at taken at recognition time) to
+    an in-memory buffer; a background thread inserts the buffer with one
+    multi-row INSERT (and one commit) every Config.ATTENDANCE_FLUSH_ROWS rows
+    or Config.ATTENDANCE_FLUSH_MS milliseconds, so recognition latency no
+    longer includes a commit. Failed flushes are retried with backoff; the
+    buffer is drained at exit. Above Config.ATTENDANCE_MAX_BUFFERED_ROWS rows
+    held in memory (database outage), new rows are dropped or write() blocks,
+    per Config.ATTENDANCE_OVERFLOW_POLICY.
+
+    With Config.ATTENDANCE_WAL_DIR set, rows are also appended to a local
+    segment file before write() returns, and segments whose rows were not
+    committed (crash, database outage at exit) are replayed on start().
+    """
+
+    def __init__(self):
+        self.wal_dir = Config.ATTENDANCE_WAL_DIR
+        self.flush_rows = Config.ATTENDANCE_FLUSH_ROWS
+        self.flush_interval = Config.ATTENDANCE_FLUSH_MS / 1000.0
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid = os.getpid()
+        self._stopping = False
+        self._rows: List[tuple] = []
+        self._first_at = 0.0
+        self._segment = None
+        self._pending: 'deque[_Batch]' = deque()
+        self._pending_rows = 0
+        self._retry_at = 0.0
+        self._written = 0
+        self._flushes = 0
+        self._failed_flushes = 0
+        self._dropped = 0
+        self._overflow_dropped = 0
+        self._replayed = 0
+        self._last_error: Optional[str] = None
+
+    @property
+    def enabled(self) -> bool:
+        return Config.ATTENDANCE_BUFFERED
+
+    def write(self, employee_code: str, device_code: Optional[str], confidence: float, distance: float,
+              quality_score: float, bbox: Optional[Sequence[int]], image_url: Optional[str] = None,
+              source: str = 'RECOGNIZE'):
+        """Buffer one attendance row"""
+        self.write_many([(employee_code, device_code, confidence, distance, quality_score, bbox, image_url, source)])
+
+    def write_many(self, rows: Sequence[tuple]):
+        """Buffer several rows: (employee_code, device_code, confidence, distance, quality_score, bbox, image_url, source)"""
+        recognized_at = datetime.now(timezone.utc)
+        buffered = [(
+            employee_code, recognized_at, device_code,
+            self._float(confidence), self._float(distance), self._float(quality_score),
+            [int(value) for value in bbox] if bbox else None, image_url, source
+        ) for employee_code, device_code, confidence, distance, quality_score, bbox, image_url, source in rows]
+
+        self._ensure_thread()
+        with self._cond:
+            if not self._make_room(len(buffered)):
+                return
+            if self.wal_dir:
+                self._append_wal(buffered)
+            first = not self._rows
+            if first:
+                self._first_at = time.monotonic()
+            self._rows.extend(buffered)
+            # Wake the flusher to arm the flush timer, or to flush a full buffer now
+            if first or len(self._rows) >= self.flush_rows:
+                self._cond.notify()
+
+    @staticmethod
+    def _float(value) -> Optional[float]:
+        return None if value is None else float(value)
+
+    def _held_rows(self) -> int:
+        return len(self._rows) + self._pending_rows
+
+    def _make_room(self, count: int) -> bool:
+        """Apply the overflow policy before buffering `count` rows (caller holds the lock)"""
+        limit = Config.ATTENDANCE_MAX_BUFFERED_ROWS
+        if limit <= 0 or self._held_rows() + count <= limit:
+            return True
+        if Config.ATTENDANCE_OVERFLOW_POLICY == 'block':
+            # Woken by every committed batch; an oversized write goes through once memory is empty
+            while self._held_rows() and self._held_rows() + count > limit and not self._stopping:
+                self._cond.wait(1.0)
+            return True
+        self._overflow_dropped += count
+        # Logged on the first overflow and then every 1000 dropped rows
+        if self._overflow_dropped == count or self._overflow_dropped // 1000 != (self._overflow_dropped - count) // 1000:
+            logger.error(f"Attendance buffer full ({self._held_rows()} rows, database unreachable?): "
+                         f"{self._overflow_dropped} rows dropped so far")
+        return False
+
+    def _append_wal(self, rows: List[tuple]):
+        """Append rows to the current WAL segment (caller holds the lock)"""
+        if self._segment is None:
+            os.makedirs(self.wal_dir, exist_ok=True)
+            path = os.path.join(self.wal_dir, f"attendance-{uuid.uuid4().hex}.wal")
+            self._segment = open(path, 'a')
+            # Held until the segment's rows are committed: replay skips locked segments
+            fcntl.flock(self._segment, fcntl.LOCK_EX)
+        for row in rows:
+            self._segment.write(self._wal_line(row))
+        self._segment.flush()
+        if Config.ATTENDANCE_WAL_FSYNC:
+            os.fsync(self._segment.fileno())
+
+    @staticmethod
+    def _wal_line(row: tuple) -> str:
+        return json.dumps([row[1].isoformat() if i == 1 else value for i, value in enumerate(row)]) + '\n'
+
+    def _rewrite_segment(self, batch: _Batch):
+        """
+        Replace a batch's WAL segment with its remaining rows, so rows already
+        committed are not replayed after a crash. The new file is locked before it
+        is renamed over the old one: replay never sees it unlocked.
+        """
+        if batch.segment is None:
+            return
+        tmp_path = f"{batch.path}.tmp"
+        segment = open(tmp_path, 'w')
+        fcntl.flock(segment, fcntl.LOCK_EX)
+        for row in batch.rows:
+            segment.write(self._wal_line(row))
+        segment.flush()
+        if Config.ATTENDANCE_WAL_FSYNC:
+            os.fsync(segment.fileno())
+        os.replace(tmp_path, batch.path)
+        batch.segment.close()
+        batch.segment = segment
+
+    def start(self):
+        """Start the flusher and replay WAL segments left by a previous process"""
+        if not self.enabled:
+            return
+        self._ensure_thread()
+        self.replay()
+
+    def replay(self) -> int:
+        """Queue the rows of unlocked WAL segments; returns the number of rows"""
+        if not self.wal_dir or not os.path.isdir(self.wal_dir):
+            return 0
+        replayed = 0
+        for name in sorted(os.listdir(self.wal_dir)):
+            if not name.endswith('.wal'):
+                continue
+            segment = open(os.path.join(self.wal_dir, name), 'r')
+            try:
+                # Locked: owned by a live writer (this or another worker process)
+                fcntl.flock(segment, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                segment.close()
+                continue
+            if os.fstat(segment.fileno()).st_nlink == 0:
+                segment.close()
+                continue
+            rows = []
+            for line in segment:
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    # Torn last line of a crashed write: that row was never acknowledged
+                    logger.warning(f"Skipping unreadable line in attendance WAL {name}")
+                    continue
+                row[1] = datetime.fromisoformat(row[1])
+                rows.append(tuple(row))
+            with self._cond:
+                self._pending.append(_Batch(rows, segment))
+                self._pending_rows += len(rows)
+                self._cond.notify()
+            replayed += len(rows)
+        if replayed:
+            with self._cond:
+                self._replayed += replayed
+            logger.info(f"Replayed {replayed} attendance rows from the WAL")
+        return replayed
+
+    def _ensure_thread(self):
+        if self._thread is None or self._pid != os.getpid():
+            with self._cond:
+                if self._thread is None or self._pid != os.getpid():
+                    # Forked child: the parent's buffer and segment are not ours
+                    self._pid = os.getpid()
+                    self._rows = []
+                    self._segment = None
+                    self._pending = deque()
+                    self._pending_rows = 0
+                    self._stopping = False
+                    self._thread = threading.Thread(target=self._run, name='attendance-writer', daemon=True)
+                    self._thread.start()
+                    atexit.register(self.drain)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopping and not self._due():
+                    self._cond.wait(self._wait_time())
+                if self._stopping:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Attendance writer error: {e}")
+
+    def _due(self) -> bool:
+        now = time.monotonic()
+        if now < self._retry_at:
+            return False
+        if self._pending:
+            return True
+        return bool(self._rows) and (len(self._rows) >= self.flush_rows
+                                     or now - self._first_at >= self.flush_interval)
+
+    def _wait_time(self) -> Optional[float]:
+        now = time.monotonic()
+        if now < self._retry_at:
+            return self._retry_at - now
+        if self._rows:
+            return max(self._first_at + self.flush_interval - now, 0.0)
+        return None
+
+    def _cut(self):
+        """Move the buffer (and its WAL segment) to the pending batches (caller holds the lock)"""
+        if self._rows:
+            self._pending.append(_Batch(self._rows, self._segment))
+            self._pending_rows += len(self._rows)
+            self._rows = []
+            self._segment = None
+
+    def flush(self) -> int:
+        """Write the buffer and all pending batches now; returns the number of rows written"""
+        written = 0
+        with self._flush_lock:
+            with self._cond:
+                self._cut()
+            while True:
+                with self._cond:
+                    if not self._pending:
+                        self._retry_at = 0.0
+                        return written
+                    batch = self._pending[0]
+                try:
+                    written += self._insert_batch(batch)
+                except Exception as e:
+                    batch.attempts += 1
+                    delay = min(2 ** (batch.attempts - 1), Config.ATTENDANCE_RETRY_BACKOFF_MAX)
+                    with self._cond:
+                        self._failed_flushes += 1
+                        self._last_error = str(e)
+                        self._retry_at = time.monotonic() + delay
+                    logger.warning(f"Attendance flush of {len(batch.rows)} rows failed "
+                                   f"(attempt {batch.attempts}, retry in {delay:.0f}s): {e}")
+                    return written
+                with self._cond:
+                    self._pending.popleft()
+                    self._pending_rows -= len(batch.rows)
+                    # Room for writers blocked by the overflow policy
+                    self._cond.notify_all()
+                self._close_segment(batch, remove=True)
+
+    def _insert_batch(self, batch: _Batch) -> int:
+        """Insert a batch in one statement; rows rejected by the database are dropped one by one"""
+        if not batch.rows:
+            return 0
+        query = with_checkin_outbox(INSERT_QUERY)
+        try:
+            db_manager.execute_values(query, batch.rows, page_size=len(batch.rows))
+            with self._cond:
+                self._written += len(batch.rows)
+                self._flushes += 1
+            return len(batch.rows)
+        except Exception as e:
+            if _is_transient(e):
+                raise
+            logger.warning(f"Attendance batch rejected ({e}), writing its rows one by one")
+
+        # e.g. an employee deleted since the recognition: isolate the offending rows
+        written = 0
+        handled = 0
+        while batch.rows:
+            try:
+                db_manager.execute_values(query, batch.rows[:1])
+                written += 1
+                with self._cond:
+                    self._written += 1
+            except Exception as row_error:
+                if _is_transient(row_error):
+                    if handled:
+                        # Committed / dropped rows must not be replayed from the segment
+                        self._rewrite_segment(batch)
+                    raise
+                logger.error(f"Dropping attendance row {batch.rows[0][:3]}: {row_error}")
+                with self._cond:
+                    self._dropped += 1
+            handled += 1
+            with self._cond:
+                batch.rows = batch.rows[1:]
+                self._pending_rows -= 1
+        with self._cond:
+            self._flushes += 1
+        return written
+
+    @staticmethod
+    def _close_segment(batch: _Batch, remove: bool):
+        if batch.segment is None:
+            return
+        if remove:
+            try:
+                os.remove(batch.path)
+            except FileNotFoundError:
+                pass
+        batch.segment.close()
+        batch.segment = None
+
+    def drain(self):
+        """Stop the flusher and write what is left (at exit)"""
+        if self._pid != os.getpid():
+            return
+        with self._cond:
+            self._stopping = True
+            self._retry_at = 0.0
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+        with self._cond:
+            left = sum(len(batch.rows) for batch in self._pending)
+            for batch in self._pending:
+                # Unlocked: the next start replays it
+                self._close_segment(batch, remove=False)
+        if left:
+            where = 'kept in the WAL for replay' if self.wal_dir else 'lost'
+            logger.error(f"{left} attendance rows could not be written at exit ({where})")
+
+    def stats(self) -> Dict[str, Any]:
+        """Buffer and flush counters of this worker"""
+        with self._cond:
+            return {
+                'enabled': self.enabled,
+                'flush_rows': self.flush_rows,
+                'flush_ms': int(self.flush_interval * 1000),
+                'wal_dir': self.wal_dir or None,
+                'buffered': len(self._rows),
+                'pending_batches': len(self._pending),
+                'pending_rows': self._pending_rows,
+                'max_buffered_rows': Config.ATTENDANCE_MAX_BUFFERED_ROWS,
+                'overflow_policy': Config.ATTENDANCE_OVERFLOW_POLICY,
+                'overflow_dropped': self._overflow_dropped,
+                'written': self._written,
+                'flushes': self._flushes,
+                'avg_rows_per_flush': round(self._written / self._flushes, 2) if self._flushes else 0.0,
+                'failed_flushes': self._failed_flushes,
+                'dropped': self._dropped,
+                'replayed': self._replayed,
+                'last_error': self._last_error
+            }
+
+
+# Global attendance writer instance
+attendance_writer = AttendanceWriter()
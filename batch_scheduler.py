@@ -0,0 +1,180 @@
+import os
+import time
+import queue
+import threading
+import logging
+from collections import deque, defaultdict
+from typing import List, Optional, Dict, Any, Tuple
+import numpy as np
+from config import Config
+from vector_search import search_employees, search_employees_batch
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingProbe:
+    """A probe waiting in the scheduler queue"""
+
+    __slots__ = ('probe', 'key', 'enqueued', 'done', 'result', 'error', 'cancelled')
+
+    def __init__(self, probe: np.ndarray, key: Tuple):
+        self.probe = probe
+        self.key = key
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.result: Optional[List[Dict[str, Any]]] = None
+        self.error: Optional[Exception] = None
+        # Set (under the scheduler lock) when the request gave up waiting
+        self.cancelled = False
+
+
+def _bucket(batch_size: int) -> int:
+    """Power-of-two bucket a batch size falls into (1, 2, 4, 8, ...)"""
+    return 1 << (batch_size - 1).bit_length()
+
+
+class MicroBatchScheduler:
+    """
+    Dynamic micro-batching of recognition searches.
+
+    Request threads enqueue their probe and block; a dispatcher thread collects
+    probes for up to Config.MICROBATCH_MAX_WAIT_MS (or Config.MICROBATCH_MAX_SIZE
+    probes), scores the whole block against the gallery in one matrix product
+    (search_employees_batch) and hands every request its own result.
+    Latency per request is recorded per batch-size bucket for tuning.
+    """
+
+    def __init__(self):
+        self._queue: 'queue.Queue[_PendingProbe]' = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid = os.getpid()
+        self._latencies: Dict[int, deque] = defaultdict(lambda: deque(maxlen=5000))
+        self._score_times: Dict[int, deque] = defaultdict(lambda: deque(maxlen=5000))
+        self._batches: Dict[int, int] = defaultdict(int)
+        self._requests: Dict[int, int] = defaultdict(int)
+        self._cancelled = 0
+
+    @property
+    def enabled(self) -> bool:
+        return Config.MICROBATCH_ENABLED
+
+    def _ensure_thread(self):
+        if self._thread is None or self._pid != os.getpid():
+            with self._lock:
+                if self._thread is None or self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                    self._pid = os.getpid()
+                    self._thread = threading.Thread(target=self._run, name='recognition-microbatch', daemon=True)
+                    self._thread.start()
+
+    def search_employees(self, probe: np.ndarray, metric: str = 'l2', k: int = 1,
+                         ef_search: Optional[int] = None, probes: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Same contract as vector_search.search_employees, batched with concurrent requests"""
+        if not self.enabled:
+            return search_employees(probe, metric=metric, k=k, ef_search=ef_search, probes=probes)
+
+        self._ensure_thread()
+        pending = _PendingProbe(np.asarray(probe, dtype=np.float32), (metric, k, ef_search, probes))
+        self._queue.put(pending)
+        if not pending.done.wait(Config.MICROBATCH_TIMEOUT):
+            with self._lock:
+                # Finished in the meantime: the result is still good
+                if not pending.done.is_set():
+                    pending.cancelled = True
+                    self._cancelled += 1
+            if pending.cancelled:
+                raise TimeoutError(f"Recognition search not scheduled within {Config.MICROBATCH_TIMEOUT}s")
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _collect(self) -> List[_PendingProbe]:
+        """Block for the first probe, then gather more until max wait or max size"""
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + Config.MICROBATCH_MAX_WAIT_MS / 1000.0
+        while len(batch) < Config.MICROBATCH_MAX_SIZE:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._dispatch(batch)
+            except Exception as e:
+                logger.error(f"Micro-batch dispatch failed: {e}")
+                for pending in batch:
+                    if not pending.done.is_set():
+                        pending.error = e
+                        pending.done.set()
+
+    def _dispatch(self, batch: List[_PendingProbe]):
+        # Requests that already timed out are not scored
+        with self._lock:
+            batch = [pending for pending in batch if not pending.cancelled]
+        if not batch:
+            return
+        started = time.perf_counter()
+        # Probes with the same search parameters share one matrix product
+        groups: Dict[Tuple, List[_PendingProbe]] = defaultdict(list)
+        for pending in batch:
+            groups[pending.key].append(pending)
+
+        for (metric, k, ef_search, probes), members in groups.items():
+            try:
+                block = np.vstack([pending.probe for pending in members])
+                results = search_employees_batch(block, metric=metric, k=k,
+                                                 ef_search=ef_search, ivfflat_probes=probes)
+                for pending, result in zip(members, results):
+                    pending.result = result
+            except Exception as e:
+                for pending in members:
+                    pending.error = e
+
+        finished = time.perf_counter()
+        bucket = _bucket(len(batch))
+        with self._lock:
+            self._batches[bucket] += 1
+            self._requests[bucket] += len(batch)
+            self._score_times[bucket].append(finished - started)
+            for pending in batch:
+                self._latencies[bucket].append(finished - pending.enqueued)
+        for pending in batch:
+            pending.done.set()
+
+    def stats(self) -> Dict[str, Any]:
+        """Request latency (enqueue -> result) and scoring time per batch-size bucket"""
+        with self._lock:
+            buckets = []
+            for bucket in sorted(self._batches):
+                latencies = np.array(self._latencies[bucket]) * 1000
+                score_times = np.array(self._score_times[bucket]) * 1000
+                buckets.append({
+                    'batch_size_max': bucket,
+                    'batches': self._batches[bucket],
+                    'requests': self._requests[bucket],
+                    'latency_ms_p50': round(float(np.percentile(latencies, 50)), 3),
+                    'latency_ms_p99': round(float(np.percentile(latencies, 99)), 3),
+                    'score_ms_p50': round(float(np.percentile(score_times, 50)), 3),
+                    'score_ms_p99': round(float(np.percentile(score_times, 99)), 3)
+                })
+            total_batches = sum(self._batches.values())
+            return {
+                'enabled': self.enabled,
+                'max_wait_ms': Config.MICROBATCH_MAX_WAIT_MS,
+                'max_batch_size': Config.MICROBATCH_MAX_SIZE,
+                'queued': self._queue.qsize(),
+                'cancelled': self._cancelled,
+                'batches': total_batches,
+                'mean_batch_size': round(sum(self._requests.values()) / total_batches, 2) if total_batches else 0.0,
+                'buckets': buckets
+            }
+
+
+# Global recognition scheduler instance
+recognition_scheduler = MicroBatchScheduler()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Benchmark: image decoding for extraction (ms / image)
+
+Compares the old decode path of the services (full PIL decode, np.array,
+then cv2.resize to the size cap) with image_decode.decode_image (JPEG DCT
+scaling via PIL draft(), EXIF orientation). Runs offline on a directory of
+images, or on synthetic 12 MP JPEGs when no directory is given.
+
+Usage: python benchmark_image_decode.py [image_dir] [max_side] [repeat]
+"""
+
+import io
+import os
+import sys
+import time
+import numpy as np
+import cv2
+from PIL import Image
+
+from image_decode import decode_image
+
+
+def _old_decode(image_data: bytes, max_side: int) -> np.ndarray:
+    """Decode path of extract_face_embedding before decode_image"""
+    image = Image.open(io.BytesIO(image_data))
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    image_rgb = np.array(image)
+    height, width = image_rgb.shape[:2]
+    if width > max_side or height > max_side:
+        scale = min(max_side / width, max_side / height)
+        image_rgb = cv2.resize(image_rgb, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+    return image_rgb
+
+
+def _synthetic_corpus(count: int = 8, size=(4000, 3000)):
+    """Smooth random photos (JPEG quality 90), similar in entropy to phone pictures"""
+    rng = np.random.default_rng(42)
+    images = []
+    for _ in range(count):
+        small = rng.integers(0, 256, size=(size[1] // 40, size[0] // 40, 3), dtype=np.uint8)
+        image = cv2.resize(small, size, interpolation=cv2.INTER_CUBIC)
+        noise = rng.normal(0, 6, size=image.shape)
+        image = np.clip(image + noise, 0, 255).astype(np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(image).save(buffer, format='JPEG', quality=90)
+        images.append(buffer.getvalue())
+    return images
+
+
+def _load_corpus(directory: str):
+    images = []
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(('.jpg', '.jpeg', '.png', '.webp')):
+            with open(os.path.join(directory, name), 'rb') as f:
+                images.append(f.read())
+    return images
+
+
+def _time_per_image(func, images, max_side: int, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for image_data in images:
+            func(image_data, max_side)
+    return (time.perf_counter() - started) / (repeat * len(images)) * 1000
+
+
+def run_benchmark(image_dir: str = None, max_side: int = 1024, repeat: int = 3):
+    images = _load_corpus(image_dir) if image_dir else _synthetic_corpus()
+    if not images:
+        print(f"❌ No images found in {image_dir}")
+        return
+
+    sizes = [Image.open(io.BytesIO(image_data)).size for image_data in images]
+    megapixels = np.mean([w * h for w, h in sizes]) / 1e6
+    print(f"🖼️  {len(images)} images, {megapixels:.1f} MP average, "
+          f"{np.mean([len(d) for d in images]) / 1024:.0f} KB average, cap {max_side} px")
+    print("=" * 60)
+
+    old_ms = _time_per_image(_old_decode, images, max_side, repeat)
+    new_ms = _time_per_image(lambda data, side: decode_image(data, side)[0], images, max_side, repeat)
+    print(f"{'full decode + resize (old)':<40} {old_ms:>8.1f} ms/image")
+    print(f"{'decode_image (DCT scaling)':<40} {new_ms:>8.1f} ms/image  (x{old_ms / new_ms:.1f})")
+
+    # Same output size; pixel difference from decoding at reduced scale
+    differences = []
+    for image_data in images:
+        old = _old_decode(image_data, max_side)
+        new = decode_image(image_data, max_side)[0]
+        if old.shape == new.shape:
+            differences.append(np.abs(old.astype(np.int16) - new.astype(np.int16)).mean())
+    if differences:
+        print(f"\nMean absolute pixel difference: {np.mean(differences):.2f} "
+              f"({len(differences)}/{len(images)} images compared; others differ by EXIF rotation)")
+
+
+if __name__ == "__main__":
+    directory = sys.argv[1] if len(sys.argv) > 1 else None
+    side = int(sys.argv[2]) if len(sys.argv) > 2 else 1024
+    repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+    run_benchmark(directory, side, repeats)
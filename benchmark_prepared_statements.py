@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark: hot queries with and without server-side preparation (ms / call)
+
+Compares the employee lookup of get_or_create_employee / recognize_face and
+the attendance insert of _log_attendance sent as plain SQL text (parsed and
+planned on every call) with PREPARE once + EXECUTE (database.StatementRegistry).
+Attendance inserts run in transactions that are rolled back, so no rows (and
+no timesheet check-ins) are left behind. Needs the configured database and at
+least one employee.
+
+Usage: python benchmark_prepared_statements.py [iterations] [employee_code]
+"""
+
+import sys
+import time
+import numpy as np
+
+from database import db_manager
+from checkin_outbox import with_checkin_outbox
+
+EMPLOYEE_LOOKUP = """
+    SELECT employee_code AS employee_id, employee_code, full_name, department, position
+    FROM employees
+    WHERE employee_code = %s
+"""
+ATTENDANCE_INSERT = with_checkin_outbox("""
+    INSERT INTO attendance_logs
+    (employee_code, device_code, confidence, distance, quality_score, bbox, recognized_at)
+    VALUES (%s, %s, %s, %s, %s, %s, now())
+""")
+
+
+def _latencies(func, iterations: int) -> np.ndarray:
+    func()  # warm-up (first PREPARE, connection checkout)
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return np.array(samples) * 1000
+
+
+def _report(name: str, samples: np.ndarray, baseline: np.ndarray = None):
+    speedup = f"  (x{np.median(baseline) / np.median(samples):.2f})" if baseline is not None else ""
+    print(f"{name:<36} p50 {np.percentile(samples, 50):7.3f} ms   p99 {np.percentile(samples, 99):7.3f} ms{speedup}")
+
+
+def _insert_rolled_back(employee_code: str, prepared: bool):
+    params = (employee_code, 'benchmark', 0.9, 0.1, 0.8, [10, 10, 100, 100])
+    with db_manager.get_connection() as conn:
+        with conn.cursor() as cursor:
+            if prepared:
+                db_manager.statements.prepare(cursor, 'benchmark_attendance_insert')
+                db_manager.statements.execute(cursor, 'benchmark_attendance_insert', params)
+            else:
+                cursor.execute(ATTENDANCE_INSERT, params)
+        conn.rollback()
+
+
+def run_benchmark(iterations: int = 2000, employee_code: str = None):
+    if employee_code is None:
+        row = db_manager.execute_one("SELECT employee_code FROM employees ORDER BY employee_code LIMIT 1")
+        if not row:
+            print("❌ No employees found. Please create an employee first.")
+            return
+        employee_code = row['employee_code']
+
+    db_manager.prepare('benchmark_employee_lookup', EMPLOYEE_LOOKUP)
+    db_manager.prepare('benchmark_attendance_insert', ATTENDANCE_INSERT)
+
+    print(f"⏱️  {iterations} calls per variant, employee {employee_code}")
+    print("=" * 80)
+
+    plain = _latencies(lambda: db_manager.execute_one(EMPLOYEE_LOOKUP, (employee_code,)), iterations)
+    prepared = _latencies(lambda: db_manager.execute_prepared('benchmark_employee_lookup', (employee_code,),
+                                                              fetch='one'), iterations)
+    _report('employee lookup (plain)', plain)
+    _report('employee lookup (prepared)', prepared, plain)
+
+    plain = _latencies(lambda: _insert_rolled_back(employee_code, prepared=False), iterations)
+    prepared = _latencies(lambda: _insert_rolled_back(employee_code, prepared=True), iterations)
+    _report('attendance insert (plain)', plain)
+    _report('attendance insert (prepared)', prepared, plain)
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    code = sys.argv[2] if len(sys.argv) > 2 else None
+    run_benchmark(count, code)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark: quantized in-memory gallery (float16 / int8) vs float32
+
+Loads the ACTIVE templates from face_embeddings, builds one gallery per storage
+mode and reports the matrix memory footprint, search latency and recall@1
+against the float32 path (with and without full-precision re-ranking).
+Probes are stored templates with gaussian noise added, so the nearest template
+is not trivially the probe itself.
+
+Usage: python benchmark_quantization.py [num_probes] [noise]
+"""
+
+import sys
+import time
+import numpy as np
+
+from config import Config
+from database import db_manager
+from gallery import FaceGallery
+
+
+def _load_rows():
+    query = """
+        SELECT fe.id, fe.employee_id, fe.vector, fe.quality_score
+        FROM face_embeddings fe
+        JOIN employees e ON fe.employee_id = e.employee_code
+        WHERE fe.status = 'ACTIVE' AND e.status = 'ACTIVE'
+    """
+    return db_manager.execute_query(query, fetch=True)
+
+
+def _build_gallery(storage: str, rows) -> FaceGallery:
+    gallery = FaceGallery(storage=storage)
+    gallery.load_rows(rows)
+    return gallery
+
+
+def _top1(gallery: FaceGallery, probes: np.ndarray, metric: str):
+    started = time.perf_counter()
+    results = gallery.search_batch(probes, metric=metric, k=1)
+    elapsed_ms = (time.perf_counter() - started) * 1000 / len(probes)
+    return [result[0]['face_id'] if result else None for result in results], elapsed_ms
+
+
+def run_benchmark(num_probes: int = 200, noise: float = 0.1):
+    rows = _load_rows()
+    if not rows:
+        print("❌ No active embeddings in face_embeddings")
+        return
+
+    metric = Config.DISTANCE_METRIC
+    vectors = np.vstack([np.asarray(row['vector'], dtype=np.float32) for row in rows])
+    rng = np.random.default_rng(42)
+    picks = rng.choice(len(vectors), size=min(num_probes, len(vectors)), replace=False)
+    # Noise relative to the per-dimension spread of the stored templates
+    probes = vectors[picks] + noise * vectors.std(axis=0) * rng.normal(size=(len(picks), vectors.shape[1]))
+    probes = probes.astype(np.float32)
+
+    print(f"📐 {len(rows)} templates, {len(probes)} probes, metric={metric}, noise={noise}")
+    print("=" * 78)
+
+    reference = _build_gallery('float32', rows)
+    reference_ids, reference_ms = _top1(reference, probes, metric)
+    reference_bytes = reference.stats()['vectors_bytes']
+    print(f"{'mode':<22} {'matrix MB':>10} {'x smaller':>10} {'ms/probe':>10} {'recall@1':>10}")
+    print(f"{'float32':<22} {reference_bytes / 1e6:>10.2f} {1.0:>10.1f} {reference_ms:>10.3f} {1.0:>10.4f}")
+
+    rerank_candidates = Config.GALLERY_RERANK_CANDIDATES
+    try:
+        for storage in ('float16', 'int8'):
+            gallery = _build_gallery(storage, rows)
+            matrix_bytes = gallery.stats()['vectors_bytes']
+            for candidates in (0, rerank_candidates or 100):
+                Config.GALLERY_RERANK_CANDIDATES = candidates
+                # Warm the full-precision cache once so latency reflects steady state
+                _top1(gallery, probes, metric)
+                ids, elapsed_ms = _top1(gallery, probes, metric)
+                recall = float(np.mean([a == b for a, b in zip(ids, reference_ids)]))
+                label = f"{storage} + rerank {candidates}" if candidates else f"{storage} (coarse)"
+                print(f"{label:<22} {matrix_bytes / 1e6:>10.2f} {reference_bytes / matrix_bytes:>10.1f} "
+                      f"{elapsed_ms:>10.3f} {recall:>10.4f}")
+    finally:
+        Config.GALLERY_RERANK_CANDIDATES = rerank_candidates
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    noise_level = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+    run_benchmark(count, noise_level)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: pgvector text decoding throughput (vectors / second)
+
+Compares the old per-row parsing used by recognize_face (eval / ast.literal_eval)
+with the psycopg2 typecaster registered in database.py (vector_codec.cast_vector).
+Runs offline, no database connection required.
+
+Usage: python benchmark_vector_decode.py [num_vectors] [dimension]
+"""
+
+import ast
+import sys
+import time
+import numpy as np
+
+from vector_codec import cast_vector, encode_vector, VectorAdapter
+
+
+def _throughput(func, values):
+    started = time.perf_counter()
+    for value in values:
+        func(value)
+    elapsed = time.perf_counter() - started
+    return len(values) / elapsed, elapsed
+
+
+def run_benchmark(num_vectors: int = 20000, dimension: int = 128):
+    rng = np.random.default_rng(42)
+    vectors = rng.normal(size=(num_vectors, dimension)).astype(np.float32)
+    # pgvector text output, as returned by the server for a vector column
+    texts = [encode_vector(v) for v in vectors]
+
+    print(f"📐 Decoding {num_vectors} vectors of dimension {dimension}")
+    print("=" * 60)
+
+    decoders = [
+        ('eval (face_service_mediapipe, old)', lambda t: np.array(eval(t), dtype=np.float32)),
+        ('ast.literal_eval (face_service, old)', lambda t: np.array(ast.literal_eval(t), dtype=np.float64)),
+        ('cast_vector (psycopg2 typecaster)', lambda t: cast_vector(t)),
+    ]
+    baseline = None
+    for name, decoder in decoders:
+        rate, elapsed = _throughput(decoder, texts)
+        baseline = baseline or rate
+        print(f"{name:<40} {rate:>12,.0f} vec/s  ({elapsed:.3f}s, x{rate / baseline:.1f})")
+
+    # Round-trip check
+    decoded = cast_vector(texts[0])
+    assert np.allclose(decoded, vectors[0]), "Decoded vector does not match the original"
+
+    print("\n📤 Encoding (insert parameters)")
+    print("=" * 60)
+    encoders = [
+        ("'[' + ','.join(map(str, ...)) + ']' (old)", lambda v: '[' + ','.join(map(str, v)) + ']'),
+        ('VectorAdapter.getquoted (psycopg2 adapter)', lambda v: VectorAdapter(v).getquoted()),
+    ]
+    for name, encoder in encoders:
+        rate, elapsed = _throughput(encoder, vectors)
+        print(f"{name:<40} {rate:>12,.0f} vec/s  ({elapsed:.3f}s)")
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    dim = int(sys.argv[2]) if len(sys.argv) > 2 else 128
+    run_benchmark(count, dim)
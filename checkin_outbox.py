@@ -0,0 +1,266 @@
+import time
+import random
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Optional, Dict, Any
+import requests
+from requests.adapters import HTTPAdapter
+from database import db_manager
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Outbox event states
+PENDING = 'PENDING'
+SENT = 'SENT'
+DEAD = 'DEAD'
+
+# Extra lease time on top of the delivery time of a whole batch
+LEASE_MARGIN_SECONDS = 30
+# How often SENT events past retention are deleted
+PRUNE_INTERVAL_SECONDS = 3600
+
+
+def with_checkin_outbox(insert_query: str) -> str:
+    """
+    Wrap an `INSERT INTO attendance_logs ...` statement (without RETURNING) so that
+    a check-in event per recognised employee is queued in the same statement,
+    i.e. in the same transaction as the attendance log.
+    """
+    if not Config.CHECKIN_ENABLED:
+        return insert_query
+    return f"""
+        WITH log AS (
+            {insert_query}
+            RETURNING id, employee_code
+        )
+        INSERT INTO checkin_outbox (attendance_log_id, employee_code, payload)
+        SELECT DISTINCT ON (employee_code) id, employee_code, json_build_object('username', employee_code)
+        FROM log
+        ORDER BY employee_code, id
+    """
+
+
+class CheckinDispatcher:
+    """
+    Background delivery of queued check-in events to the external timesheet API.
+
+    Events are claimed in batches with FOR UPDATE SKIP LOCKED (safe with several
+    workers/hosts), posted through a pooled keep-alive session and retried with
+    exponential backoff; after Config.CHECKIN_MAX_ATTEMPTS (or a permanent 4xx)
+    an event is moved to the DEAD state.
+    """
+
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._session: Optional[requests.Session] = None
+        # One POST in flight per claimed event, over the session's pooled connections
+        self._executor = ThreadPoolExecutor(max_workers=Config.CHECKIN_BATCH_SIZE, thread_name_prefix='checkin-post')
+        self._next_prune_at = 0.0
+        self._pruned = 0
+        self._lock = threading.Lock()
+        self._sent = 0
+        self._retried = 0
+        self._dead = 0
+        self._last_sent_at: Optional[float] = None
+        self._last_error: Optional[str] = None
+
+    @property
+    def session(self) -> requests.Session:
+        if self._session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=Config.CHECKIN_BATCH_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update({'Content-Type': 'application/json'})
+            self._session = session
+        return self._session
+
+    @staticmethod
+    def lease_seconds() -> float:
+        """Claim lease: long enough for a whole batch even if its POSTs ran one after another"""
+        return Config.CHECKIN_TIMEOUT * Config.CHECKIN_BATCH_SIZE + LEASE_MARGIN_SECONDS
+
+    def _claim(self) -> List[Dict[str, Any]]:
+        """Claim due events; the lease (next_attempt_at) hides them from other dispatchers"""
+        query = """
+            UPDATE checkin_outbox
+            SET attempts = attempts + 1,
+                next_attempt_at = now() + make_interval(secs => %s)
+            WHERE id IN (
+                SELECT id FROM checkin_outbox
+                WHERE status = 'PENDING' AND next_attempt_at <= now()
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, employee_code, payload, attempts
+        """
+        with db_manager.get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query, (self.lease_seconds(), Config.CHECKIN_BATCH_SIZE))
+                rows = cursor.fetchall()
+                conn.commit()
+                return rows
+
+    def _deliver(self, event: Dict[str, Any], session: Optional[requests.Session] = None) -> Optional[str]:
+        """POST one event; returns None on success, else the error"""
+        try:
+            resp = (session or self.session).post(Config.CHECKIN_URL, json=event['payload'], timeout=Config.CHECKIN_TIMEOUT)
+            if resp.status_code == 200:
+                return None
+            return f"HTTP {resp.status_code}: {resp.text[:500]}"
+        except Exception as ex:
+            return str(ex)
+
+    @staticmethod
+    def _permanent(error: str) -> bool:
+        """4xx responses other than timeout / rate limit will not succeed on retry"""
+        return error.startswith('HTTP 4') and not error.startswith(('HTTP 408', 'HTTP 429'))
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(Config.CHECKIN_BACKOFF_BASE * (2 ** (attempts - 1)), Config.CHECKIN_BACKOFF_MAX)
+        return delay * random.uniform(0.8, 1.2)
+
+    def dispatch_once(self) -> int:
+        """Deliver one batch of due events concurrently; returns the number of events processed"""
+        events = self._claim()
+        if not events:
+            return 0
+
+        session = self.session  # created here, not raced by the POST threads
+        futures = {self._executor.submit(self._deliver, event, session): event for event in events}
+        for future in as_completed(futures):
+            # Recorded as each POST finishes, so a crash mid-batch re-sends only undelivered events
+            event = futures[future]
+            error = future.result()
+            if error is None:
+                self._mark_sent(event)
+            else:
+                self._mark_failed(event, error)
+        return len(events)
+
+    def _mark_sent(self, event: Dict[str, Any]):
+        db_manager.execute_query(
+            "UPDATE checkin_outbox SET status = 'SENT', sent_at = now(), last_error = NULL WHERE id = %s",
+            (event['id'],)
+        )
+        with self._lock:
+            self._sent += 1
+            self._last_sent_at = time.time()
+
+    def _mark_failed(self, event: Dict[str, Any], error: str):
+        if event['attempts'] >= Config.CHECKIN_MAX_ATTEMPTS or self._permanent(error):
+            db_manager.execute_query(
+                "UPDATE checkin_outbox SET status = 'DEAD', last_error = %s WHERE id = %s",
+                (error, event['id'])
+            )
+            logger.error(f"Check-in for {event['employee_code']} moved to DEAD after "
+                         f"{event['attempts']} attempts: {error}")
+            with self._lock:
+                self._dead += 1
+        else:
+            db_manager.execute_query("""
+                UPDATE checkin_outbox
+                SET last_error = %s, next_attempt_at = now() + make_interval(secs => %s)
+                WHERE id = %s
+            """, (error, self._backoff(event['attempts']), event['id']))
+            with self._lock:
+                self._retried += 1
+        with self._lock:
+            self._last_error = error
+
+    def prune(self, batch_size: int = 5000) -> int:
+        """Delete SENT events older than Config.CHECKIN_SENT_RETENTION_HOURS (0 = keep); returns the count"""
+        if Config.CHECKIN_SENT_RETENTION_HOURS <= 0:
+            return 0
+        deleted = 0
+        while True:
+            # Small batches (idx_checkin_outbox_status) so row locks stay short
+            count = db_manager.execute_query("""
+                DELETE FROM checkin_outbox
+                WHERE id IN (
+                    SELECT id FROM checkin_outbox
+                    WHERE status = 'SENT' AND created_at < now() - make_interval(secs => %s)
+                    LIMIT %s
+                )
+            """, (Config.CHECKIN_SENT_RETENTION_HOURS * 3600, batch_size))
+            deleted += count
+            if count < batch_size:
+                break
+        if deleted:
+            with self._lock:
+                self._pruned += deleted
+            logger.info(f"Pruned {deleted} delivered check-in events")
+        return deleted
+
+    def start(self):
+        """Poll the outbox every Config.CHECKIN_POLL_INTERVAL seconds in a background thread"""
+        if self._thread is not None:
+            return
+
+        def run():
+            while not self._stop_event.is_set():
+                if time.monotonic() >= self._next_prune_at:
+                    self._next_prune_at = time.monotonic() + PRUNE_INTERVAL_SECONDS
+                    try:
+                        self.prune()
+                    except Exception as e:
+                        logger.error(f"Check-in outbox prune error: {e}")
+                try:
+                    # Keep draining while full batches come back
+                    if self.dispatch_once() >= Config.CHECKIN_BATCH_SIZE:
+                        continue
+                except Exception as e:
+                    logger.error(f"Check-in dispatcher error: {e}")
+                self._stop_event.wait(Config.CHECKIN_POLL_INTERVAL)
+
+        self._thread = threading.Thread(target=run, name='checkin-dispatcher', daemon=True)
+        self._thread.start()
+        logger.info(f"Check-in dispatcher started ({Config.CHECKIN_URL})")
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread = None
+
+    def status(self) -> Dict[str, Any]:
+        """Outbox backlog, dispatch lag and counters of this worker's dispatcher"""
+        result = db_manager.execute_one("""
+            SELECT
+                count(*) FILTER (WHERE status = 'PENDING') AS pending,
+                count(*) FILTER (WHERE status = 'PENDING' AND attempts > 0) AS retrying,
+                count(*) FILTER (WHERE status = 'DEAD') AS dead,
+                count(*) FILTER (WHERE status = 'SENT' AND sent_at > now() - interval '1 hour') AS sent_last_hour,
+                EXTRACT(EPOCH FROM now() - min(created_at) FILTER (WHERE status = 'PENDING')) AS lag_seconds,
+                EXTRACT(EPOCH FROM avg(sent_at - created_at)
+                        FILTER (WHERE status = 'SENT' AND sent_at > now() - interval '1 hour')) AS delivery_seconds_avg
+            FROM checkin_outbox
+        """)
+        with self._lock:
+            return {
+                'enabled': Config.CHECKIN_ENABLED,
+                'pending': result['pending'],
+                'retrying': result['retrying'],
+                'dead': result['dead'],
+                'sent_last_hour': result['sent_last_hour'],
+                'lag_seconds': round(float(result['lag_seconds']), 3) if result['lag_seconds'] is not None else 0.0,
+                'delivery_seconds_avg': round(float(result['delivery_seconds_avg']), 3)
+                if result['delivery_seconds_avg'] is not None else None,
+                'lease_seconds': self.lease_seconds(),
+                'sent_retention_hours': Config.CHECKIN_SENT_RETENTION_HOURS,
+                'dispatcher': {
+                    'running': self._thread is not None,
+                    'pruned': self._pruned,
+                    'sent': self._sent,
+                    'retried': self._retried,
+                    'dead': self._dead,
+                    'last_sent_at': self._last_sent_at,
+                    'last_error': self._last_error
+                }
+            }
+
+
+# Global check-in dispatcher instance
+checkin_dispatcher = CheckinDispatcher()
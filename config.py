@@ -23,6 +23,74 @@ class Config:
     DISTANCE_METRIC = os.environ.get('DISTANCE_METRIC') or 'l2'
     EMBEDDING_DIMENSION = 128
     
+    # Face Gallery Configuration (in-memory embedding matrix)
+    GALLERY_LISTEN_ENABLED = os.environ.get('GALLERY_LISTEN_ENABLED', 'True').lower() in ['true', '1', 'yes']
+    GALLERY_NOTIFY_CHANNEL = os.environ.get('GALLERY_NOTIFY_CHANNEL') or 'face_gallery_changes'
+    GALLERY_LISTEN_RETRY_SECONDS = float(os.environ.get('GALLERY_LISTEN_RETRY_SECONDS') or 5)
+    # Two-stage search: score per-employee centroids, then compare templates of the top M employees
+    # (approximate: off by default, see config.env.example)
+    GALLERY_CENTROID_PREFILTER = os.environ.get('GALLERY_CENTROID_PREFILTER', 'False').lower() in ['true', '1', 'yes']
+    GALLERY_CENTROID_SHORTLIST = int(os.environ.get('GALLERY_CENTROID_SHORTLIST') or 50)
+    GALLERY_PREFILTER_MIN_TEMPLATES = int(os.environ.get('GALLERY_PREFILTER_MIN_TEMPLATES') or 5000)
+    # Gallery matrix storage: float32, float16 or int8 (per-dimension scale)
+    GALLERY_STORAGE = os.environ.get('GALLERY_STORAGE', 'float32').lower()
+    # Quantized storage: candidates re-ranked against full-precision vectors (0 = no re-ranking)
+    GALLERY_RERANK_CANDIDATES = int(os.environ.get('GALLERY_RERANK_CANDIDATES') or 100)
+    GALLERY_RERANK_CACHE_SIZE = int(os.environ.get('GALLERY_RERANK_CACHE_SIZE') or 20000)
+    # Memory-mapped gallery snapshot shared by the workers of a host (empty = load from the database)
+    GALLERY_SNAPSHOT_PATH = os.environ.get('GALLERY_SNAPSHOT_PATH', '')
+    GALLERY_SNAPSHOT_HEADROOM = float(os.environ.get('GALLERY_SNAPSHOT_HEADROOM') or 0.1)
+    
+    # Vector Search Configuration
+    # 'memory' = in-process gallery, 'pgvector' = server-side ORDER BY vector <-> probe
+    VECTOR_SEARCH_MODE = os.environ.get('VECTOR_SEARCH_MODE') or 'memory'
+    # Index on face_embeddings.vector; only pgvector search reads it, so none by default in memory mode
+    VECTOR_INDEX_TYPE = os.environ.get('VECTOR_INDEX_TYPE') or ('hnsw' if VECTOR_SEARCH_MODE == 'pgvector' else 'none')
+    HNSW_M = int(os.environ.get('HNSW_M') or 16)
+    HNSW_EF_CONSTRUCTION = int(os.environ.get('HNSW_EF_CONSTRUCTION') or 64)
+    HNSW_EF_SEARCH = int(os.environ.get('HNSW_EF_SEARCH') or 40)
+    IVFFLAT_PROBES = int(os.environ.get('IVFFLAT_PROBES') or 10)
+    IVFFLAT_REBUILD_GROWTH = float(os.environ.get('IVFFLAT_REBUILD_GROWTH') or 0.5)
+    IVFFLAT_AUTO_REBUILD = os.environ.get('IVFFLAT_AUTO_REBUILD', 'True').lower() in ['true', '1', 'yes']
+    IVFFLAT_CHECK_INTERVAL_SECONDS = int(os.environ.get('IVFFLAT_CHECK_INTERVAL_SECONDS') or 3600)
+    IVFFLAT_MEASURE_SAMPLE = int(os.environ.get('IVFFLAT_MEASURE_SAMPLE') or 50)
+    
+    # Recognition Candidates Configuration
+    RECOGNITION_TOP_K = int(os.environ.get('RECOGNITION_TOP_K') or 1)
+    # Minimum distance gap between best and second-best employee (0 = disabled)
+    RECOGNITION_MARGIN_THRESHOLD = float(os.environ.get('RECOGNITION_MARGIN_THRESHOLD') or 0.0)
+    PGVECTOR_EMPLOYEE_OVERFETCH = int(os.environ.get('PGVECTOR_EMPLOYEE_OVERFETCH') or 4)
+    
+    # Batch Recognition Configuration
+    BATCH_MAX_IMAGES = int(os.environ.get('BATCH_MAX_IMAGES') or 16)
+    BATCH_EXTRACT_WORKERS = int(os.environ.get('BATCH_EXTRACT_WORKERS') or os.cpu_count() or 4)
+    
+    # MediaPipe Model Pool Configuration (detector/face mesh bundles per worker process)
+    MEDIAPIPE_POOL_SIZE = int(os.environ.get('MEDIAPIPE_POOL_SIZE') or os.cpu_count() or 4)
+    MEDIAPIPE_POOL_TIMEOUT = float(os.environ.get('MEDIAPIPE_POOL_TIMEOUT') or 30)
+    
+    # Extraction Process Pool Configuration (0 processes = extract in the request thread)
+    EXTRACTION_PROCESSES = int(os.environ.get('EXTRACTION_PROCESSES') or 0)
+    EXTRACTION_QUEUE_DEPTH = int(os.environ.get('EXTRACTION_QUEUE_DEPTH') or 64)
+    EXTRACTION_TIMEOUT = float(os.environ.get('EXTRACTION_TIMEOUT') or 30)
+    
+    # Recognition Micro-batching Configuration (concurrent searches scored in one matrix product)
+    MICROBATCH_ENABLED = os.environ.get('MICROBATCH_ENABLED', 'False').lower() in ['true', '1', 'yes']
+    MICROBATCH_MAX_WAIT_MS = float(os.environ.get('MICROBATCH_MAX_WAIT_MS') or 2)
+    MICROBATCH_MAX_SIZE = int(os.environ.get('MICROBATCH_MAX_SIZE') or 64)
+    MICROBATCH_TIMEOUT = float(os.environ.get('MICROBATCH_TIMEOUT') or 10)
+    
+    # Timesheet Check-in Configuration (outbox + background dispatcher)
+    CHECKIN_URL = os.environ.get('CHECKIN_URL', 'https://api-ns.quannh.click/api/user-timesheet/check-in')
+    CHECKIN_ENABLED = bool(CHECKIN_URL) and os.environ.get('CHECKIN_ENABLED', 'True').lower() in ['true', '1', 'yes']
+    CHECKIN_TIMEOUT = float(os.environ.get('CHECKIN_TIMEOUT') or 7)
+    CHECKIN_BATCH_SIZE = int(os.environ.get('CHECKIN_BATCH_SIZE') or 20)
+    CHECKIN_POLL_INTERVAL = float(os.environ.get('CHECKIN_POLL_INTERVAL') or 1)
+    CHECKIN_MAX_ATTEMPTS = int(os.environ.get('CHECKIN_MAX_ATTEMPTS') or 8)
+    CHECKIN_BACKOFF_BASE = float(os.environ.get('CHECKIN_BACKOFF_BASE') or 2)
+    CHECKIN_BACKOFF_MAX = float(os.environ.get('CHECKIN_BACKOFF_MAX') or 600)
+    CHECKIN_SENT_RETENTION_HOURS = float(os.environ.get('CHECKIN_SENT_RETENTION_HOURS') or 168)
+    
     # Server Configuration
     HOST = os.environ.get('HOST') or '0.0.0.0'
     PORT = int(os.environ.get('PORT') or 5555)
@@ -36,6 +104,10 @@ class Config:
     # Database Performance Tuning
     DB_POOL_MIN_CONN = int(os.environ.get('DB_POOL_MIN_CONN') or 1)
     DB_POOL_MAX_CONN = int(os.environ.get('DB_POOL_MAX_CONN') or 20)
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT') or 10)
+    DB_POOL_MAX_LIFETIME = float(os.environ.get('DB_POOL_MAX_LIFETIME') or 1800)
+    DB_POOL_CHECK_INTERVAL = float(os.environ.get('DB_POOL_CHECK_INTERVAL') or 30)
+    DB_PREPARED_STATEMENTS = os.environ.get('DB_PREPARED_STATEMENTS', 'True').lower() in ['true', '1', 'yes']
     
     # MinIO Configuration
     MINIO_ENDPOINT = os.environ.get('MINIO_ENDPOINT') or '160.191.245.38:9000'
@@ -49,6 +121,48 @@ class Config:
     STORE_ORIGINAL_IMAGES = os.environ.get('STORE_ORIGINAL_IMAGES', 'True').lower() in ['true', '1', 'yes']
     IMAGE_RETENTION_DAYS = int(os.environ.get('IMAGE_RETENTION_DAYS') or 365)
     
+    # Two-resolution Extraction Configuration (detect on a proxy, embed on the face crop)
+    DETECTION_PROXY_SIZE = int(os.environ.get('DETECTION_PROXY_SIZE') or 320)
+    DETECTION_FALLBACK_SIZE = int(os.environ.get('DETECTION_FALLBACK_SIZE') or 640)
+    FACE_CROP_PADDING = float(os.environ.get('FACE_CROP_PADDING') or 0.5)
+    
+    # Image Dedup Configuration (sha256 of the raw upload, checked before extraction)
+    IMAGE_DEDUP_ENABLED = os.environ.get('IMAGE_DEDUP_ENABLED', 'True').lower() in ['true', '1', 'yes']
+    
+    # Embedding Cache Configuration (memory | redis | none)
+    EMBEDDING_CACHE_BACKEND = (os.environ.get('EMBEDDING_CACHE_BACKEND') or 'memory').lower()
+    EMBEDDING_CACHE_TTL = float(os.environ.get('EMBEDDING_CACHE_TTL') or 300)
+    EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get('EMBEDDING_CACHE_MAX_ENTRIES') or 10000)
+    EMBEDDING_CACHE_REDIS_URL = os.environ.get('EMBEDDING_CACHE_REDIS_URL') or 'redis://localhost:6379/0'
+    
+    # Background Image Upload Configuration
+    UPLOAD_ASYNC = os.environ.get('UPLOAD_ASYNC', 'True').lower() in ['true', '1', 'yes']
+    UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS') or 2)
+    UPLOAD_SPOOL_DIR = os.environ.get('UPLOAD_SPOOL_DIR') or 'upload_spool'
+    UPLOAD_MEMORY_LIMIT_MB = float(os.environ.get('UPLOAD_MEMORY_LIMIT_MB') or 64)
+    UPLOAD_MAX_ATTEMPTS = int(os.environ.get('UPLOAD_MAX_ATTEMPTS') or 5)
+    UPLOAD_BACKOFF_BASE = float(os.environ.get('UPLOAD_BACKOFF_BASE') or 2)
+    UPLOAD_BACKOFF_MAX = float(os.environ.get('UPLOAD_BACKOFF_MAX') or 300)
+    UPLOAD_REPLAY_MIN_AGE = float(os.environ.get('UPLOAD_REPLAY_MIN_AGE') or 60)
+    
+    # Buffered Attendance Log Writer (multi-row INSERT every N rows or T ms, optional local WAL)
+    ATTENDANCE_BUFFERED = os.environ.get('ATTENDANCE_BUFFERED', 'True').lower() in ['true', '1', 'yes']
+    ATTENDANCE_FLUSH_ROWS = int(os.environ.get('ATTENDANCE_FLUSH_ROWS') or 200)
+    ATTENDANCE_FLUSH_MS = float(os.environ.get('ATTENDANCE_FLUSH_MS') or 200)
+    ATTENDANCE_WAL_DIR = os.environ.get('ATTENDANCE_WAL_DIR', 'attendance_wal')
+    ATTENDANCE_WAL_FSYNC = os.environ.get('ATTENDANCE_WAL_FSYNC', 'False').lower() in ['true', '1', 'yes']
+    ATTENDANCE_RETRY_BACKOFF_MAX = float(os.environ.get('ATTENDANCE_RETRY_BACKOFF_MAX') or 30)
+    # Rows held in memory (buffer + failed batches) before ATTENDANCE_OVERFLOW_POLICY applies
+    ATTENDANCE_MAX_BUFFERED_ROWS = int(os.environ.get('ATTENDANCE_MAX_BUFFERED_ROWS') or 100000)
+    ATTENDANCE_OVERFLOW_POLICY = (os.environ.get('ATTENDANCE_OVERFLOW_POLICY') or 'drop').lower()
+    
+    # Attendance Log Partitioning (monthly partitions on recognized_at, boundaries in TIMEZONE)
+    ATTENDANCE_PARTITIONS_AHEAD = int(os.environ.get('ATTENDANCE_PARTITIONS_AHEAD') or 3)
+    ATTENDANCE_RETENTION_MONTHS = int(os.environ.get('ATTENDANCE_RETENTION_MONTHS') or 0)
+    ATTENDANCE_RETENTION_ACTION = (os.environ.get('ATTENDANCE_RETENTION_ACTION') or 'archive').lower()
+    ATTENDANCE_ARCHIVE_SCHEMA = os.environ.get('ATTENDANCE_ARCHIVE_SCHEMA') or 'attendance_archive'
+    ATTENDANCE_PARTITION_CHECK_INTERVAL = int(os.environ.get('ATTENDANCE_PARTITION_CHECK_INTERVAL') or 3600)
+    
     # Additional Configuration
     AUTO_INIT_DB = os.environ.get('AUTO_INIT_DB', 'True').lower() in ['true', '1', 'yes']
     TIMEZONE = os.environ.get('TIMEZONE') or 'UTC'
@@ -0,0 +1,73 @@
+"""
+Shared fixtures of the pytest suite (python -m pytest -q).
+
+Tests that need PostgreSQL with pgvector run against TEST_DATABASE_URL and are
+skipped when it is not set. init_database() is applied to that database and its
+tables are emptied before every test: never point it at a real database.
+"""
+
+import os
+import numpy as np
+import pytest
+from config import Config
+
+# Manual scripts against a running API / remote services, not pytest tests
+collect_ignore = ['test_api.py', 'test_connection.py', 'test_accuracy.py']
+
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL')
+
+TABLES = ('checkin_outbox', 'attendance_logs', 'face_embeddings', 'employees')
+
+
+@pytest.fixture(scope='session')
+def database_url():
+    """TEST_DATABASE_URL, for tests that open their own connections"""
+    if not TEST_DATABASE_URL:
+        pytest.skip('TEST_DATABASE_URL is not set')
+    return TEST_DATABASE_URL
+
+
+@pytest.fixture(scope='session')
+def database():
+    """db_manager connected to TEST_DATABASE_URL, schema initialised once per run"""
+    if not TEST_DATABASE_URL:
+        pytest.skip('TEST_DATABASE_URL is not set')
+    from database import db_manager, init_database
+    Config.DATABASE_URL = TEST_DATABASE_URL
+    db_manager.close_all_connections()
+    db_manager._pool = None
+    init_database()
+    yield db_manager
+    db_manager.close_all_connections()
+
+
+@pytest.fixture
+def db(database):
+    """Empty tables for one test"""
+    database.execute_query(f"TRUNCATE {', '.join(TABLES)} RESTART IDENTITY CASCADE")
+    return database
+
+
+@pytest.fixture
+def enroll(db):
+    """Insert an (ACTIVE) employee if needed and one embedding; returns the face id"""
+    def insert(employee_code: str, vector, quality_score: float = 0.5) -> int:
+        db.execute_query("""
+            INSERT INTO employees (employee_code, full_name) VALUES (%s, %s)
+            ON CONFLICT (employee_code) DO NOTHING
+        """, (employee_code, employee_code))
+        row = db.execute_one("""
+            INSERT INTO face_embeddings (employee_id, vector, quality_score, sha256)
+            VALUES (%s, %s, %s, %s) RETURNING id
+        """, (employee_code, np.asarray(vector, dtype=np.float32).tolist(), quality_score, '0' * 64))
+        return row['id']
+    return insert
+
+
+@pytest.fixture
+def client():
+    """Flask test client of the API (background workers are not started)"""
+    from app import app
+    app.config['TESTING'] = True
+    with app.test_client() as test_client:
+        yield test_client
@@ -1,47 +1,312 @@
+import time
+import threading
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg2.errors
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.extensions import register_adapter, register_type, new_type, TRANSACTION_STATUS_IDLE
 import psycopg2.pool
+import numpy as np
 from contextlib import contextmanager
+from typing import List, Dict, Any, Tuple, Optional
 import logging
 from config import Config
+from vector_codec import cast_vector, VectorAdapter
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+class PreparedConnection(psycopg2.extensions.connection):
+    """Connection that remembers which registered statements it has PREPAREd"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+class StatementRegistry:
+    """
+    Hot statements, PREPAREd once per pooled connection and run with EXECUTE,
+    so PostgreSQL parses and plans them once per connection instead of per call.
+    Statements are written with psycopg2 %s placeholders.
+    """
+
+    def __init__(self):
+        self._statements: Dict[str, Tuple[str, str]] = {}
+
+    def register(self, name: str, query: str) -> str:
+        """Register `query` under `name` (a valid SQL identifier); returns the name"""
+        parts = query.split('%s')
+        server_query = parts[0] + ''.join(f"${index}{part}" for index, part in enumerate(parts[1:], 1))
+        self._statements[name] = (query, server_query)
+        return name
+
+    def query(self, name: str) -> str:
+        """Original (%s) text of a statement"""
+        return self._statements[name][0]
+
+    def prepare(self, cursor, name: str):
+        """PREPARE the statement on the cursor's connection unless it already is"""
+        prepared = cursor.connection.prepared
+        if name not in prepared:
+            cursor.execute(f"PREPARE {name} AS {self._statements[name][1]}")
+            prepared.add(name)
+
+    @staticmethod
+    def execute(cursor, name: str, params: Tuple = ()):
+        cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})" if params else f"EXECUTE {name}",
+                       params)
+
+
+class PoolTimeout(psycopg2.pool.PoolError):
+    """No connection became available within the pool timeout"""
+
+
+class ConnectionPool:
+    """
+    Thread-safe psycopg2 connection pool.
+
+    Requests wait (up to `timeout` seconds) for a free connection instead of
+    failing when all `maxconn` connections are checked out. Connections idle
+    for longer than `check_interval` are validated with a round trip before
+    being handed out, connections older than `max_lifetime` are replaced, and
+    broken ones are discarded. Checkouts, wait time and usage are counted.
+    """
+
+    def __init__(self, minconn: int, maxconn: int, dsn: str, timeout: float = 30.0,
+                 max_lifetime: float = 3600.0, check_interval: float = 30.0, **kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.dsn = dsn
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.check_interval = check_interval
+        self.kwargs = kwargs
+        self.closed = False
+        self._cond = threading.Condition()
+        # Idle connections, most recently used last: (connection, created_at, last_used)
+        self._idle: List[Tuple[Any, float, float]] = []
+        self._created_at: Dict[int, float] = {}
+        # Connections being opened (counted against maxconn)
+        self._pending = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_seconds = 0.0
+        self._wait_seconds_max = 0.0
+        self._timeouts = 0
+        self._opened = 0
+        self._recycled = 0
+        self._discarded = 0
+        for _ in range(minconn):
+            conn = self._connect()
+            self._idle.append((conn, self._created_at[id(conn)], time.monotonic()))
+
+    @property
+    def size(self) -> int:
+        return len(self._created_at) + self._pending
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, **self.kwargs)
+        with self._cond:
+            self._created_at[id(conn)] = time.monotonic()
+            self._opened += 1
+        return conn
+
+    def _close(self, conn):
+        self._created_at.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _usable(self, conn, created_at: float, last_used: float) -> bool:
+        """Liveness / lifetime check of an idle connection (called without the lock)"""
+        now = time.monotonic()
+        if conn.closed:
+            return False
+        if self.max_lifetime and now - created_at > self.max_lifetime:
+            with self._cond:
+                self._recycled += 1
+            return False
+        if now - last_used > self.check_interval:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                conn.rollback()
+            except Exception as e:
+                logger.warning(f"Discarding dead database connection: {e}")
+                with self._cond:
+                    self._discarded += 1
+                return False
+        return True
+
+    def getconn(self):
+        """Check out a connection, waiting up to `timeout` seconds for one to be free"""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+        while True:
+            with self._cond:
+                if self.closed:
+                    raise psycopg2.pool.PoolError("connection pool is closed")
+                while not self._idle and self.size >= self.maxconn:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(f"No database connection available within {self.timeout}s "
+                                          f"({self.maxconn} in use)")
+                    waited = True
+                    self._cond.wait(remaining)
+                if self._idle:
+                    conn, created_at, last_used = self._idle.pop()
+                else:
+                    # Reserve the slot; the connection is opened outside the lock
+                    conn = None
+                    self._pending += 1
+
+            if conn is None:
+                try:
+                    conn = self._connect()
+                finally:
+                    with self._cond:
+                        self._pending -= 1
+                        self._cond.notify()
+            elif not self._usable(conn, created_at, last_used):
+                with self._cond:
+                    self._close(conn)
+                    self._cond.notify()
+                continue
+
+            elapsed = time.monotonic() - started
+            with self._cond:
+                self._checkouts += 1
+                if waited:
+                    self._waits += 1
+                    self._wait_seconds += elapsed
+                    self._wait_seconds_max = max(self._wait_seconds_max, elapsed)
+            return conn
+
+    def putconn(self, conn, close: bool = False):
+        """Return a connection; broken, expired or explicitly closed ones are dropped"""
+        if not close and not conn.closed:
+            try:
+                if conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                close = True
+        with self._cond:
+            created_at = self._created_at.get(id(conn), 0.0)
+            expired = self.max_lifetime and time.monotonic() - created_at > self.max_lifetime
+            if close or conn.closed or expired or self.closed:
+                if expired and not close:
+                    self._recycled += 1
+                self._close(conn)
+            else:
+                self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            self.closed = True
+            for conn, _, _ in self._idle:
+                self._close(conn)
+            self._idle = []
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            idle = len(self._idle)
+            return {
+                'min_connections': self.minconn,
+                'max_connections': self.maxconn,
+                'open': self.size,
+                'idle': idle,
+                'in_use': self.size - idle,
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'wait_seconds_avg': round(self._wait_seconds / self._waits, 4) if self._waits else 0.0,
+                'wait_seconds_max': round(self._wait_seconds_max, 4),
+                'timeouts': self._timeouts,
+                'opened': self._opened,
+                'recycled': self._recycled,
+                'discarded': self._discarded,
+                'timeout_seconds': self.timeout,
+                'max_lifetime_seconds': self.max_lifetime
+            }
+
+
 class DatabaseManager:
     def __init__(self):
-        self.connection_pool = None
-        self.init_pool()
+        self._pool: Optional[ConnectionPool] = None
+        self._pool_lock = threading.Lock()
+        self.statements = StatementRegistry()
+    
+    @property
+    def connection_pool(self) -> ConnectionPool:
+        """The pool, opened on first use (importing a module never connects)"""
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self.init_pool()
+        return self._pool
     
     def init_pool(self):
         """Initialize connection pool"""
         try:
-            self.connection_pool = psycopg2.pool.SimpleConnectionPool(
+            self._pool = ConnectionPool(
                 Config.DB_POOL_MIN_CONN, Config.DB_POOL_MAX_CONN,
                 Config.DATABASE_URL,
+                timeout=Config.DB_POOL_TIMEOUT,
+                max_lifetime=Config.DB_POOL_MAX_LIFETIME,
+                check_interval=Config.DB_POOL_CHECK_INTERVAL,
+                connection_factory=PreparedConnection,
                 cursor_factory=RealDictCursor
             )
             logger.info(f"Database connection pool initialized (min: {Config.DB_POOL_MIN_CONN}, max: {Config.DB_POOL_MAX_CONN})")
         except Exception as e:
             logger.error(f"Error initializing database pool: {e}")
             raise
+        
+        try:
+            self.register_vector_type()
+        except Exception as e:
+            logger.warning(f"Could not register pgvector type adapter: {e}")
+    
+    def register_vector_type(self) -> bool:
+        """
+        Decode pgvector columns directly into float32 numpy arrays and
+        encode numpy arrays as vector parameters (no eval/literal_eval)
+        """
+        register_adapter(np.ndarray, VectorAdapter)
+        result = self.execute_one("SELECT to_regtype('vector')::oid AS oid")
+        if not result or not result['oid']:
+            logger.warning("pgvector extension not installed yet, vector typecaster not registered")
+            return False
+        register_type(new_type((result['oid'],), 'VECTOR', cast_vector))
+        return True
     
     @contextmanager
     def get_connection(self):
-        """Get connection from pool"""
+        """Get connection from pool (waits up to Config.DB_POOL_TIMEOUT for a free one)"""
         conn = None
+        broken = False
         try:
             conn = self.connection_pool.getconn()
             yield conn
         except Exception as e:
             if conn:
-                conn.rollback()
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+            if isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError)):
+                broken = True
             logger.error(f"Database error: {e}")
             raise
         finally:
             if conn:
-                self.connection_pool.putconn(conn)
+                self.connection_pool.putconn(conn, close=broken)
     
     def execute_query(self, query, params=None, fetch=False):
         """Execute query with connection from pool"""
@@ -62,10 +327,69 @@ class DatabaseManager:
                 conn.commit()
                 return result
     
+    def execute_values(self, query, rows, template=None, page_size=100):
+        """Execute a multi-row INSERT (VALUES %s) in one statement and commit"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cursor:
+                execute_values(cursor, query, rows, template=template, page_size=page_size)
+                conn.commit()
+                return cursor.rowcount
+    
+    def execute_with_settings(self, query, params=None, settings=None):
+        """Execute a read query with transaction-local settings (SET LOCAL)"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cursor:
+                for name, value in (settings or {}).items():
+                    cursor.execute("SELECT set_config(%s, %s, true)", (name, str(value)))
+                cursor.execute(query, params)
+                result = cursor.fetchall()
+                conn.commit()
+                return result
+    
+    def prepare(self, name: str, query: str) -> str:
+        """Register a hot statement (%s placeholders) for execute_prepared; returns its name"""
+        return self.statements.register(name, query)
+    
+    def execute_prepared(self, name: str, params=(), fetch: Optional[str] = None):
+        """
+        Execute a registered statement via PREPARE / EXECUTE and commit
+        fetch: None (returns rowcount), 'one' or 'all'
+        """
+        if not Config.DB_PREPARED_STATEMENTS:
+            query = self.statements.query(name)
+            if fetch == 'one':
+                return self.execute_one(query, params)
+            return self.execute_query(query, params, fetch=fetch == 'all')
+        
+        params = tuple(params)
+        with self.get_connection() as conn:
+            with conn.cursor() as cursor:
+                try:
+                    self.statements.prepare(cursor, name)
+                    self.statements.execute(cursor, name, params)
+                except psycopg2.errors.InvalidSqlStatementName:
+                    # Deallocated behind our back (DISCARD ALL, pooler): prepare again
+                    conn.rollback()
+                    conn.prepared.clear()
+                    self.statements.prepare(cursor, name)
+                    self.statements.execute(cursor, name, params)
+                if fetch == 'one':
+                    result = cursor.fetchone()
+                elif fetch == 'all':
+                    result = cursor.fetchall()
+                else:
+                    result = cursor.rowcount
+                conn.commit()
+                return result
+    
+    def pool_stats(self) -> Dict[str, Any]:
+        """Connection pool usage: checkouts, wait time, in-use connections"""
+        return self.connection_pool.stats()
+    
     def close_all_connections(self):
         """Close all connections in pool"""
-        if self.connection_pool:
-            self.connection_pool.closeall()
+        if self._pool:
+            self._pool.closeall()
             logger.info("All database connections closed")
 
 # Global database manager instance
@@ -136,10 +460,62 @@ def init_database():
         "CREATE INDEX IF NOT EXISTS idx_face_embeddings_sha256 ON face_embeddings(sha256);",
         "CREATE INDEX IF NOT EXISTS idx_employees_code ON employees(employee_code);",
         
-        # Attendance logs table to record recognition events (check-in/out history)
+        # An unpartitioned attendance_logs (existing install) is renamed out of the way;
+        # attendance_partition_manager attaches it back as the oldest partition. Until it is
+        # attached, its key is made the parent's (id, recognized_at) and its id sequence is
+        # handed over to the partitioned table, so new ids continue after the old ones.
+        """
+        DO $$
+        DECLARE
+            id_sequence text;
+            pkey text;
+            pkey_columns text[];
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_class WHERE oid = to_regclass('attendance_logs') AND relkind = 'r') THEN
+                ALTER TABLE attendance_logs RENAME TO attendance_logs_legacy;
+                ALTER INDEX IF EXISTS idx_att_logs_emp_time RENAME TO idx_att_logs_legacy_emp_time;
+                ALTER INDEX IF EXISTS idx_att_logs_device_time RENAME TO idx_att_logs_legacy_device_time;
+            END IF;
+
+            IF to_regclass('attendance_logs_legacy') IS NULL
+               OR EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass('attendance_logs_legacy')) THEN
+                RETURN;
+            END IF;
+
+            SELECT c.conname, array_agg(a.attname::text ORDER BY a.attname) INTO pkey, pkey_columns
+            FROM pg_constraint c
+            JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = ANY(c.conkey)
+            WHERE c.conrelid = 'attendance_logs_legacy'::regclass AND c.contype = 'p'
+            GROUP BY c.conname;
+            IF pkey_columns IS DISTINCT FROM ARRAY['id', 'recognized_at'] THEN
+                IF pkey IS NOT NULL THEN
+                    EXECUTE format('ALTER TABLE attendance_logs_legacy DROP CONSTRAINT %I', pkey);
+                END IF;
+                ALTER TABLE attendance_logs_legacy
+                    ADD CONSTRAINT attendance_logs_legacy_pkey PRIMARY KEY (id, recognized_at);
+            END IF;
+
+            id_sequence := pg_get_serial_sequence('attendance_logs_legacy', 'id');
+            ALTER TABLE attendance_logs_legacy ALTER COLUMN id DROP DEFAULT;
+            IF id_sequence IS NOT NULL THEN
+                EXECUTE format('ALTER SEQUENCE %s OWNED BY NONE', id_sequence);
+                IF to_regclass('attendance_logs_id_seq') IS NULL THEN
+                    EXECUTE format('ALTER SEQUENCE %s RENAME TO attendance_logs_id_seq', id_sequence);
+                END IF;
+            END IF;
+            CREATE SEQUENCE IF NOT EXISTS attendance_logs_id_seq;
+            PERFORM setval('attendance_logs_id_seq', max(id)) FROM attendance_logs_legacy
+            HAVING max(id) > (SELECT CASE WHEN is_called THEN last_value ELSE last_value - 1 END
+                              FROM attendance_logs_id_seq);
+        END $$;
+        """,
+        
+        # Attendance logs table to record recognition events (check-in/out history),
+        # range-partitioned by month on recognized_at (partitions managed by attendance_partitions)
+        "CREATE SEQUENCE IF NOT EXISTS attendance_logs_id_seq;",
         """
         CREATE TABLE IF NOT EXISTS attendance_logs (
-            id BIGSERIAL PRIMARY KEY,
+            id BIGINT NOT NULL DEFAULT nextval('attendance_logs_id_seq'),
             employee_code VARCHAR(50) NOT NULL REFERENCES employees(employee_code) ON DELETE CASCADE,
             recognized_at TIMESTAMPTZ NOT NULL DEFAULT now(),
             device_code VARCHAR(64),
@@ -148,17 +524,123 @@ def init_database():
             quality_score REAL,
             bbox INT4[4],
             image_url TEXT,
-            source VARCHAR(32) DEFAULT 'RECOGNIZE' NOT NULL
-        );
+            source VARCHAR(32) DEFAULT 'RECOGNIZE' NOT NULL,
+            PRIMARY KEY (id, recognized_at)
+        ) PARTITION BY RANGE (recognized_at);
         """,
+        "ALTER SEQUENCE attendance_logs_id_seq OWNED BY attendance_logs.id;",
+        "CREATE TABLE IF NOT EXISTS attendance_logs_default PARTITION OF attendance_logs DEFAULT;",
         "CREATE INDEX IF NOT EXISTS idx_att_logs_emp_time ON attendance_logs(employee_code, recognized_at);",
         "CREATE INDEX IF NOT EXISTS idx_att_logs_device_time ON attendance_logs(device_code, recognized_at);",
+        # Keyset pagination of /api/attendance/logs: ORDER BY recognized_at DESC, id DESC
+        "CREATE INDEX IF NOT EXISTS idx_att_logs_time_id ON attendance_logs(recognized_at, id);",
+        
+        # Outbox of check-in events for the external timesheet API (written with the attendance log)
+        """
+        CREATE TABLE IF NOT EXISTS checkin_outbox (
+            id BIGSERIAL PRIMARY KEY,
+            attendance_log_id BIGINT,
+            employee_code VARCHAR(50) NOT NULL,
+            payload JSONB NOT NULL,
+            status VARCHAR(16) NOT NULL DEFAULT 'PENDING',
+            attempts INT NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            last_error TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            sent_at TIMESTAMPTZ
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_checkin_outbox_due ON checkin_outbox(next_attempt_at) WHERE status = 'PENDING';",
+        "CREATE INDEX IF NOT EXISTS idx_checkin_outbox_status ON checkin_outbox(status, created_at);",
+        
+        # Build metadata for trained vector indexes (IVFFlat drift tracking)
+        """
+        CREATE TABLE IF NOT EXISTS vector_index_state (
+            index_name VARCHAR(128) PRIMARY KEY,
+            index_type VARCHAR(16) NOT NULL,
+            lists INT,
+            rows_at_build BIGINT NOT NULL,
+            built_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            report JSONB
+        );
+        """,
+        
+        # Notify face gallery listeners about row-level changes (payload carries the row id)
+        f"""
+        CREATE OR REPLACE FUNCTION notify_face_embedding_change() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                PERFORM pg_notify('{Config.GALLERY_NOTIFY_CHANNEL}', json_build_object(
+                    'table', 'face_embeddings', 'op', TG_OP, 'id', OLD.id, 'employee_code', OLD.employee_id)::text);
+                RETURN OLD;
+            END IF;
+            PERFORM pg_notify('{Config.GALLERY_NOTIFY_CHANNEL}', json_build_object(
+                'table', 'face_embeddings', 'op', TG_OP, 'id', NEW.id, 'employee_code', NEW.employee_id)::text);
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+        """,
+        "DROP TRIGGER IF EXISTS trg_face_embeddings_notify ON face_embeddings;",
+        """
+        CREATE TRIGGER trg_face_embeddings_notify
+        AFTER INSERT OR DELETE OR UPDATE OF vector, status, employee_id, quality_score ON face_embeddings
+        FOR EACH ROW EXECUTE FUNCTION notify_face_embedding_change();
+        """,
+        f"""
+        CREATE OR REPLACE FUNCTION notify_employee_status_change() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('{Config.GALLERY_NOTIFY_CHANNEL}', json_build_object(
+                'table', 'employees', 'op', TG_OP, 'id', NEW.id,
+                'employee_code', NEW.employee_code, 'status', NEW.status)::text);
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+        """,
+        "DROP TRIGGER IF EXISTS trg_employees_status_notify ON employees;",
+        """
+        CREATE TRIGGER trg_employees_status_notify
+        AFTER UPDATE OF status ON employees
+        FOR EACH ROW WHEN (OLD.status IS DISTINCT FROM NEW.status)
+        EXECUTE FUNCTION notify_employee_status_change();
+        """,
     ]
     
+    init_queries.extend(vector_index_queries())
+    
     try:
         for query in init_queries:
             db_manager.execute_query(query)
+        
+        # Monthly attendance_logs partitions (and the pre-partitioning table as the oldest one)
+        from attendance_partitions import attendance_partition_manager
+        attendance_partition_manager.maintain()
+        
+        if Config.VECTOR_INDEX_TYPE == 'ivfflat':
+            # lists is derived from the row count, so the index is built by the manager
+            from index_manager import ivfflat_index_manager
+            ivfflat_index_manager.ensure_index()
+        
+        # The vector type may only exist now that the extension was created
+        db_manager.register_vector_type()
         logger.info("Database initialized successfully")
     except Exception as e:
         logger.error(f"Error initializing database: {e}")
-        raise 
\ No newline at end of file
+        raise 
+
+VECTOR_OPCLASSES = {
+    'l2': 'vector_l2_ops',
+    'cosine': 'vector_cosine_ops'
+}
+
+def vector_index_queries():
+    """Index on face_embeddings.vector matching Config.DISTANCE_METRIC / VECTOR_INDEX_TYPE"""
+    opclass = VECTOR_OPCLASSES.get(Config.DISTANCE_METRIC, 'vector_l2_ops')
+    if Config.VECTOR_INDEX_TYPE == 'hnsw':
+        return [
+            f"""
+            CREATE INDEX IF NOT EXISTS idx_face_embeddings_vector_hnsw
+            ON face_embeddings USING hnsw (vector {opclass})
+            WITH (m = {int(Config.HNSW_M)}, ef_construction = {int(Config.HNSW_EF_CONSTRUCTION)});
+            """
+        ]
+    return []
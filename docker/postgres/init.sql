@@ -49,9 +49,11 @@ CREATE TABLE IF NOT EXISTS face_embeddings (
     created_at TIMESTAMPTZ NOT NULL DEFAULT now()
 );
 
--- Create attendance_logs table
+-- Create attendance_logs table, range-partitioned by month on recognized_at
+-- (monthly partitions are created ahead and retired by the application's partition maintenance)
+CREATE SEQUENCE IF NOT EXISTS attendance_logs_id_seq;
 CREATE TABLE IF NOT EXISTS attendance_logs (
-    id BIGSERIAL PRIMARY KEY,
+    id BIGINT NOT NULL DEFAULT nextval('attendance_logs_id_seq'),
     employee_code VARCHAR(50) NOT NULL REFERENCES employees(employee_code) ON DELETE CASCADE,
     recognized_at TIMESTAMPTZ NOT NULL DEFAULT now(),
     device_code VARCHAR(64),
@@ -60,8 +62,12 @@ CREATE TABLE IF NOT EXISTS attendance_logs (
     quality_score REAL,
     bbox INT4[4],
     image_url TEXT,
-    source VARCHAR(32) DEFAULT 'RECOGNIZE' NOT NULL
-);
+    source VARCHAR(32) DEFAULT 'RECOGNIZE' NOT NULL,
+    PRIMARY KEY (id, recognized_at)
+) PARTITION BY RANGE (recognized_at);
+ALTER SEQUENCE attendance_logs_id_seq OWNED BY attendance_logs.id;
+-- Rows outside every monthly partition; maintenance moves them into their month
+CREATE TABLE IF NOT EXISTS attendance_logs_default PARTITION OF attendance_logs DEFAULT;
 
 -- Create indexes
 CREATE INDEX IF NOT EXISTS idx_face_embeddings_employee_id ON face_embeddings(employee_id);
@@ -70,6 +76,58 @@ CREATE INDEX IF NOT EXISTS idx_face_embeddings_sha256 ON face_embeddings(sha256)
 CREATE INDEX IF NOT EXISTS idx_employees_code ON employees(employee_code);
 CREATE INDEX IF NOT EXISTS idx_att_logs_emp_time ON attendance_logs(employee_code, recognized_at);
 CREATE INDEX IF NOT EXISTS idx_att_logs_device_time ON attendance_logs(device_code, recognized_at);
+-- Keyset pagination of /api/attendance/logs: ORDER BY recognized_at DESC, id DESC
+CREATE INDEX IF NOT EXISTS idx_att_logs_time_id ON attendance_logs(recognized_at, id);
+
+-- Outbox of check-in events for the external timesheet API (written with the attendance log)
+CREATE TABLE IF NOT EXISTS checkin_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    attendance_log_id BIGINT,
+    employee_code VARCHAR(50) NOT NULL,
+    payload JSONB NOT NULL,
+    status VARCHAR(16) NOT NULL DEFAULT 'PENDING',
+    attempts INT NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    last_error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    sent_at TIMESTAMPTZ
+);
+CREATE INDEX IF NOT EXISTS idx_checkin_outbox_due ON checkin_outbox(next_attempt_at) WHERE status = 'PENDING';
+CREATE INDEX IF NOT EXISTS idx_checkin_outbox_status ON checkin_outbox(status, created_at);
+
+-- Notify face gallery listeners about row-level changes (payload carries the row id)
+CREATE OR REPLACE FUNCTION notify_face_embedding_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('face_gallery_changes', json_build_object(
+            'table', 'face_embeddings', 'op', TG_OP, 'id', OLD.id, 'employee_code', OLD.employee_id)::text);
+        RETURN OLD;
+    END IF;
+    PERFORM pg_notify('face_gallery_changes', json_build_object(
+        'table', 'face_embeddings', 'op', TG_OP, 'id', NEW.id, 'employee_code', NEW.employee_id)::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_face_embeddings_notify ON face_embeddings;
+CREATE TRIGGER trg_face_embeddings_notify
+AFTER INSERT OR DELETE OR UPDATE OF vector, status, employee_id, quality_score ON face_embeddings
+FOR EACH ROW EXECUTE FUNCTION notify_face_embedding_change();
+
+CREATE OR REPLACE FUNCTION notify_employee_status_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('face_gallery_changes', json_build_object(
+        'table', 'employees', 'op', TG_OP, 'id', NEW.id,
+        'employee_code', NEW.employee_code, 'status', NEW.status)::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_employees_status_notify ON employees;
+CREATE TRIGGER trg_employees_status_notify
+AFTER UPDATE OF status ON employees
+FOR EACH ROW WHEN (OLD.status IS DISTINCT FROM NEW.status)
+EXECUTE FUNCTION notify_employee_status_change();
 
 -- Log initialization
 DO $$
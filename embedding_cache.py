@@ -0,0 +1,260 @@
+import json
+import time
+import threading
+import logging
+from collections import OrderedDict
+from typing import List, Optional, Dict, Any, Tuple, Callable
+import numpy as np
+from config import Config
+from image_dedup import image_sha256
+
+logger = logging.getLogger(__name__)
+
+# (embedding_vector, bbox, quality_score) as returned by extract_face_embedding
+Extraction = Tuple[Optional[np.ndarray], Optional[Dict], float]
+
+
+class CacheEntry:
+    """A cached extraction, with the model that produced it and what it cost to compute"""
+
+    __slots__ = ('embedding', 'bbox', 'quality_score', 'model_name', 'model_version', 'seconds', 'expires_at')
+
+    def __init__(self, embedding: np.ndarray, bbox: Optional[Dict], quality_score: float,
+                 model_name: str, model_version: str, seconds: float, expires_at: float):
+        self.embedding = embedding
+        self.bbox = bbox
+        self.quality_score = quality_score
+        self.model_name = model_name
+        self.model_version = model_version
+        self.seconds = seconds
+        self.expires_at = expires_at
+
+    def encode(self) -> bytes:
+        """Serialized form for external backends: JSON header line + float32 vector bytes"""
+        header = {
+            'bbox': self.bbox,
+            'quality_score': self.quality_score,
+            'model_name': self.model_name,
+            'model_version': self.model_version,
+            'seconds': self.seconds,
+            'expires_at': self.expires_at
+        }
+        return json.dumps(header).encode('utf-8') + b'\n' + self.embedding.astype(np.float32).tobytes()
+
+    @classmethod
+    def decode(cls, data: bytes) -> 'CacheEntry':
+        header, vector = data.split(b'\n', 1)
+        header = json.loads(header)
+        return cls(np.frombuffer(vector, dtype=np.float32).copy(), **header)
+
+
+class MemoryCacheBackend:
+    """In-process LRU dict bounded to Config.EMBEDDING_CACHE_MAX_ENTRIES"""
+
+    name = 'memory'
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, CacheEntry]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: CacheEntry, ttl: float):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = len(self._entries)
+            dimension = next(iter(self._entries.values())).embedding.size if entries else 0
+            return {
+                'entries': entries,
+                'max_entries': self.max_entries,
+                'evictions': self.evictions,
+                'vectors_bytes': entries * dimension * 4
+            }
+
+
+class RedisCacheBackend:
+    """
+    Redis-compatible server (Redis, Valkey, KeyDB, ...) shared by all workers.
+    Expiry uses the server TTL; the memory bound and LRU eviction come from the
+    server's maxmemory / maxmemory-policy (allkeys-lru).
+    """
+
+    name = 'redis'
+
+    def __init__(self, url: str):
+        import redis
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        data = self.client.get(key)
+        return CacheEntry.decode(data) if data is not None else None
+
+    def set(self, key: str, entry: CacheEntry, ttl: float):
+        self.client.set(key, entry.encode(), ex=max(int(ttl), 1))
+
+    def delete(self, key: str):
+        self.client.delete(key)
+
+    def stats(self) -> Dict[str, Any]:
+        info = self.client.info('memory')
+        return {
+            'used_memory_bytes': info.get('used_memory'),
+            'maxmemory_bytes': info.get('maxmemory'),
+            'maxmemory_policy': info.get('maxmemory_policy')
+        }
+
+
+def _create_backend():
+    backend = Config.EMBEDDING_CACHE_BACKEND
+    if backend == 'redis':
+        try:
+            return RedisCacheBackend(Config.EMBEDDING_CACHE_REDIS_URL)
+        except Exception as e:
+            logger.error(f"Redis embedding cache unavailable ({e}), using the in-process cache")
+    elif backend != 'memory':
+        return None
+    return MemoryCacheBackend(Config.EMBEDDING_CACHE_MAX_ENTRIES)
+
+
+class EmbeddingCache:
+    """
+    Cache of extraction results keyed by the sha256 of the raw image.
+
+    Kiosk retries, double taps and gateway replays resend identical bytes;
+    their (embedding, bbox, quality_score) is served from the cache instead of
+    being extracted again. Keys and entries carry Config.FACE_MODEL_NAME /
+    FACE_MODEL_VERSION, so a model change never serves old vectors. Entries
+    expire after Config.EMBEDDING_CACHE_TTL seconds. Images without a face are
+    not cached (the miss may come from a transient error).
+    """
+
+    def __init__(self):
+        self.ttl = Config.EMBEDDING_CACHE_TTL
+        self.backend = _create_backend()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._expired = 0
+        self._errors = 0
+        self._saved_seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    @staticmethod
+    def _key(sha256: str) -> str:
+        return f"embedding:{Config.FACE_MODEL_NAME}:{Config.FACE_MODEL_VERSION}:{sha256}"
+
+    def get(self, sha256: str) -> Optional[Extraction]:
+        """Cached extraction for this image, or None"""
+        key = self._key(sha256)
+        try:
+            entry = self.backend.get(key)
+        except Exception as e:
+            with self._lock:
+                self._errors += 1
+            logger.warning(f"Embedding cache read failed: {e}")
+            return None
+
+        expired = entry is not None and entry.expires_at <= time.time()
+        stale = entry is not None and (entry.model_name, entry.model_version) != \
+            (Config.FACE_MODEL_NAME, Config.FACE_MODEL_VERSION)
+        if expired or stale:
+            try:
+                self.backend.delete(key)
+            except Exception:
+                pass
+            entry = None
+        with self._lock:
+            if entry is None:
+                self._misses += 1
+                self._expired += int(expired)
+                return None
+            self._hits += 1
+            self._saved_seconds += entry.seconds
+        return entry.embedding.copy(), entry.bbox, entry.quality_score
+
+    def put(self, sha256: str, result: Extraction, seconds: float):
+        """Cache an extraction that took `seconds` to compute"""
+        embedding, bbox, quality_score = result
+        if embedding is None:
+            return
+        # Copied: the caller keeps (and may modify) the array it was handed on the miss
+        entry = CacheEntry(np.array(embedding, dtype=np.float32), bbox, float(quality_score),
+                           Config.FACE_MODEL_NAME, Config.FACE_MODEL_VERSION, seconds, time.time() + self.ttl)
+        try:
+            self.backend.set(self._key(sha256), entry, self.ttl)
+        except Exception as e:
+            with self._lock:
+                self._errors += 1
+            logger.warning(f"Embedding cache write failed: {e}")
+
+    def get_or_extract(self, image_data: bytes, extract: Callable[[bytes], Extraction]) -> Extraction:
+        """extract(image_data), served from the cache when the same image was extracted recently"""
+        return self.get_or_extract_many([image_data], lambda images: [extract(images[0])])[0]
+
+    def get_or_extract_many(self, images: List[bytes],
+                            extract_many: Callable[[List[bytes]], List[Extraction]]) -> List[Extraction]:
+        """extract_many(images) for the cache misses only; results in order"""
+        if not self.enabled:
+            return extract_many(images)
+
+        hashes = [image_sha256(image_data) for image_data in images]
+        results: List[Optional[Extraction]] = [self.get(sha256) for sha256 in hashes]
+        missing = [index for index, result in enumerate(results) if result is None]
+        if missing:
+            started = time.perf_counter()
+            extracted = extract_many([images[index] for index in missing])
+            seconds = (time.perf_counter() - started) / len(missing)
+            for index, result in zip(missing, extracted):
+                results[index] = result
+                self.put(hashes[index], result, seconds)
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit rate and extraction time saved by this worker's cache"""
+        backend_stats = {}
+        if self.enabled:
+            try:
+                backend_stats = self.backend.stats()
+            except Exception as e:
+                backend_stats = {'error': str(e)}
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'enabled': self.enabled,
+                'backend': self.backend.name if self.enabled else None,
+                'model_name': Config.FACE_MODEL_NAME,
+                'model_version': Config.FACE_MODEL_VERSION,
+                'ttl_seconds': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'expired': self._expired,
+                'errors': self._errors,
+                'hit_rate': round(self._hits / lookups, 4) if lookups else 0.0,
+                'saved_cpu_seconds': round(self._saved_seconds, 3),
+                **backend_stats
+            }
+
+
+# Global embedding cache instance
+embedding_cache = EmbeddingCache()
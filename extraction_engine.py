@@ -0,0 +1,225 @@
+import os
+import time
+import atexit
+import importlib
+import threading
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future, TimeoutError as FutureTimeout, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import List, Tuple, Optional, Dict, Any
+import numpy as np
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Face service of a child process (set by _init_worker)
+_service = None
+
+
+class ExtractionUnavailable(RuntimeError):
+    """Extraction queue is full or the extraction did not finish in time"""
+
+
+# Config of a child process: it only extracts (the parent caches and owns the process pool),
+# one extraction at a time, so one model bundle and no pre-opened DB connections
+WORKER_CONFIG = {
+    'EXTRACTION_PROCESSES': 0,
+    'EMBEDDING_CACHE_BACKEND': 'none',
+    'DB_POOL_MIN_CONN': 0,
+    'MEDIAPIPE_POOL_SIZE': 1
+}
+
+
+def in_extraction_worker() -> bool:
+    """Whether this process is a (spawned) child of an extraction pool"""
+    return multiprocessing.parent_process() is not None
+
+
+def _init_worker(module_name: str, overrides: Dict[str, Any]):
+    """Child initializer: import the face service once, so its models are loaded once per child"""
+    global _service
+    # Config was evaluated when this module was unpickled (and the service module may
+    # already be imported through the parent's __main__): set the attributes themselves.
+    # _extract_shared calls the local extractor, so the engine and the cache of an
+    # already-built service are bypassed either way.
+    for name, value in overrides.items():
+        setattr(Config, name, value)
+    _service = importlib.import_module(module_name).face_service
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """Attach to a parent's shared memory block without taking ownership of it"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13: spawned children share the parent's resource tracker,
+        # which already tracks the block; the parent unlinks it
+        return shared_memory.SharedMemory(name=name)
+
+
+def _started() -> int:
+    """Child no-op task: returns once the initializer (model loading) has run"""
+    return os.getpid()
+
+
+def _extract_shared(name: str, size: int):
+    """Child task: read the image bytes from shared memory and extract the embedding"""
+    shm = _attach(name)
+    try:
+        image_data = bytes(shm.buf[:size])
+    finally:
+        shm.close()
+    return _service._extract_local(image_data)
+
+
+class ExtractionEngine:
+    """
+    Process pool for CPU-bound embedding extraction.
+
+    Each child imports `module_name` (face_service or face_service_mediapipe)
+    once and reuses its models; image bytes are handed over through shared
+    memory. Request threads submit and wait for the result, so throughput
+    scales with cores instead of one interpreter's GIL. Disabled when
+    Config.EXTRACTION_PROCESSES is 0 (extraction runs in the request thread).
+    """
+
+    def __init__(self, module_name: str):
+        self.module_name = module_name
+        self.processes = Config.EXTRACTION_PROCESSES
+        self.queue_depth = Config.EXTRACTION_QUEUE_DEPTH
+        self.timeout = Config.EXTRACTION_TIMEOUT
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._failed = 0
+        self._timeouts = 0
+        self._rejected = 0
+        self._requests = 0
+        self._seconds_total = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.processes > 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    # spawn: children must not inherit the parent's threads, DB connections or graphs
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.processes,
+                        mp_context=multiprocessing.get_context('spawn'),
+                        initializer=_init_worker,
+                        initargs=(self.module_name, WORKER_CONFIG)
+                    )
+                    self._pid = os.getpid()
+                    # Spawned pools start children on demand, one per submit while none is idle:
+                    # one no-op per worker starts them all, so the models load before the first peak
+                    wait([self._executor.submit(_started) for _ in range(self.processes)])
+                    atexit.register(self._executor.shutdown, wait=False, cancel_futures=True)
+                    logger.info(f"Extraction engine started: {self.processes} processes ({self.module_name})")
+        return self._executor
+
+    def _reserve(self, count: int):
+        with self._lock:
+            if self._in_flight + count > self.processes + self.queue_depth:
+                self._rejected += count
+                raise ExtractionUnavailable(f"Extraction queue full ({self._in_flight} in flight)")
+            self._in_flight += count
+
+    def _submit(self, image_data: bytes) -> Tuple[Future, shared_memory.SharedMemory]:
+        shm = shared_memory.SharedMemory(create=True, size=max(len(image_data), 1))
+        shm.buf[:len(image_data)] = image_data
+        try:
+            return self._get_executor().submit(_extract_shared, shm.name, len(image_data)), shm
+        except Exception:
+            shm.close()
+            shm.unlink()
+            raise
+
+    def _wait(self, future: Future, shm: shared_memory.SharedMemory, deadline: float):
+        try:
+            return future.result(timeout=max(deadline - time.monotonic(), 0))
+        except FutureTimeout:
+            # concurrent.futures.TimeoutError: only an alias of the builtin from Python 3.11
+            future.cancel()
+            with self._lock:
+                self._timeouts += 1
+            raise ExtractionUnavailable(f"Extraction timed out after {self.timeout}s")
+        except BrokenProcessPool:
+            # A child died (e.g. OOM killed): start a fresh pool on the next submit
+            with self._lock:
+                self._failed += 1
+                self._executor = None
+            raise
+        except Exception:
+            with self._lock:
+                self._failed += 1
+            raise
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            shm.close()
+            shm.unlink()
+
+    def extract(self, image_data: bytes) -> Tuple[Optional[np.ndarray], Optional[Dict], float]:
+        """Extract one embedding in a child process: (embedding_vector, bbox, quality_score)"""
+        return self.extract_many([image_data])[0]
+
+    def extract_many(self, images: List[bytes]) -> List[Tuple[Optional[np.ndarray], Optional[Dict], float]]:
+        """Extract several embeddings in parallel child processes, in order"""
+        self._reserve(len(images))
+        started = time.monotonic()
+        submitted = []
+        try:
+            for image_data in images:
+                submitted.append(self._submit(image_data))
+        except Exception:
+            with self._lock:
+                self._in_flight -= len(images) - len(submitted)
+            for future, shm in submitted:
+                try:
+                    self._wait(future, shm, started + self.timeout)
+                except Exception:
+                    pass
+            raise
+
+        deadline = started + self.timeout
+        results = []
+        error = None
+        for future, shm in submitted:
+            # Wait for every task, so every shared memory block is released
+            try:
+                results.append(self._wait(future, shm, deadline))
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
+        with self._lock:
+            self._completed += len(images)
+            self._requests += 1
+            self._seconds_total += time.monotonic() - started
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            busy = min(self._in_flight, self.processes)
+            return {
+                'enabled': self.enabled,
+                'module': self.module_name,
+                'processes': self.processes,
+                'max_queue_depth': self.queue_depth,
+                'timeout_seconds': self.timeout,
+                'in_flight': self._in_flight,
+                'queue_depth': max(self._in_flight - self.processes, 0),
+                'utilization': round(busy / self.processes, 3) if self.processes else 0.0,
+                'completed': self._completed,
+                'failed': self._failed,
+                'timeouts': self._timeouts,
+                'rejected': self._rejected,
+                'request_seconds_avg': round(self._seconds_total / self._requests, 4) if self._requests else 0.0
+            }
@@ -1,53 +1,72 @@
 import face_recognition
 import numpy as np
-import cv2
-from PIL import Image
-import io
-import hashlib
 import logging
 from typing import List, Tuple, Optional, Dict, Any
 from database import db_manager
 from config import Config
+from image_decode import decode_image, detection_proxy
+from extraction_engine import ExtractionEngine
 from minio_service import minio_service
+from upload_queue import upload_queue
+from gallery import face_gallery
+from image_dedup import image_dedup, image_sha256
+from embedding_cache import embedding_cache
+from batch_scheduler import recognition_scheduler
+from checkin_outbox import with_checkin_outbox
+from attendance_writer import attendance_writer
 
 logger = logging.getLogger(__name__)
 
+# Hot statements of recognize_face, prepared once per pooled connection
+RECOGNIZED_EMPLOYEE = db_manager.prepare('recognized_employee', """
+    SELECT employee_code AS employee_id, employee_code, full_name, department, position
+    FROM employees
+    WHERE employee_code = %s
+""")
+ATTENDANCE_INSERT = db_manager.prepare('attendance_insert', with_checkin_outbox("""
+    INSERT INTO attendance_logs (
+        employee_code, recognized_at, device_code, confidence, distance, quality_score, bbox, image_url, source
+    ) VALUES (%s, now(), %s, %s, %s, %s, %s, %s, %s)
+"""))
+
 class FaceService:
+    # Layout of the stored bbox array (INT4[4])
+    BBOX_KEYS = ('top', 'right', 'bottom', 'left')
+
     def __init__(self):
         self.tolerance = Config.FACE_RECOGNITION_TOLERANCE
         self.model_name = Config.FACE_MODEL_NAME
         self.model_version = Config.FACE_MODEL_VERSION
         self.distance_metric = Config.DISTANCE_METRIC
+        # Extraction in child processes when Config.EXTRACTION_PROCESSES > 0
+        self.extraction_engine = ExtractionEngine(__name__)
     
 
     def extract_face_embedding(self, image_data: bytes) -> Tuple[Optional[np.ndarray], Optional[Dict], float]:
         """
         Extract face embedding from image with improved quality assessment
+        Repeated images are served from the embedding cache
         Returns: (embedding_vector, bbox, quality_score)
         """
+        return embedding_cache.get_or_extract(image_data, self._extract_uncached)
+
+    def _extract_uncached(self, image_data: bytes) -> Tuple[Optional[np.ndarray], Optional[Dict], float]:
+        """Extract in a child process, or in this thread"""
+        if self.extraction_engine.enabled:
+            return self.extraction_engine.extract(image_data)
+        return self._extract_local(image_data)
+
+    def _extract_local(self, image_data: bytes) -> Tuple[Optional[np.ndarray], Optional[Dict], float]:
+        """Extract in this process (also what extraction worker processes run)"""
         try:
-            # Load image
-            image = Image.open(io.BytesIO(image_data))
-            image_array = np.array(image)
-            
-            # Convert to RGB if needed
-            if len(image_array.shape) == 3 and image_array.shape[2] == 3:
-                image_rgb = cv2.cvtColor(image_array, cv2.COLOR_BGR2RGB)
-            else:
-                image_rgb = image_array
-            
-            # Resize image if too large (improve performance)
-            height, width = image_rgb.shape[:2]
-            if width > 1024 or height > 1024:
-                scale = min(1024/width, 1024/height)
-                new_width = int(width * scale)
-                new_height = int(height * scale)
-                image_rgb = cv2.resize(image_rgb, (new_width, new_height))
-                logger.info(f"Resized image from {width}x{height} to {new_width}x{new_height}")
+            # Decode upright RGB, at most 1024 px (large JPEGs decoded at reduced DCT scale)
+            image_rgb, (width, height) = decode_image(image_data, 1024)
+            if image_rgb.shape[:2] != (height, width):
+                logger.info(f"Decoded image {width}x{height} at {image_rgb.shape[1]}x{image_rgb.shape[0]}")
             
             # Find face locations with different models for better accuracy
-            face_locations = face_recpython app.py
-ognition.face_locations(image_rgb, model='hog')
+            # (HOG on a small proxy of the image, mapped back to image coordinates)
+            face_locations = self._locate_faces(image_rgb)
             
             if not face_locations:
                 # Try with CNN model if HOG fails
@@ -68,8 +87,9 @@ ognition.face_locations(image_rgb, model='hog')
             
             top, right, bottom, left = face_location
             
-            # Extract face encoding with better parameters
-            face_encodings = face_recognition.face_encodings(image_rgb, [face_location], num_jitters=2)
+            # Extract face encoding with better parameters, on the padded face crop at full resolution
+            face_crop, crop_location = self._face_crop(image_rgb, face_location)
+            face_encodings = face_recognition.face_encodings(face_crop, [crop_location], num_jitters=2)
             
             if not face_encodings:
                 logger.warning("Could not encode face")
@@ -108,9 +128,42 @@ ognition.face_locations(image_rgb, model='hog')
         except Exception as e:
             logger.error(f"Error extracting face embedding: {e}")
             return None, None, 0.0
+    def _locate_faces(self, image_rgb: np.ndarray) -> List[Tuple[int, int, int, int]]:
+        """
+        HOG face locations (top, right, bottom, left) found on a proxy of at most
+        Config.DETECTION_PROXY_SIZE px; when it finds nothing, faces too small for
+        the proxy are searched once more on a Config.DETECTION_FALLBACK_SIZE px proxy
+        (not the full image: HOG cost grows with the pixel count)
+        """
+        proxy, scale = detection_proxy(image_rgb, Config.DETECTION_PROXY_SIZE)
+        face_locations = face_recognition.face_locations(proxy, model='hog')
+        if scale == 1.0:
+            return face_locations
+        if not face_locations and Config.DETECTION_FALLBACK_SIZE > Config.DETECTION_PROXY_SIZE:
+            proxy, scale = detection_proxy(image_rgb, Config.DETECTION_FALLBACK_SIZE)
+            face_locations = face_recognition.face_locations(proxy, model='hog')
+        
+        height, width = image_rgb.shape[:2]
+        return [
+            (max(int(top / scale), 0), min(int(right / scale), width),
+             min(int(bottom / scale), height), max(int(left / scale), 0))
+            for top, right, bottom, left in face_locations
+        ]
+    
+    def _face_crop(self, image_rgb: np.ndarray,
+                   face_location: Tuple[int, int, int, int]) -> Tuple[np.ndarray, Tuple[int, int, int, int]]:
+        """Face region padded by Config.FACE_CROP_PADDING, and the face location inside it"""
+        top, right, bottom, left = face_location
+        height, width = image_rgb.shape[:2]
+        padding = int(Config.FACE_CROP_PADDING * max(bottom - top, right - left))
+        y0, x0 = max(top - padding, 0), max(left - padding, 0)
+        y1, x1 = min(bottom + padding, height), min(right + padding, width)
+        face_crop = np.ascontiguousarray(image_rgb[y0:y1, x0:x1])
+        return face_crop, (top - y0, right - x0, bottom - y0, left - x0)
+    
     def calculate_image_hash(self, image_data: bytes) -> str:
         """Calculate SHA256 hash of image data"""
-        return hashlib.sha256(image_data).hexdigest()
+        return image_sha256(image_data)
     
     def save_face_embedding(self, employee_code: str, image_data: bytes, 
                           created_by: str = None, source: str = 'ENROLL',
@@ -118,37 +171,37 @@ ognition.face_locations(image_rgb, model='hog')
         """
         Save face embedding to database and optionally store image in MinIO
         """
+        upload_job = None
         try:
-            # Extract face embedding
-            embedding, bbox, quality_score = self.extract_face_embedding(image_data)
+            # Calculate image hash of the raw upload
+            image_hash = self.calculate_image_hash(image_data)
             
-            if embedding is None:
+            # Check if this face already exists (before any decoding / extraction)
+            if image_dedup.find(image_hash) is not None:
                 return {
                     'success': False,
-                    'error': 'No face found in image or could not extract embedding'
+                    'error': 'This face image already exists in the database'
                 }
             
-            # Calculate image hash
-            image_hash = self.calculate_image_hash(image_data)
-            
-            # Check if this face already exists
-            existing_query = """
-                SELECT id FROM face_embeddings 
-                WHERE sha256 = %s AND status = 'ACTIVE'
-            """
-            existing = db_manager.execute_one(existing_query, (image_hash,))
+            # Extract face embedding
+            embedding, bbox, quality_score = self.extract_face_embedding(image_data)
             
-            if existing:
+            if embedding is None:
                 return {
                     'success': False,
-                    'error': 'This face image already exists in the database'
+                    'error': 'No face found in image or could not extract embedding'
                 }
             
             # Upload image to MinIO if service is available
             image_url = None
             minio_object_name = None
             
-            if minio_service and Config.STORE_ORIGINAL_IMAGES:
+            if upload_queue.enabled:
+                # Uploaded in the background; the row keeps a pending image_url until then
+                upload_job = upload_queue.spool(image_data, employee_code, content_type, image_hash)
+                minio_object_name = upload_job.object_name
+                image_url = upload_job.image_url
+            elif minio_service and Config.STORE_ORIGINAL_IMAGES:
                 try:
                     success, object_name, url = minio_service.upload_image(
                         image_data, employee_code, content_type
@@ -162,8 +215,6 @@ ognition.face_locations(image_rgb, model='hog')
                 except Exception as e:
                     logger.warning(f"MinIO upload failed: {e}, continuing without image storage")
             
-            # Convert embedding to list for database storage
-            embedding_list = embedding.tolist()
             bbox_array = [bbox['top'], bbox['right'], bbox['bottom'], bbox['left']] if bbox else None
             
             # Insert into database
@@ -177,7 +228,7 @@ ognition.face_locations(image_rgb, model='hog')
             
             result = db_manager.execute_one(insert_query, (
                 employee_code,
-                embedding_list,
+                embedding.astype(np.float32),
                 self.model_name,
                 self.model_version,
                 self.distance_metric,
@@ -189,6 +240,10 @@ ognition.face_locations(image_rgb, model='hog')
                 created_by
             ))
             
+            if upload_job is not None:
+                upload_queue.submit(upload_job)
+            face_gallery.upsert(result['id'], employee_code, embedding, quality_score)
+            
             return {
                 'success': True,
                 'face_embedding_id': result['id'],
@@ -200,18 +255,29 @@ ognition.face_locations(image_rgb, model='hog')
             
         except Exception as e:
             logger.error(f"Error saving face embedding: {e}")
+            if upload_job is not None:
+                upload_queue.discard(upload_job)
             return {
                 'success': False,
                 'error': f'Database error: {str(e)}'
             }
     
 
-    def recognize_face(self, image_data: bytes, device_code: Optional[str] = None) -> Dict[str, Any]:
+    def recognize_face(self, image_data: bytes, device_code: Optional[str] = None,
+                       ef_search: Optional[int] = None, probes: Optional[int] = None,
+                       top_k: Optional[int] = None, margin_threshold: Optional[float] = None) -> Dict[str, Any]:
         """
         Recognize face with improved accuracy using multiple templates
+        ef_search / probes: HNSW / IVFFlat search breadth (pgvector search mode only)
+        top_k: number of closest distinct employees returned as candidates
+        margin_threshold: reject matches whose best-to-second-best margin is smaller
         """
         try:
-            # Extract face embedding from input image
+            top_k = top_k or Config.RECOGNITION_TOP_K
+            if margin_threshold is None:
+                margin_threshold = Config.RECOGNITION_MARGIN_THRESHOLD
+            
+            # Extract face embedding from input image (a repeated image is served by the embedding cache)
             input_embedding, bbox, quality_score = self.extract_face_embedding(image_data)
             
             if input_embedding is None:
@@ -220,81 +286,41 @@ ognition.face_locations(image_rgb, model='hog')
                     'error': 'No face found in image or could not extract embedding'
                 }
             
-            # Get all stored embeddings with employee info
-            query = """
-                SELECT fe.id, fe.employee_id, fe.vector, fe.quality_score,
-                       e.employee_code, e.full_name, e.department, e.position
-                FROM face_embeddings fe
-                JOIN employees e ON fe.employee_id = e.employee_code
-                WHERE fe.status = 'ACTIVE' AND e.status = 'ACTIVE'
-                ORDER BY fe.quality_score DESC
-            """
+            # Closest distinct employees (in-memory matrix or pgvector index),
+            # micro-batched with concurrent requests when enabled
+            # At least 2 so the best-to-second-best margin can be computed
+            matches = recognition_scheduler.search_employees(input_embedding, metric=self.distance_metric,
+                                                             k=max(top_k, 2), ef_search=ef_search, probes=probes)
+            templates_compared = len(face_gallery) if face_gallery.loaded else len(matches)
             
-            stored_embeddings = db_manager.execute_query(query, fetch=True)
-            
-            if not stored_embeddings:
+            if not matches:
                 return {
                     'success': False,
                     'error': 'No face templates found in database'
                 }
             
-            # Group embeddings by employee
-            employee_embeddings = {}
-            for stored in stored_embeddings:
-                emp_code = stored['employee_id']  # This is now employee_code
-                if emp_code not in employee_embeddings:
-                    employee_embeddings[emp_code] = {
-                        'employee_info': stored,
-                        'embeddings': []
-                    }
-                employee_embeddings[emp_code]['embeddings'].append(stored)
+            best_distance = matches[0]['distance']
+            margin = matches[1]['distance'] - best_distance if len(matches) > 1 else None
+            candidates = [{'employee_code': m['employee_code'], 'distance': round(m['distance'], 4)}
+                          for m in matches[:top_k]] if top_k > 1 else None
             
-            best_match = None
-            best_distance = float('inf')
-            best_employee_id = None
+            if (best_distance <= self.tolerance and margin_threshold and
+                    margin is not None and margin < margin_threshold):
+                return {
+                    'success': False,
+                    'error': 'Ambiguous match',
+                    'best_distance': round(best_distance, 4),
+                    'margin': round(margin, 4),
+                    'candidates': candidates,
+                    'quality_score': round(quality_score, 3),
+                    'tolerance': self.tolerance,
+                    'templates_compared': templates_compared
+                }
             
-            # Compare with each employee's templates
-            for emp_code, emp_data in employee_embeddings.items():
-                employee_distances = []
-                
-                for stored in emp_data['embeddings']:
-                    # Ensure stored_vector is a numpy array
-                    if isinstance(stored['vector'], str):
-                        # If it's a string, try to parse it
-                        try:
-                            import ast
-                            vector_list = ast.literal_eval(stored['vector'])
-                            stored_vector = np.array(vector_list, dtype=np.float64)
-                        except:
-                            logger.error(f"Could not parse vector string: {stored['vector'][:100]}...")
-                            continue
-                    elif isinstance(stored['vector'], list):
-                        stored_vector = np.array(stored['vector'], dtype=np.float64)
-                    else:
-                        stored_vector = np.array(stored['vector'], dtype=np.float64)
-                    
-                    # Ensure both vectors have the same shape
-                    if input_embedding.shape != stored_vector.shape:
-                        logger.error(f"Vector shape mismatch: input {input_embedding.shape} vs stored {stored_vector.shape}")
-                        continue
-                    
-                    # Calculate distance
-                    if self.distance_metric == 'l2':
-                        distance = np.linalg.norm(input_embedding - stored_vector)
-                    else:  # cosine distance
-                        dot_product = np.dot(input_embedding, stored_vector)
-                        norms = np.linalg.norm(input_embedding) * np.linalg.norm(stored_vector)
-                        distance = 1 - (dot_product / norms) if norms != 0 else 1
-                    
-                    employee_distances.append(distance)
-                
-                # Use the best (minimum) distance for this employee
-                min_distance = min(employee_distances)
-                
-                if min_distance < best_distance:
-                    best_distance = min_distance
-                    best_match = emp_data['employee_info']
-                    best_employee_id = emp_code
+            best_match = None
+            if best_distance <= self.tolerance:
+                best_match = db_manager.execute_prepared(RECOGNIZED_EMPLOYEE, (matches[0]['employee_code'],),
+                                                         fetch='one')
             
             # Check if best match is within tolerance
             if best_match and best_distance <= self.tolerance:
@@ -305,17 +331,11 @@ ognition.face_locations(image_rgb, model='hog')
                 if quality_score > 0.7:
                     confidence = min(1.0, confidence * 1.1)
                 
-                # Log attendance on successful recognition
+                # Log attendance on successful recognition (timesheet check-in queued in the same statement)
                 try:
                     bbox_array = [bbox['top'], bbox['right'], bbox['bottom'], bbox['left']] if bbox else None
-                    insert_log = """
-                        INSERT INTO attendance_logs (
-                            employee_code, recognized_at, device_code, confidence, distance, quality_score, bbox, image_url, source
-                        ) VALUES (%s, now(), %s, %s, %s, %s, %s, %s, %s)
-                        RETURNING id
-                    """
                     # Try to include image_url if available from MinIO recent upload (not available here); keep NULL
-                    _log = db_manager.execute_one(insert_log, (
+                    attendance_row = (
                         best_match['employee_id'],
                         device_code,
                         float(round(confidence, 3)),
@@ -324,7 +344,12 @@ ognition.face_locations(image_rgb, model='hog')
                         bbox_array,
                         None,
                         'RECOGNIZE'
-                    ))
+                    )
+                    if attendance_writer.enabled:
+                        # Buffered: inserted by the background writer, no commit on the request path
+                        attendance_writer.write(*attendance_row)
+                    else:
+                        db_manager.execute_prepared(ATTENDANCE_INSERT, attendance_row)
                 except Exception as e:
                     logger.warning(f"Failed to write attendance log: {e}")
 
@@ -338,16 +363,20 @@ ognition.face_locations(image_rgb, model='hog')
                     'confidence': round(confidence, 3),
                     'distance': round(best_distance, 4),
                     'quality_score': round(quality_score, 3),
-                    'templates_compared': len(stored_embeddings)
+                    'margin': round(margin, 4) if margin is not None else None,
+                    'candidates': candidates,
+                    'templates_compared': templates_compared
                 }
             else:
                 return {
                     'success': False,
                     'error': 'No matching face found',
-                    'best_distance': round(best_distance, 4) if best_match else None,
+                    'best_distance': round(best_distance, 4),
+                    'margin': round(margin, 4) if margin is not None else None,
+                    'candidates': candidates,
                     'quality_score': round(quality_score, 3),
                     'tolerance': self.tolerance,
-                    'templates_compared': len(stored_embeddings)
+                    'templates_compared': templates_compared
                 }
                 
         except Exception as e:
@@ -357,11 +386,14 @@ ognition.face_locations(image_rgb, model='hog')
                 'error': f'Recognition error: {str(e)}'
             }
     def get_face_embeddings(self, employee_code: str = None) -> List[Dict[str, Any]]:
-        """Get face embeddings, optionally filtered by employee_code"""
+        """Get face embeddings (metadata only, no vector), optionally filtered by employee_code"""
         try:
             if employee_code:
                 query = """
-                    SELECT fe.*, e.employee_code, e.full_name
+                    SELECT fe.id, fe.employee_id, fe.model_name, fe.model_version, fe.distance_metric,
+                           fe.quality_score, fe.liveness_score, fe.bbox, fe.source, fe.status,
+                           fe.image_url, fe.sha256, fe.created_by, fe.created_at,
+                           e.employee_code, e.full_name
                     FROM face_embeddings fe
                     JOIN employees e ON fe.employee_id = e.employee_code
                     WHERE fe.employee_id = %s AND fe.status = 'ACTIVE'
@@ -370,7 +402,10 @@ ognition.face_locations(image_rgb, model='hog')
                 params = (employee_code,)
             else:
                 query = """
-                    SELECT fe.*, e.employee_code, e.full_name
+                    SELECT fe.id, fe.employee_id, fe.model_name, fe.model_version, fe.distance_metric,
+                           fe.quality_score, fe.liveness_score, fe.bbox, fe.source, fe.status,
+                           fe.image_url, fe.sha256, fe.created_by, fe.created_at,
+                           e.employee_code, e.full_name
                     FROM face_embeddings fe
                     JOIN employees e ON fe.employee_id = e.employee_code
                     WHERE fe.status = 'ACTIVE'
@@ -412,6 +447,7 @@ ognition.face_locations(image_rgb, model='hog')
             result = db_manager.execute_one(query, params)
             
             if result:
+                face_gallery.refresh(result['id'])
                 return {'success': True, 'face_embedding_id': result['id']}
             else:
                 return {'success': False, 'error': 'Face embedding not found'}
@@ -425,7 +461,7 @@ ognition.face_locations(image_rgb, model='hog')
         try:
             # First, get the face embedding info to get image URL
             get_query = """
-                SELECT id, image_url FROM face_embeddings 
+                SELECT id, image_url, sha256 FROM face_embeddings 
                 WHERE id = %s AND status != 'DELETED'
             """
             
@@ -455,8 +491,11 @@ ognition.face_locations(image_rgb, model='hog')
             result = db_manager.execute_one(delete_query, (face_id,))
             
             if result:
-                # Try to delete image from MinIO if it exists
-                if image_url and minio_service:
+                face_gallery.remove(face_id)
+                
+                # Try to delete image from MinIO if it exists and no other
+                # embedding uses the same (content-addressed) object
+                if image_url and minio_service and not image_dedup.is_referenced(face_info['sha256'], face_id):
                     try:
                         # Extract object name from URL
                         object_name = self._extract_object_name_from_url(image_url)
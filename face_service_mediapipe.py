@@ -1,19 +1,38 @@
 import mediapipe as mp
 import numpy as np
 import cv2
-from PIL import Image
-import io
-import hashlib
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Tuple, Optional, Dict, Any
 from database import db_manager
 from config import Config
+from image_decode import decode_image, detection_proxy
+from extraction_engine import ExtractionEngine
 from minio_service import minio_service
+from upload_queue import upload_queue
+from gallery import face_gallery
+from image_dedup import image_dedup, image_sha256
+from embedding_cache import embedding_cache
+from vector_search import search_employees_batch
+from batch_scheduler import recognition_scheduler
+from checkin_outbox import with_checkin_outbox
+from attendance_writer import attendance_writer
+from mediapipe_models import model_registry, ModelBundle
 from sklearn.metrics.pairwise import cosine_similarity
 
 logger = logging.getLogger(__name__)
 
+# Attendance insert of every successful recognition (timesheet check-in queued in the same statement)
+ATTENDANCE_INSERT = db_manager.prepare('mediapipe_attendance_insert', with_checkin_outbox("""
+    INSERT INTO attendance_logs 
+    (employee_code, device_code, confidence, distance, quality_score, bbox, recognized_at)
+    VALUES (%s, %s, %s, %s, %s, %s, now())
+"""))
+
 class FaceService:
+    # Layout of the stored bbox array (INT4[4])
+    BBOX_KEYS = ('x', 'y', 'width', 'height')
+
     def __init__(self):
         self.tolerance = Config.FACE_RECOGNITION_TOLERANCE
         self.model_name = Config.FACE_MODEL_NAME
@@ -25,79 +44,74 @@ class FaceService:
         self.mp_face_mesh = mp.solutions.face_mesh
         self.mp_drawing = mp.solutions.drawing_utils
         
-        # Initialize face detection model
-        self.face_detection = self.mp_face_detection.FaceDetection(
-            model_selection=1,  # 0 for close-range, 1 for full-range
-            min_detection_confidence=0.5
-        )
-        
-        # Initialize face mesh for landmarks
-        self.face_mesh = self.mp_face_mesh.FaceMesh(
-            static_image_mode=True,
-            max_num_faces=1,
-            refine_landmarks=True,
-            min_detection_confidence=0.5,
-            min_tracking_confidence=0.5
-        )
+        # Pool of detector/fallback/face mesh bundles (Config.MEDIAPIPE_POOL_SIZE),
+        # built once and reused; one bundle per concurrent extraction
+        self.models = model_registry
+        # Batch extraction threads (started on first use by the executor itself)
+        self._executor = ThreadPoolExecutor(max_workers=Config.BATCH_EXTRACT_WORKERS,
+                                            thread_name_prefix='face-extract')
+        # Extraction in child processes when Config.EXTRACTION_PROCESSES > 0
+        # (models are then loaded in the children only)
+        self.extraction_engine = ExtractionEngine(__name__)
+        if not self.extraction_engine.enabled:
+            self.models.warm_up()
 
     def extract_face_embedding(self, image_data: bytes) -> Tuple[Optional[np.ndarray], Optional[Dict], float]:
         """
         Extract face embedding from image using MediaPipe
+        Repeated images are served from the embedding cache
         Returns: (embedding_vector, bbox, quality_score)
         """
+        return embedding_cache.get_or_extract(image_data, self._extract_uncached)
+
+    def _extract_uncached(self, image_data: bytes) -> Tuple[Optional[np.ndarray], Optional[Dict], float]:
+        """Extract in a child process, or here with a pooled model bundle"""
+        if self.extraction_engine.enabled:
+            return self.extraction_engine.extract(image_data)
+        return self._extract_local(image_data)
+
+    def _extract_local(self, image_data: bytes) -> Tuple[Optional[np.ndarray], Optional[Dict], float]:
+        """Extract in this process with a pooled model bundle (also what extraction worker processes run)"""
         try:
-            # Load image using PIL (handles JPEG better)
-            image = Image.open(io.BytesIO(image_data))
-            
-            # Convert to RGB if needed (PIL might load as RGBA or other modes)
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            image_array = np.array(image)
-            image_rgb = image_array  # PIL already gives RGB
-            
-            # Validate image dimensions
-            height, width = image_rgb.shape[:2]
+            with self.models.checkout() as models:
+                return self._extract_face_embedding(image_data, models)
+        except TimeoutError as e:
+            logger.error(f"Error extracting face embedding: {str(e)}")
+            return None, None, 0.0
+
+    def _extract_face_embedding(self, image_data: bytes, models: ModelBundle) -> Tuple[Optional[np.ndarray], Optional[Dict], float]:
+        """Extract face embedding with a checked-out model bundle"""
+        try:
+            # Decode upright RGB; images larger than 1920 px (MediaPipe works better with
+            # reasonable sizes) are decoded at reduced DCT scale, smaller ones kept as-is
+            image_rgb, (width, height) = decode_image(image_data, 1920)
             logger.info(f"Processing image: {width}x{height}, size: {len(image_data)} bytes")
             
             if height < 50 or width < 50:
                 logger.warning(f"Image too small: {width}x{height}")
                 return None, None, 0.0
             
-            # Resize if too large (MediaPipe works better with reasonable sizes)
-            # But keep smaller images as-is (might be cropped face)
-            if width > 1920 or height > 1920:
-                scale = min(1920/width, 1920/height)
-                new_width = int(width * scale)
-                new_height = int(height * scale)
-                image_rgb = cv2.resize(image_rgb, (new_width, new_height), interpolation=cv2.INTER_AREA)
-                logger.info(f"Resized image from {width}x{height} to {new_width}x{new_height}")
-            
             # If image is very small (likely a cropped face), enhance it
             if width < 200 or height < 200:
                 logger.info("Small image detected, enhancing for better detection")
                 # Enhance contrast for better detection
-                image_bgr = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR)
-                lab = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2LAB)
+                lab = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2LAB)
                 l, a, b = cv2.split(lab)
                 clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
                 l = clahe.apply(l)
                 enhanced = cv2.merge([l, a, b])
-                image_rgb = cv2.cvtColor(enhanced, cv2.COLOR_BGR2RGB)
+                image_rgb = cv2.cvtColor(enhanced, cv2.COLOR_LAB2RGB)
             
-            # Process with MediaPipe Face Detection
-            results = self.face_detection.process(image_rgb)
+            # Process with MediaPipe Face Detection on a small proxy (Config.DETECTION_PROXY_SIZE):
+            # the detector works at 128/256 px internally, relative boxes apply to the full image
+            proxy, _ = detection_proxy(image_rgb, Config.DETECTION_PROXY_SIZE)
+            results = models.detector.process(proxy)
             
             if not results.detections:
                 logger.warning(f"No faces detected in image ({width}x{height})")
-                # Try with lower confidence threshold
+                # Try with lower confidence threshold (close-range model)
                 logger.info("Trying with lower confidence threshold...")
-                temp_detector = self.mp_face_detection.FaceDetection(
-                    model_selection=0,  # Try close-range model
-                    min_detection_confidence=0.3
-                )
-                results = temp_detector.process(image_rgb)
-                temp_detector.close()
+                results = models.fallback_detector.process(proxy)
                 
                 if not results.detections:
                     return None, None, 0.0
@@ -106,14 +120,16 @@ class FaceService:
             detection = results.detections[0]
             bbox = detection.location_data.relative_bounding_box
             
-            # Convert relative coordinates to absolute
+            # Convert relative coordinates to absolute (original image)
             x = int(bbox.xmin * width)
             y = int(bbox.ymin * height)
             w = int(bbox.width * width)
             h = int(bbox.height * height)
             
-            # Extract face region
-            face_region = image_rgb[y:y+h, x:x+w]
+            # Extract face region from the decoded image (full resolution)
+            decoded_height, decoded_width = image_rgb.shape[:2]
+            face_region = image_rgb[max(int(bbox.ymin * decoded_height), 0):int((bbox.ymin + bbox.height) * decoded_height),
+                                    max(int(bbox.xmin * decoded_width), 0):int((bbox.xmin + bbox.width) * decoded_width)]
             
             if face_region.size == 0:
                 logger.warning("Empty face region")
@@ -123,7 +139,7 @@ class FaceService:
             face_resized = cv2.resize(face_region, (160, 160))
             
             # Generate embedding using face landmarks
-            embedding = self._generate_face_embedding(face_resized)
+            embedding = self._generate_face_embedding(face_resized, models.face_mesh)
             
             if embedding is None:
                 logger.warning("Failed to generate face embedding")
@@ -152,14 +168,28 @@ class FaceService:
             logger.error(f"Error extracting face embedding: {str(e)}")
             return None, None, 0.0
 
-    def _generate_face_embedding(self, face_image: np.ndarray) -> Optional[np.ndarray]:
+    def extract_face_embeddings(self, images: List[bytes]) -> List[Tuple[Optional[np.ndarray], Optional[Dict], float]]:
+        """
+        Extract face embeddings for several images in parallel
+        Returns one (embedding_vector, bbox, quality_score) per image, in order
+        """
+        return embedding_cache.get_or_extract_many(images, self._extract_many_uncached)
+
+    def _extract_many_uncached(self, images: List[bytes]) -> List[Tuple[Optional[np.ndarray], Optional[Dict], float]]:
+        if self.extraction_engine.enabled:
+            return self.extraction_engine.extract_many(images)
+        if len(images) <= 1:
+            return [self._extract_local(image_data) for image_data in images]
+        return list(self._executor.map(self._extract_local, images))
+
+    def _generate_face_embedding(self, face_image: np.ndarray, face_mesh) -> Optional[np.ndarray]:
         """
         Generate face embedding using MediaPipe face mesh landmarks
         Returns 128-dimensional vector for database compatibility
         """
         try:
             # Process with face mesh to get landmarks
-            results = self.face_mesh.process(face_image)
+            results = face_mesh.process(face_image)
             
             if not results.multi_face_landmarks:
                 return None
@@ -244,7 +274,16 @@ class FaceService:
         """
         Save face embedding to database
         """
+        upload_job = None
         try:
+            # Duplicate uploads are rejected before any decoding / extraction
+            sha256 = image_sha256(image_data)
+            if image_dedup.find(sha256) is not None:
+                return {
+                    'success': False,
+                    'error': 'This face image already exists in the database'
+                }
+            
             # Extract face embedding
             embedding, bbox, quality_score = self.extract_face_embedding(image_data)
             
@@ -260,13 +299,15 @@ class FaceService:
                     'error': f'Face quality too low: {quality_score:.3f}'
                 }
             
-            # Generate SHA256 hash
-            sha256 = hashlib.sha256(image_data).hexdigest()
-            
             # Store image in MinIO if available
             image_url = None
             minio_object_name = None
-            if minio_service:
+            if upload_queue.enabled:
+                # Uploaded in the background; the row keeps a pending image_url until then
+                upload_job = upload_queue.spool(image_data, employee_code, content_type, sha256)
+                minio_object_name = upload_job.object_name
+                image_url = upload_job.image_url
+            elif minio_service:
                 try:
                     success, object_name, url = minio_service.upload_image(
                         image_data, employee_code, content_type=content_type
@@ -277,14 +318,12 @@ class FaceService:
                 except Exception as e:
                     logger.warning(f"Failed to upload to MinIO: {str(e)}")
             
-            # Convert embedding to string format for database
-            embedding_str = '[' + ','.join(map(str, embedding)) + ']'
-            
             # Save to database
             query = """
                 INSERT INTO face_embeddings 
-                (employee_id, vector, quality_score, bbox, source, image_url, sha256, created_by, created_at)
-                VALUES (%s, %s::vector, %s, %s, %s::face_source, %s, %s, %s, now())
+                (employee_id, vector, model_name, model_version, quality_score, bbox, source,
+                 image_url, sha256, created_by, created_at)
+                VALUES (%s, %s::vector, %s, %s, %s, %s, %s::face_source, %s, %s, %s, now())
                 RETURNING id
             """
             
@@ -292,7 +331,9 @@ class FaceService:
             
             result = db_manager.execute_one(query, (
                 employee_code,
-                embedding_str,
+                embedding,
+                self.model_name,
+                self.model_version,
                 quality_score,
                 bbox_array,
                 source,
@@ -302,6 +343,9 @@ class FaceService:
             ))
             
             if result:
+                if upload_job is not None:
+                    upload_queue.submit(upload_job)
+                face_gallery.upsert(result['id'], employee_code, embedding, quality_score)
                 return {
                     'success': True,
                     'face_embedding_id': result['id'],
@@ -311,6 +355,8 @@ class FaceService:
                     'minio_object_name': minio_object_name
                 }
             else:
+                if upload_job is not None:
+                    upload_queue.discard(upload_job)
                 return {
                     'success': False,
                     'error': 'Failed to save face embedding'
@@ -318,135 +364,211 @@ class FaceService:
                 
         except Exception as e:
             logger.error(f"Error saving face embedding: {str(e)}")
+            if upload_job is not None:
+                upload_queue.discard(upload_job)
             return {
                 'success': False,
                 'error': f'Database error: {str(e)}'
             }
 
-    def recognize_face(self, image_data: bytes, device_code: str = None) -> Dict[str, Any]:
+    def recognize_face(self, image_data: bytes, device_code: str = None,
+                       ef_search: int = None, probes: int = None,
+                       top_k: int = None, margin_threshold: float = None) -> Dict[str, Any]:
         """
         Recognize face in image
+        ef_search / probes: HNSW / IVFFlat search breadth (pgvector search mode only)
+        top_k: number of closest distinct employees returned as candidates
+        margin_threshold: reject matches whose best-to-second-best margin is smaller
         """
         try:
-            # Extract face embedding from input image
-            embedding, bbox, quality_score = self.extract_face_embedding(image_data)
+            top_k = top_k or Config.RECOGNITION_TOP_K
             
-            if embedding is None:
-                return {
-                    'success': False,
-                    'employee_code': None,
-                    'confidence': 0.0,
-                    'distance': 1.0,
-                    'message': 'No face detected'
-                }
-            
-            if quality_score < 0.3:
-                return {
-                    'success': False,
-                    'employee_code': None,
-                    'confidence': 0.0,
-                    'distance': 1.0,
-                    'message': f'Face quality too low: {quality_score:.3f}'
-                }
-            
-            # Get all face embeddings from database
-            query = """
-                SELECT id, employee_id, vector, quality_score
-                FROM face_embeddings 
-                WHERE status = 'ACTIVE'
-            """
-            
-            embeddings = db_manager.execute_query(query, fetch=True)
-            
-            if not embeddings:
-                return {
-                    'success': False,
-                    'employee_code': None,
-                    'confidence': 0.0,
-                    'distance': 1.0,
-                    'message': 'No registered faces found'
-                }
+            # Extract face embedding from input image (a repeated image is served by the embedding cache)
+            embedding, bbox, quality_score = self.extract_face_embedding(image_data)
             
-            # Find best match
-            best_match = None
-            best_distance = float('inf')
+            rejected = self._check_probe(embedding, quality_score)
+            if rejected:
+                return rejected
             
-            for emb in embeddings:
-                try:
-                    # Parse stored embedding
-                    stored_embedding = np.array(eval(emb['vector']), dtype=np.float32)
-                    
-                    # Compare embeddings
-                    distance = self.compare_faces(embedding, stored_embedding)
-                    
-                    if distance < best_distance:
-                        best_distance = distance
-                        best_match = emb
-                        
-                except Exception as e:
-                    logger.warning(f"Error comparing with embedding {emb['id']}: {str(e)}")
-                    continue
+            # Closest distinct employees (cosine distance; in-memory matrix or pgvector index),
+            # micro-batched with concurrent requests when enabled
+            # At least 2 so the best-to-second-best margin can be computed
+            matches = recognition_scheduler.search_employees(embedding, metric='cosine', k=max(top_k, 2),
+                                                             ef_search=ef_search, probes=probes)
             
-            # Check if match is good enough
-            if best_match and best_distance <= self.tolerance:
+            result = self._match_result(matches, quality_score, top_k, margin_threshold)
+            if result['success']:
                 # Log attendance
-                self._log_attendance(best_match['employee_id'], device_code, 
-                                   best_distance, quality_score, bbox)
-                
-                return {
-                    'success': True,
-                    'employee_code': best_match['employee_id'],
-                    'confidence': 1.0 - best_distance,
-                    'distance': best_distance,
-                    'quality_score': quality_score,
-                    'message': 'Face recognized successfully'
-                }
-            else:
-                return {
-                    'success': False,
-                    'employee_code': None,
-                    'confidence': 0.0,
-                    'distance': best_distance,
-                    'message': f'No matching face found (distance: {best_distance:.3f})'
-                }
+                self._log_attendance(result['employee_code'], device_code, 
+                                   result['distance'], quality_score, bbox)
+            return result
                 
         except Exception as e:
             logger.error(f"Error recognizing face: {str(e)}")
-            return {
-                'success': False,
-                'employee_code': None,
-                'confidence': 0.0,
-                'distance': 1.0,
-                'message': f'Recognition error: {str(e)}'
+            return self._error_result(f'Recognition error: {str(e)}')
+
+    def recognize_faces_batch(self, images: List[bytes], device_code: str = None,
+                              ef_search: int = None, probes: int = None,
+                              top_k: int = None, margin_threshold: float = None) -> List[Dict[str, Any]]:
+        """
+        Recognize faces in several images at once
+        Embeddings are extracted in parallel, the (N x 128) probe block is matched
+        against the gallery in one matrix multiply and attendance is written with
+        one multi-row INSERT. Returns per-image results in order.
+        """
+        try:
+            top_k = top_k or Config.RECOGNITION_TOP_K
+            extracted = self.extract_face_embeddings(images)
+            results: List[Optional[Dict[str, Any]]] = [None] * len(images)
+            
+            probe_indexes = []
+            for index, (embedding, bbox, quality_score) in enumerate(extracted):
+                rejected = self._check_probe(embedding, quality_score)
+                if rejected:
+                    results[index] = rejected
+                else:
+                    probe_indexes.append(index)
+            
+            attendance_rows = []
+            if probe_indexes:
+                probe_block = np.vstack([extracted[index][0] for index in probe_indexes])
+                all_matches = search_employees_batch(probe_block, metric='cosine', k=max(top_k, 2),
+                                                     ef_search=ef_search, ivfflat_probes=probes)
+                
+                for index, matches in zip(probe_indexes, all_matches):
+                    _, bbox, quality_score = extracted[index]
+                    result = self._match_result(matches, quality_score, top_k, margin_threshold)
+                    if result['success']:
+                        attendance_rows.append((result['employee_code'], device_code,
+                                                result['distance'], quality_score, bbox))
+                    results[index] = result
+            
+            if attendance_rows:
+                self._log_attendance_batch(attendance_rows)
+            
+            return results
+            
+        except Exception as e:
+            logger.error(f"Error recognizing face batch: {str(e)}")
+            return [self._error_result(f'Recognition error: {str(e)}') for _ in images]
+
+    def _check_probe(self, embedding: Optional[np.ndarray], quality_score: float) -> Optional[Dict[str, Any]]:
+        """
+        Reject probes without a face or with low quality
+        Returns the failure result, or None if the probe can be matched
+        """
+        if embedding is None:
+            return self._error_result('No face detected')
+        
+        if quality_score < 0.3:
+            return self._error_result(f'Face quality too low: {quality_score:.3f}')
+        
+        return None
+
+    def _match_result(self, matches: List[Dict[str, Any]], quality_score: float,
+                      top_k: int = 1, margin_threshold: float = None) -> Dict[str, Any]:
+        """
+        Build the recognition result from the closest distinct employees
+        """
+        if not matches:
+            return self._error_result('No registered faces found')
+        
+        if margin_threshold is None:
+            margin_threshold = Config.RECOGNITION_MARGIN_THRESHOLD
+        
+        best_match = matches[0]
+        best_distance = best_match['distance']
+        margin = matches[1]['distance'] - best_distance if len(matches) > 1 else None
+        
+        # Check if match is good enough
+        if best_distance > self.tolerance:
+            result = self._error_result(f'No matching face found (distance: {best_distance:.3f})')
+            result['distance'] = best_distance
+        elif margin_threshold and margin is not None and margin < margin_threshold:
+            result = self._error_result(f'Ambiguous match (margin: {margin:.3f} < {margin_threshold:.3f})')
+            result['distance'] = best_distance
+        else:
+            result = {
+                'success': True,
+                'employee_code': best_match['employee_code'],
+                'confidence': 1.0 - best_distance,
+                'distance': best_distance,
+                'quality_score': quality_score,
+                'message': 'Face recognized successfully'
             }
+        
+        result['margin'] = margin
+        if top_k > 1:
+            result['candidates'] = matches[:top_k]
+        return result
+
+    @staticmethod
+    def _error_result(message: str) -> Dict[str, Any]:
+        return {
+            'success': False,
+            'employee_code': None,
+            'confidence': 0.0,
+            'distance': 1.0,
+            'message': message
+        }
 
     def _log_attendance(self, employee_code: str, device_code: str, 
                        distance: float, quality_score: float, bbox: Dict):
         """
-        Log attendance recognition
+        Log attendance recognition (and queue the timesheet check-in in the same statement)
         """
         try:
-            query = """
-                INSERT INTO attendance_logs 
-                (employee_code, device_code, confidence, distance, quality_score, bbox, recognized_at)
-                VALUES (%s, %s, %s, %s, %s, %s, now())
-            """
-            
             bbox_array = [bbox['x'], bbox['y'], bbox['width'], bbox['height']] if bbox else None
             
-            db_manager.execute_query(query, (
+            if attendance_writer.enabled:
+                # Buffered: inserted by the background writer, no commit on the request path
+                attendance_writer.write(employee_code, device_code, 1.0 - distance, distance,
+                                        quality_score, bbox_array)
+            else:
+                db_manager.execute_prepared(ATTENDANCE_INSERT, (
+                    employee_code,
+                    device_code,
+                    1.0 - distance,  # confidence
+                    distance,
+                    quality_score,
+                    bbox_array
+                ))
+            
+            logger.info(f"Attendance logged for {employee_code}")
+            
+        except Exception as e:
+            logger.error(f"Error logging attendance: {str(e)}")
+
+    def _log_attendance_batch(self, rows: List[Tuple[str, str, float, float, Dict]]):
+        """
+        Log several recognitions with one multi-row INSERT
+        (one timesheet check-in per distinct employee is queued in the same statement)
+        rows: (employee_code, device_code, distance, quality_score, bbox)
+        """
+        try:
+            values = [(
                 employee_code,
                 device_code,
                 1.0 - distance,  # confidence
                 distance,
                 quality_score,
-                bbox_array
-            ))
+                [bbox['x'], bbox['y'], bbox['width'], bbox['height']] if bbox else None
+            ) for employee_code, device_code, distance, quality_score, bbox in rows]
             
-            logger.info(f"Attendance logged for {employee_code}")
+            if attendance_writer.enabled:
+                attendance_writer.write_many([row + (None, 'RECOGNIZE') for row in values])
+            else:
+                query = with_checkin_outbox("""
+                    INSERT INTO attendance_logs 
+                    (employee_code, device_code, confidence, distance, quality_score, bbox, recognized_at)
+                    VALUES %s
+                """)
+                db_manager.execute_values(query, values, template="(%s, %s, %s, %s, %s, %s, now())")
+            
+            logger.info(f"Attendance logged for {len(values)} recognitions")
             
         except Exception as e:
-            logger.error(f"Error logging attendance: {str(e)}")
+            logger.error(f"Error logging attendance batch: {str(e)}")
 
     def get_face_embeddings(self, employee_code: str = None) -> List[Dict]:
         """
@@ -508,6 +630,7 @@ class FaceService:
             result = db_manager.execute_one(query, tuple(params))
             
             if result:
+                face_gallery.refresh(result['id'])
                 return {
                     'success': True,
                     'face_embedding_id': result['id']
@@ -540,6 +663,7 @@ class FaceService:
                 message = "Face embedding marked as deleted"
             
             if result > 0:
+                face_gallery.remove(face_id)
                 return {
                     'success': True,
                     'message': message
@@ -568,6 +692,7 @@ class FaceService:
                     RETURNING id 
                     """
             db_manager.execute_one(query, (employee_code,))
+            face_gallery.remove_employee(employee_code)
             return True
 
         except Exception as e:
@@ -0,0 +1,802 @@
+import os
+import threading
+import select
+import json
+import logging
+from collections import OrderedDict
+from typing import List, Tuple, Optional, Dict, Any
+import numpy as np
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from database import db_manager
+from config import Config
+from vector_codec import to_vector
+from gallery_snapshot import read_snapshot, GallerySnapshot
+
+logger = logging.getLogger(__name__)
+
+# Storage dtype of the gallery matrix per Config.GALLERY_STORAGE
+STORAGE_DTYPES = {
+    'float32': np.float32,
+    'float16': np.float16,
+    'int8': np.int8
+}
+
+# Rows dequantized per block when scoring a compact (float16 / int8) matrix
+SCORE_CHUNK_ROWS = 65536
+
+
+class FaceGallery:
+    """
+    Process-resident matrix of all ACTIVE face embeddings.
+
+    Rows are kept contiguous (N x D) together with parallel arrays of
+    face ids, employee slots and quality scores, so a probe is matched with a
+    single matrix-vector product instead of a per-row Python loop.
+
+    With storage='float16' or 'int8' (per-dimension scale) the matrix is only
+    used for coarse scoring; the best Config.GALLERY_RERANK_CANDIDATES rows are
+    re-ranked against full-precision vectors fetched lazily from PostgreSQL.
+    """
+
+    def __init__(self, dimension: int = Config.EMBEDDING_DIMENSION, storage: str = Config.GALLERY_STORAGE):
+        if storage not in STORAGE_DTYPES:
+            raise ValueError(f"Unsupported gallery storage: {storage}")
+        self.dimension = dimension
+        self.storage = storage
+        self._dtype = STORAGE_DTYPES[storage]
+        # int8 only: per-dimension scale, value = code * scale
+        self._scale: Optional[np.ndarray] = None
+        # Full-precision vectors used for re-ranking (face_id -> float32), LRU
+        self._exact_cache: 'OrderedDict[int, np.ndarray]' = OrderedDict()
+        # Bumped whenever rows are removed or replaced: fetched exact vectors may be stale
+        self._generation = 0
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._listener: Optional['GalleryListener'] = None
+        self._listener_lock = threading.Lock()
+        self._snapshot: Optional[GallerySnapshot] = None
+        self._reset(0)
+
+    def _reset(self, capacity: int):
+        """Empty backing arrays with room for `capacity` rows"""
+        self._generation += 1
+        self._size = 0
+        self._vectors = np.empty((capacity, self.dimension), dtype=self._dtype)
+        self._sq_norms = np.empty(capacity, dtype=np.float32)
+        self._ids = np.empty(capacity, dtype=np.int64)
+        self._quality = np.empty(capacity, dtype=np.float32)
+        self._slots = np.empty(capacity, dtype=np.int32)
+        self._row_by_id: Dict[int, int] = {}
+        # Employee slots: small integer per employee code, used for per-employee reductions
+        self._slot_by_code: Dict[str, int] = {}
+        self._code_by_slot: List[Optional[str]] = []
+        self._slot_counts: List[int] = []
+        self._free_slots: List[int] = []
+        # Per-employee centroids (two-stage search) and row membership
+        self._rows_by_slot: List[set] = []
+        self._centroids = np.zeros((0, self.dimension), dtype=np.float32)
+        self._centroid_sq_norms = np.zeros(0, dtype=np.float32)
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    @property
+    def quantized(self) -> bool:
+        return self.storage != 'float32'
+
+    def load(self) -> int:
+        """(Re)load the whole gallery from the snapshot file if configured, else from face_embeddings"""
+        path = Config.GALLERY_SNAPSHOT_PATH
+        if path and os.path.exists(path):
+            try:
+                return self.load_snapshot(path)
+            except Exception as e:
+                logger.warning(f"Could not load gallery snapshot {path}, loading from database: {e}")
+
+        query = """
+            SELECT fe.id, fe.employee_id, fe.vector, fe.quality_score
+            FROM face_embeddings fe
+            JOIN employees e ON fe.employee_id = e.employee_code
+            WHERE fe.status = 'ACTIVE' AND e.status = 'ACTIVE'
+        """
+        rows = db_manager.execute_query(query, fetch=True)
+        self.load_rows(rows)
+        self._snapshot = None
+
+        logger.info(f"Face gallery loaded: {self._size} embeddings, {self.employee_count()} employees")
+        return self._size
+
+    def load_rows(self, rows: List[Dict[str, Any]]):
+        """Replace the gallery with pre-fetched rows of {id, employee_id, vector, quality_score}"""
+        vectors = [to_vector(row['vector']) for row in rows]
+        with self._lock:
+            self._reset(len(rows))
+            self._exact_cache.clear()
+            if self.storage == 'int8':
+                valid = [v for v in vectors if v.shape == (self.dimension,)]
+                self._scale = self._fit_scale(np.vstack(valid)) if valid else None
+            for row, vector in zip(rows, vectors):
+                try:
+                    self._append(row['id'], row['employee_id'], vector, row['quality_score'])
+                except ValueError as e:
+                    logger.warning(f"Skipping embedding {row['id']}: {e}")
+            self._loaded = True
+
+    def load_snapshot(self, path: str) -> int:
+        """
+        Map a snapshot file written by gallery_snapshot.build_snapshot (copy-on-write,
+        shared page cache), then reconcile it with the ACTIVE rows in the database.
+        """
+        snapshot = read_snapshot(path, mode='c')
+        if snapshot.dimension != self.dimension:
+            raise ValueError(f"Snapshot dimension {snapshot.dimension} != {self.dimension}")
+
+        with self._lock:
+            self._load_arrays(snapshot)
+            self._snapshot = snapshot
+            self._loaded = True
+            self._reconcile()
+
+        logger.info(f"Face gallery mapped from {path}: {self._size} embeddings, "
+                    f"{self.employee_count()} employees")
+        return self._size
+
+    def _load_arrays(self, snapshot: GallerySnapshot):
+        """Adopt the snapshot arrays as the backing store (caller holds the lock)"""
+        count, capacity = snapshot.count, snapshot.capacity
+        self._reset(0)
+        self._exact_cache.clear()
+        if self.quantized:
+            # Compact storage cannot share the float32 pages, quantize block by block
+            self._scale = self._fit_scale(np.asarray(snapshot.vectors[:count])) if self.storage == 'int8' and count else None
+            self._vectors = np.empty((capacity, self.dimension), dtype=self._dtype)
+            for start in range(0, count, SCORE_CHUNK_ROWS):
+                end = min(start + SCORE_CHUNK_ROWS, count)
+                self._vectors[start:end] = self._quantize(np.asarray(snapshot.vectors[start:end]))
+        else:
+            self._vectors = snapshot.vectors
+        self._ids = snapshot.ids
+        self._quality = snapshot.quality
+        self._slots = snapshot.code_index
+        self._sq_norms = np.empty(capacity, dtype=np.float32)
+        for start in range(0, count, SCORE_CHUNK_ROWS):
+            end = min(start + SCORE_CHUNK_ROWS, count)
+            block = np.asarray(snapshot.vectors[start:end])
+            self._sq_norms[start:end] = np.einsum('ij,ij->i', block, block)
+        self._size = count
+        self._row_by_id = dict(zip(self._ids[:count].tolist(), range(count)))
+
+        # Employee slots = indexes of the snapshot code table
+        slots = np.asarray(self._slots[:count])
+        self._code_by_slot = list(snapshot.codes)
+        self._slot_by_code = {code: slot for slot, code in enumerate(self._code_by_slot)}
+        self._slot_counts = np.bincount(slots, minlength=len(self._code_by_slot)).tolist()
+        order = np.argsort(slots, kind='stable')
+        bounds = np.searchsorted(slots[order], np.arange(len(self._code_by_slot) + 1))
+        self._rows_by_slot = [set(order[bounds[slot]:bounds[slot + 1]].tolist())
+                              for slot in range(len(self._code_by_slot))]
+        for slot, slot_count in enumerate(self._slot_counts):
+            if slot_count == 0:
+                del self._slot_by_code[self._code_by_slot[slot]]
+                self._code_by_slot[slot] = None
+                self._free_slots.append(slot)
+        self._grow_centroids(len(self._code_by_slot))
+        for slot in range(len(self._code_by_slot)):
+            self._update_centroid(slot)
+
+    def _reconcile(self):
+        """
+        Apply changes made after the snapshot was written (caller holds the lock).
+        Rows are compared on (id, xmin), so embeddings updated in place are re-read too.
+        """
+        rows = db_manager.execute_query("""
+            SELECT fe.id, fe.xmin::text::bigint AS row_version
+            FROM face_embeddings fe
+            JOIN employees e ON fe.employee_id = e.employee_code
+            WHERE fe.status = 'ACTIVE' AND e.status = 'ACTIVE'
+        """, fetch=True)
+        active = {row['id']: row['row_version'] for row in rows}
+        count = self._snapshot.count
+        snapshot_versions = dict(zip(self._snapshot.ids[:count].tolist(), self._snapshot.versions[:count].tolist()))
+
+        stale = [face_id for face_id in self._row_by_id if face_id not in active]
+        missing = [face_id for face_id in active if face_id not in self._row_by_id]
+        changed = [face_id for face_id, version in active.items()
+                   if face_id in self._row_by_id and snapshot_versions.get(face_id) != version]
+        for face_id in stale:
+            self.remove(face_id)
+        if missing or changed:
+            added = db_manager.execute_query("""
+                SELECT id, employee_id, vector, quality_score
+                FROM face_embeddings
+                WHERE id = ANY(%s)
+            """, (missing + changed,), fetch=True)
+            for row in added:
+                self.upsert(row['id'], row['employee_id'], row['vector'], row['quality_score'])
+        if stale or missing or changed:
+            logger.info(f"Gallery snapshot reconciled: -{len(stale)} +{len(missing)} ~{len(changed)} embeddings")
+
+    def ensure_loaded(self):
+        """Load the gallery on first use (after LISTEN is active, so no change is missed)"""
+        if not self._loaded:
+            # Waited for outside the gallery lock: concurrent searches are not held up to 5 s
+            self.start_listener()
+            with self._lock:
+                if not self._loaded:
+                    self.load()
+
+    def start_listener(self):
+        """Start the LISTEN/NOTIFY thread that applies row-level deltas, and wait until it listens"""
+        if not Config.GALLERY_LISTEN_ENABLED:
+            return
+        with self._listener_lock:
+            if self._listener is None:
+                self._listener = GalleryListener(self)
+                self._listener.start()
+            listener = self._listener
+        if not listener.ready.wait(timeout=5):
+            logger.warning("Face gallery listener not ready, changes from other workers may be delayed")
+
+    def stop_listener(self):
+        """Stop the LISTEN/NOTIFY thread"""
+        with self._listener_lock:
+            if self._listener is not None:
+                self._listener.stop()
+                self._listener = None
+
+    def employee_count(self) -> int:
+        return len(self._slot_by_code)
+
+    @staticmethod
+    def _fit_scale(vectors: np.ndarray) -> np.ndarray:
+        """Per-dimension int8 scale with 25% headroom for templates enrolled after the load"""
+        peak = np.abs(vectors).max(axis=0) * 1.25
+        return (np.where(peak > 0, peak, 1.0) / 127.0).astype(np.float32)
+
+    def _quantize(self, vector: np.ndarray) -> np.ndarray:
+        """Encode a float32 vector in the storage dtype"""
+        if self.storage == 'int8':
+            if self._scale is None:
+                self._scale = self._fit_scale(np.atleast_2d(vector))
+            return np.clip(np.rint(vector / self._scale), -127, 127).astype(np.int8)
+        return vector.astype(self._dtype)
+
+    def _dequantize(self, block: np.ndarray) -> np.ndarray:
+        """Decode stored rows back to (approximate) float32"""
+        if self.storage == 'int8':
+            return block.astype(np.float32) * self._scale
+        return block.astype(np.float32, copy=False)
+
+    def _grow(self, capacity: int):
+        """Grow backing arrays (amortised doubling)"""
+        new_capacity = max(capacity, 2 * len(self._ids), 64)
+        vectors = np.empty((new_capacity, self.dimension), dtype=self._dtype)
+        vectors[:self._size] = self._vectors[:self._size]
+        self._vectors = vectors
+        for name in ('_sq_norms', '_ids', '_quality', '_slots'):
+            old = getattr(self, name)
+            new = np.empty(new_capacity, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def _acquire_slot(self, employee_code: str) -> int:
+        slot = self._slot_by_code.get(employee_code)
+        if slot is None:
+            if self._free_slots:
+                slot = self._free_slots.pop()
+                self._code_by_slot[slot] = employee_code
+                self._slot_counts[slot] = 0
+            else:
+                slot = len(self._code_by_slot)
+                self._code_by_slot.append(employee_code)
+                self._slot_counts.append(0)
+                self._rows_by_slot.append(set())
+                if slot >= len(self._centroids):
+                    self._grow_centroids(slot + 1)
+            self._slot_by_code[employee_code] = slot
+        self._slot_counts[slot] += 1
+        return slot
+
+    def _release_slot(self, slot: int):
+        self._slot_counts[slot] -= 1
+        if self._slot_counts[slot] == 0:
+            del self._slot_by_code[self._code_by_slot[slot]]
+            self._code_by_slot[slot] = None
+            self._free_slots.append(slot)
+
+    def _grow_centroids(self, capacity: int):
+        """Grow the per-employee centroid arrays (amortised doubling)"""
+        new_capacity = max(capacity, 2 * len(self._centroids), 64)
+        for name in ('_centroids', '_centroid_sq_norms'):
+            old = getattr(self, name)
+            new = np.zeros((new_capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def _update_centroid(self, slot: int):
+        """Recompute an employee centroid from its current templates"""
+        rows = list(self._rows_by_slot[slot])
+        if rows:
+            centroid = self._dequantize(self._vectors[rows]).mean(axis=0, dtype=np.float64).astype(np.float32)
+        else:
+            centroid = np.zeros(self.dimension, dtype=np.float32)
+        self._centroids[slot] = centroid
+        self._centroid_sq_norms[slot] = float(np.dot(centroid, centroid))
+
+    def _append(self, face_id: int, employee_code: str, vector: np.ndarray, quality_score: float):
+        """Append a new row (caller holds the lock)"""
+        if vector.shape != (self.dimension,):
+            raise ValueError(f"Embedding must have {self.dimension} dimensions, got {vector.shape}")
+        if self._size >= len(self._ids):
+            self._grow(self._size + 1)
+        row = self._size
+        self._size += 1
+        self._row_by_id[face_id] = row
+        self._vectors[row] = self._quantize(vector)
+        self._sq_norms[row] = float(np.dot(vector, vector))
+        self._ids[row] = face_id
+        self._quality[row] = quality_score or 0.0
+        slot = self._acquire_slot(employee_code)
+        self._slots[row] = slot
+        self._rows_by_slot[slot].add(row)
+        self._update_centroid(slot)
+
+    def upsert(self, face_id: int, employee_code: str, vector, quality_score: float = 0.0):
+        """Add or replace a single embedding"""
+        vector = to_vector(vector)
+        if vector.shape != (self.dimension,):
+            raise ValueError(f"Embedding must have {self.dimension} dimensions, got {vector.shape}")
+
+        with self._lock:
+            if not self._loaded:
+                return
+            self.remove(face_id)
+            self._append(face_id, employee_code, vector, quality_score)
+
+    def remove(self, face_id: int) -> bool:
+        """Remove a single embedding (swap-with-last, O(1))"""
+        with self._lock:
+            self._exact_cache.pop(face_id, None)
+            row = self._row_by_id.pop(face_id, None)
+            if row is None:
+                return False
+            self._generation += 1
+            slot = int(self._slots[row])
+            self._rows_by_slot[slot].discard(row)
+            self._release_slot(slot)
+            self._update_centroid(slot)
+            last = self._size - 1
+            if row != last:
+                moved_slot = int(self._slots[last])
+                self._rows_by_slot[moved_slot].discard(last)
+                self._rows_by_slot[moved_slot].add(row)
+                self._vectors[row] = self._vectors[last]
+                self._sq_norms[row] = self._sq_norms[last]
+                self._ids[row] = self._ids[last]
+                self._quality[row] = self._quality[last]
+                self._slots[row] = self._slots[last]
+                self._row_by_id[int(self._ids[row])] = row
+            self._size = last
+            return True
+
+    def refresh(self, face_id: int) -> bool:
+        """
+        Re-read a single embedding by primary key and apply it to the gallery.
+        Returns True if the embedding is (still) active.
+        """
+        if not self._loaded:
+            return False
+        query = """
+            SELECT fe.id, fe.employee_id, fe.vector, fe.quality_score
+            FROM face_embeddings fe
+            JOIN employees e ON fe.employee_id = e.employee_code
+            WHERE fe.id = %s AND fe.status = 'ACTIVE' AND e.status = 'ACTIVE'
+        """
+        row = db_manager.execute_one(query, (face_id,))
+        if row:
+            self.upsert(row['id'], row['employee_id'], row['vector'], row['quality_score'])
+            return True
+        self.remove(face_id)
+        return False
+
+    def refresh_employee(self, employee_code: str) -> int:
+        """Re-read every active embedding of an employee (indexed by employee_id)"""
+        if not self._loaded:
+            return 0
+        query = """
+            SELECT fe.id, fe.employee_id, fe.vector, fe.quality_score
+            FROM face_embeddings fe
+            JOIN employees e ON fe.employee_id = e.employee_code
+            WHERE fe.employee_id = %s AND fe.status = 'ACTIVE' AND e.status = 'ACTIVE'
+        """
+        rows = db_manager.execute_query(query, (employee_code,), fetch=True)
+        with self._lock:
+            self.remove_employee(employee_code)
+            for row in rows:
+                self.upsert(row['id'], row['employee_id'], row['vector'], row['quality_score'])
+        return len(rows)
+
+    def remove_employee(self, employee_code: str) -> int:
+        """Remove every embedding of an employee"""
+        with self._lock:
+            slot = self._slot_by_code.get(employee_code)
+            if slot is None:
+                return 0
+            face_ids = [int(self._ids[row]) for row in self._rows_by_slot[slot]]
+            for face_id in face_ids:
+                self.remove(face_id)
+            return len(face_ids)
+
+    @staticmethod
+    def _pairwise(probes: np.ndarray, vectors: np.ndarray, sq_norms: np.ndarray, metric: str) -> np.ndarray:
+        """Distances between probes (M x D) and vectors (N x D) with precomputed squared norms -> (M x N)"""
+        dots = probes @ vectors.T
+        if metric == 'l2':
+            probe_sq = np.einsum('ij,ij->i', probes, probes)[:, None]
+            squared = probe_sq - 2.0 * dots + sq_norms[None, :]
+            return np.sqrt(np.maximum(squared, 0.0))
+        # cosine distance
+        norms = np.sqrt(sq_norms)[None, :] * np.linalg.norm(probes, axis=1)[:, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            similarity = np.where(norms > 0, dots / norms, 0.0)
+        return 1.0 - similarity
+
+    def _distances(self, probes: np.ndarray, metric: str) -> np.ndarray:
+        """Distances between probes (M x D) and every gallery row -> (M x N)"""
+        if not self.quantized:
+            return self._pairwise(probes, self._vectors[:self._size], self._sq_norms[:self._size], metric)
+        # Coarse scores on the compact matrix, dequantized block by block
+        distances = np.empty((len(probes), self._size), dtype=np.float32)
+        for start in range(0, self._size, SCORE_CHUNK_ROWS):
+            end = min(start + SCORE_CHUNK_ROWS, self._size)
+            distances[:, start:end] = self._pairwise(probes, self._dequantize(self._vectors[start:end]),
+                                                     self._sq_norms[start:end], metric)
+        return distances
+
+    def _fetch_exact(self, face_ids: List[int]) -> Dict[int, np.ndarray]:
+        """Full-precision vectors from face_embeddings by primary key"""
+        rows = db_manager.execute_query(
+            "SELECT id, vector FROM face_embeddings WHERE id = ANY(%s)", (face_ids,), fetch=True
+        )
+        return {row['id']: to_vector(row['vector']) for row in rows}
+
+    def _prefetch_exact(self, candidates: List[np.ndarray]) -> Dict[int, np.ndarray]:
+        """
+        Fetch the full-precision vectors of candidate face ids missing from the cache.
+        Called without the lock, so the database round trip does not block searches
+        and delta updates; the result is only kept if no row changed meanwhile.
+        """
+        with self._lock:
+            generation = self._generation
+            missing = sorted({int(face_id) for face_ids in candidates for face_id in face_ids}
+                             - self._exact_cache.keys())
+        if not missing:
+            return {}
+        try:
+            fetched = self._fetch_exact(missing)
+        except Exception as e:
+            logger.warning(f"Re-ranking falls back to stored vectors: {e}")
+            return {}
+
+        with self._lock:
+            if self._generation != generation:
+                # A row was replaced after the fetch started: its vector may be the old one
+                return {}
+            for face_id, vector in fetched.items():
+                self._exact_cache[face_id] = vector
+            while len(self._exact_cache) > Config.GALLERY_RERANK_CACHE_SIZE:
+                self._exact_cache.popitem(last=False)
+        return fetched
+
+    def _exact_vectors(self, face_ids: np.ndarray, fetched: Dict[int, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Current rows and full-precision vectors of candidate face ids (caller holds the lock).
+        Ids removed since the coarse pass are skipped; rows are looked up again because
+        swap-remove may have moved them.
+        """
+        rows = []
+        vectors = []
+        for face_id in face_ids.tolist():
+            row = self._row_by_id.get(face_id)
+            if row is None:
+                continue
+            vector = self._exact_cache.get(face_id)
+            if vector is not None:
+                self._exact_cache.move_to_end(face_id)
+            else:
+                vector = fetched.get(face_id)
+                if vector is None:
+                    vector = self._dequantize(self._vectors[row])
+            rows.append(row)
+            vectors.append(vector)
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty((0, self.dimension), dtype=np.float32)
+        return np.array(rows, dtype=np.int64), np.vstack(vectors).astype(np.float32, copy=False)
+
+    def _rerank_candidates(self, rows: np.ndarray, coarse: np.ndarray, limit: int) -> np.ndarray:
+        """Face ids of the best coarse candidates to re-rank (caller holds the lock)"""
+        count = min(max(Config.GALLERY_RERANK_CANDIDATES, limit), len(rows))
+        return self._ids[rows[self._smallest(coarse, count)]].copy()
+
+    def _rerank(self, probe: np.ndarray, face_ids: np.ndarray, fetched: Dict[int, np.ndarray],
+                metric: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Re-rank coarse candidates against full-precision vectors (caller holds the lock).
+        Returns (rows, exact distances), closest first.
+        """
+        rows, vectors = self._exact_vectors(face_ids, fetched)
+        exact = self._pairwise(probe[None, :], vectors, np.einsum('ij,ij->i', vectors, vectors), metric)[0]
+        order = np.argsort(exact)
+        return rows[order], exact[order]
+
+    def _rerank_employees(self, probe: np.ndarray, face_ids: np.ndarray, fetched: Dict[int, np.ndarray],
+                          metric: str, k: int) -> List[Dict[str, Any]]:
+        """Re-rank candidates and keep the best template of the k closest employees"""
+        ranked_rows, exact = self._rerank(probe, face_ids, fetched, metric)
+        candidates = []
+        seen = set()
+        for row, distance in zip(ranked_rows, exact):
+            employee_code = self._code_by_slot[self._slots[row]]
+            if employee_code in seen:
+                continue
+            seen.add(employee_code)
+            candidates.append({'employee_code': employee_code, 'distance': float(distance)})
+            if len(candidates) == k:
+                break
+        return candidates
+
+    @property
+    def _reranking(self) -> bool:
+        return self.quantized and Config.GALLERY_RERANK_CANDIDATES > 0
+
+    @staticmethod
+    def _smallest(values: np.ndarray, k: int) -> np.ndarray:
+        """Indexes of the k smallest values, closest first (argpartition, O(n))"""
+        if k == 1:
+            return np.array([np.argmin(values)])
+        nearest = np.argpartition(values, k - 1)[:k]
+        return nearest[np.argsort(values[nearest])]
+
+    def search(self, probe: np.ndarray, metric: str = 'l2', k: int = 1) -> List[Dict[str, Any]]:
+        """
+        Find the k nearest templates to a probe.
+        Returns a list of {face_id, employee_code, distance, quality_score}, closest first.
+        """
+        return self.search_batch(np.asarray(probe, dtype=np.float32)[None, :], metric, k)[0]
+
+    def search_batch(self, probes: np.ndarray, metric: str = 'l2', k: int = 1) -> List[List[Dict[str, Any]]]:
+        """Match a block of probes (M x D) against the gallery in one matrix product"""
+        self.ensure_loaded()
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, self.dimension)
+
+        with self._lock:
+            if self._size == 0:
+                return [[] for _ in range(len(probes))]
+            distances = self._distances(probes, metric)
+            k = max(1, min(k, self._size))
+            if not self._reranking:
+                return [[{
+                    'face_id': int(self._ids[row]),
+                    'employee_code': self._code_by_slot[self._slots[row]],
+                    'distance': float(row_distances[row]),
+                    'quality_score': float(self._quality[row])
+                } for row in self._smallest(row_distances, k)] for row_distances in distances]
+            rows = np.arange(self._size)
+            candidates = [self._rerank_candidates(rows, row_distances, k) for row_distances in distances]
+
+        fetched = self._prefetch_exact(candidates)
+        with self._lock:
+            results = []
+            for probe, face_ids in zip(probes, candidates):
+                rows, exact = self._rerank(probe, face_ids, fetched, metric)
+                results.append([{
+                    'face_id': int(self._ids[row]),
+                    'employee_code': self._code_by_slot[self._slots[row]],
+                    'distance': float(distance),
+                    'quality_score': float(self._quality[row])
+                } for row, distance in zip(rows[:k], exact[:k])])
+            return results
+
+    def search_employees(self, probe: np.ndarray, metric: str = 'l2', k: int = 1) -> List[Dict[str, Any]]:
+        """
+        Find the k closest distinct employees (best template per employee).
+        Returns a list of {employee_code, distance}, closest first.
+        """
+        return self.search_employees_batch(np.asarray(probe, dtype=np.float32)[None, :], metric, k)[0]
+
+    def _use_prefilter(self, k: int) -> bool:
+        """Two-stage search only pays off on large galleries with several templates per employee"""
+        return (Config.GALLERY_CENTROID_PREFILTER and
+                self._size >= Config.GALLERY_PREFILTER_MIN_TEMPLATES and
+                self.employee_count() > max(Config.GALLERY_CENTROID_SHORTLIST, k))
+
+    def search_employees_batch(self, probes: np.ndarray, metric: str = 'l2',
+                               k: int = 1) -> List[List[Dict[str, Any]]]:
+        """Closest distinct employees for a block of probes, O(n) per probe (no full sort)"""
+        self.ensure_loaded()
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, self.dimension)
+
+        with self._lock:
+            if self._size == 0:
+                return [[] for _ in range(len(probes))]
+            if self._use_prefilter(k):
+                results = self._search_employees_two_stage(probes, metric, k)
+            else:
+                results = self._search_employees_exhaustive(probes, metric, k)
+            if not self._reranking:
+                return results
+            k = max(1, min(k, self.employee_count()))
+
+        # Re-ranking: results hold the candidate face ids of every probe
+        fetched = self._prefetch_exact(results)
+        with self._lock:
+            return [self._rerank_employees(probe, face_ids, fetched, metric, k)
+                    for probe, face_ids in zip(probes, results)]
+
+    def _search_employees_exhaustive(self, probes: np.ndarray, metric: str, k: int) -> List[Any]:
+        """
+        Best template per employee over every row (caller holds the lock).
+        With re-ranking, returns the candidate face ids of each probe instead.
+        """
+        distances = self._distances(probes, metric)
+        slots = self._slots[:self._size]
+        k = max(1, min(k, self.employee_count()))
+
+        results = []
+        for row_distances in distances:
+            if self._reranking:
+                results.append(self._rerank_candidates(np.arange(self._size), row_distances, k))
+                continue
+            # Best template per employee slot; freed slots stay at +inf
+            per_employee = np.full(len(self._code_by_slot), np.inf, dtype=row_distances.dtype)
+            np.minimum.at(per_employee, slots, row_distances)
+            candidates = []
+            for slot in self._smallest(per_employee, k):
+                if not np.isfinite(per_employee[slot]):
+                    break
+                candidates.append({
+                    'employee_code': self._code_by_slot[slot],
+                    'distance': float(per_employee[slot])
+                })
+            results.append(candidates)
+        return results
+
+    def _search_employees_two_stage(self, probes: np.ndarray, metric: str, k: int) -> List[Any]:
+        """
+        Stage 1: score per-employee centroids and shortlist the closest M employees.
+        Stage 2: comparison against the templates of the shortlisted employees only
+        (with re-ranking, returns the candidate face ids of each probe instead).
+        """
+        slot_count = len(self._code_by_slot)
+        shortlist_size = max(Config.GALLERY_CENTROID_SHORTLIST, k)
+        centroid_distances = self._pairwise(probes, self._centroids[:slot_count],
+                                            self._centroid_sq_norms[:slot_count], metric)
+        empty = np.array([count == 0 for count in self._slot_counts])
+        centroid_distances[:, empty] = np.inf
+
+        results = []
+        for probe, row_distances in zip(probes, centroid_distances):
+            shortlist = [int(slot) for slot in self._smallest(row_distances, shortlist_size)
+                         if np.isfinite(row_distances[slot])]
+            row_groups = [np.fromiter(self._rows_by_slot[slot], dtype=np.int64,
+                                      count=len(self._rows_by_slot[slot])) for slot in shortlist]
+            rows = np.concatenate(row_groups)
+            distances = self._pairwise(probe[None, :], self._dequantize(self._vectors[rows]),
+                                       self._sq_norms[rows], metric)[0]
+            if self._reranking:
+                results.append(self._rerank_candidates(rows, distances, k))
+                continue
+
+            # Best template per shortlisted employee (rows are grouped by employee)
+            offsets = np.cumsum([0] + [len(group) for group in row_groups[:-1]])
+            per_employee = np.minimum.reduceat(distances, offsets)
+            order = self._smallest(per_employee, min(k, len(shortlist)))
+            results.append([{
+                'employee_code': self._code_by_slot[shortlist[index]],
+                'distance': float(per_employee[index])
+            } for index in order])
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        """Gallery size and memory usage"""
+        with self._lock:
+            return {
+                'loaded': self._loaded,
+                'size': self._size,
+                'employees': self.employee_count(),
+                'capacity': len(self._ids),
+                'dimension': self.dimension,
+                'storage': self.storage,
+                'snapshot': {
+                    'path': self._snapshot.path,
+                    'created_at': self._snapshot.created_at,
+                    'shared_matrix': self._vectors is self._snapshot.vectors
+                } if self._snapshot is not None else None,
+                'centroid_prefilter': self._use_prefilter(1),
+                'rerank_candidates': Config.GALLERY_RERANK_CANDIDATES if self._reranking else 0,
+                'rerank_cache_size': len(self._exact_cache),
+                'vectors_bytes': int(self._vectors.nbytes),
+                'memory_bytes': int(self._vectors.nbytes + self._sq_norms.nbytes + self._ids.nbytes +
+                                    self._quality.nbytes + self._slots.nbytes + self._centroids.nbytes +
+                                    len(self._exact_cache) * self.dimension * 4)
+            }
+
+
+class GalleryListener(threading.Thread):
+    """
+    Background thread that LISTENs on Config.GALLERY_NOTIFY_CHANNEL and applies
+    row-level changes (emitted by triggers on face_embeddings / employees) to the
+    gallery, so every worker stays current without reloading the full table.
+    """
+
+    def __init__(self, gallery: FaceGallery, channel: str = Config.GALLERY_NOTIFY_CHANNEL):
+        super().__init__(name='face-gallery-listener', daemon=True)
+        self.gallery = gallery
+        self.channel = channel
+        self.ready = threading.Event()
+        self._stop_event = threading.Event()
+        self._connected_before = False
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self._listen()
+            except Exception as e:
+                logger.error(f"Face gallery listener error: {e}")
+                self._stop_event.wait(Config.GALLERY_LISTEN_RETRY_SECONDS)
+
+    def _listen(self):
+        conn = psycopg2.connect(Config.DATABASE_URL)
+        try:
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {self.channel};")
+            logger.info(f"Face gallery listening on channel '{self.channel}'")
+
+            # Notifications sent while disconnected are lost, resync once
+            if self._connected_before and self.gallery.loaded:
+                self.gallery.load()
+            self._connected_before = True
+            self.ready.set()
+
+            while not self._stop_event.is_set():
+                if select.select([conn], [], [], 1.0) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    self._apply(notify.payload)
+        finally:
+            conn.close()
+
+    def _apply(self, payload: str):
+        """Apply a single change notification"""
+        try:
+            change = json.loads(payload)
+            if change.get('table') == 'snapshot':
+                # A new snapshot file was renamed into place: re-map it
+                if self.gallery.loaded:
+                    self.gallery.load()
+            elif change.get('table') == 'employees':
+                if change.get('status') == 'ACTIVE':
+                    self.gallery.refresh_employee(change['employee_code'])
+                else:
+                    self.gallery.remove_employee(change['employee_code'])
+            elif change.get('op') == 'DELETE':
+                self.gallery.remove(int(change['id']))
+            else:
+                self.gallery.refresh(int(change['id']))
+        except Exception as e:
+            logger.warning(f"Could not apply gallery change {payload!r}: {e}")
+
+
+# Global face gallery instance
+face_gallery = FaceGallery()
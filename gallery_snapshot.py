@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Gallery snapshot file shared by every worker on a host.
+
+Layout (little endian, sections aligned to 64 bytes):
+    header      magic 'FCGS', version, dimension, count, capacity, n_codes, created_at
+    vectors     float32 [capacity x dimension]   rows >= count are headroom
+    ids         int64   [capacity]
+    versions    int64   [capacity]               xmin of the face_embeddings row
+    quality     float32 [capacity]
+    code_index  int32   [capacity]               index into the code table
+    code table  int64   [n_codes + 1] offsets, followed by the utf-8 employee codes
+
+Workers open the file with np.memmap (copy-on-write), so the matrix is backed by
+one page-cached copy per host; deltas applied by a worker only copy the touched
+pages. The loader job writes a new file, renames it over the old one and sends a
+NOTIFY so every worker re-maps it.
+
+Usage: python gallery_snapshot.py [path]
+"""
+
+import os
+import sys
+import json
+import time
+import struct
+import logging
+from typing import List, Dict, Any, Optional
+import numpy as np
+from database import db_manager
+from config import Config
+from vector_codec import to_vector
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'FCGS'
+VERSION = 2
+HEADER = struct.Struct('<4sIIQQQd')
+ALIGNMENT = 64
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _layout(dimension: int, capacity: int) -> Dict[str, int]:
+    """Byte offsets of every section"""
+    offsets = {'vectors': _align(HEADER.size)}
+    offsets['ids'] = _align(offsets['vectors'] + capacity * dimension * 4)
+    offsets['versions'] = _align(offsets['ids'] + capacity * 8)
+    offsets['quality'] = _align(offsets['versions'] + capacity * 8)
+    offsets['code_index'] = _align(offsets['quality'] + capacity * 4)
+    offsets['codes'] = _align(offsets['code_index'] + capacity * 4)
+    return offsets
+
+
+class GallerySnapshot:
+    """Memory-mapped view of a snapshot file"""
+
+    def __init__(self, path: str, mode: str = 'c'):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, version, dimension, count, capacity, n_codes, created_at = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"Not a gallery snapshot (version {VERSION}): {path}")
+            offsets = _layout(dimension, capacity)
+            f.seek(offsets['codes'])
+            bounds = np.frombuffer(f.read((n_codes + 1) * 8), dtype=np.int64)
+            blob = f.read(int(bounds[-1]))
+
+        self.dimension = dimension
+        self.count = count
+        self.capacity = capacity
+        self.created_at = created_at
+        self.inode = os.stat(path).st_ino
+        self.codes: List[str] = [blob[bounds[i]:bounds[i + 1]].decode('utf-8') for i in range(n_codes)]
+        self.vectors = np.memmap(path, dtype=np.float32, mode=mode, offset=offsets['vectors'],
+                                 shape=(capacity, dimension))
+        self.ids = np.memmap(path, dtype=np.int64, mode=mode, offset=offsets['ids'], shape=(capacity,))
+        self.versions = np.memmap(path, dtype=np.int64, mode=mode, offset=offsets['versions'], shape=(capacity,))
+        self.quality = np.memmap(path, dtype=np.float32, mode=mode, offset=offsets['quality'], shape=(capacity,))
+        self.code_index = np.memmap(path, dtype=np.int32, mode=mode, offset=offsets['code_index'],
+                                    shape=(capacity,))
+
+
+def read_snapshot(path: str, mode: str = 'c') -> GallerySnapshot:
+    """Open a snapshot file (mode 'c' = copy-on-write, 'r' = read-only)"""
+    return GallerySnapshot(path, mode=mode)
+
+
+def write_snapshot(path: str, rows, count: int, dimension: int = Config.EMBEDDING_DIMENSION,
+                   headroom: float = Config.GALLERY_SNAPSHOT_HEADROOM) -> Dict[str, Any]:
+    """
+    Write `count` rows of {id, employee_id, vector, quality_score, row_version} (any iterable)
+    to `path` atomically: the file is written next to the target and renamed over it.
+    """
+    capacity = max(count + int(count * headroom), 64)
+    offsets = _layout(dimension, capacity)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    try:
+        return _write_file(path, tmp_path, rows, count, dimension, capacity, offsets)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _write_file(path: str, tmp_path: str, rows, count: int, dimension: int, capacity: int,
+                offsets: Dict[str, int]) -> Dict[str, Any]:
+    with open(tmp_path, 'wb') as f:
+        f.truncate(offsets['codes'])
+    vectors = np.memmap(tmp_path, dtype=np.float32, mode='r+', offset=offsets['vectors'],
+                        shape=(capacity, dimension))
+    ids = np.memmap(tmp_path, dtype=np.int64, mode='r+', offset=offsets['ids'], shape=(capacity,))
+    versions = np.memmap(tmp_path, dtype=np.int64, mode='r+', offset=offsets['versions'], shape=(capacity,))
+    quality = np.memmap(tmp_path, dtype=np.float32, mode='r+', offset=offsets['quality'], shape=(capacity,))
+    code_index = np.memmap(tmp_path, dtype=np.int32, mode='r+', offset=offsets['code_index'], shape=(capacity,))
+
+    index_by_code: Dict[str, int] = {}
+    written = 0
+    try:
+        for row in rows:
+            if written >= count:
+                break
+            vector = to_vector(row['vector'])
+            if vector.shape != (dimension,):
+                logger.warning(f"Skipping embedding {row['id']}: {vector.shape}")
+                continue
+            vectors[written] = vector
+            ids[written] = row['id']
+            versions[written] = row.get('row_version') or 0
+            quality[written] = row['quality_score'] or 0.0
+            code_index[written] = index_by_code.setdefault(row['employee_id'], len(index_by_code))
+            written += 1
+        for array in (vectors, ids, versions, quality, code_index):
+            array.flush()
+    finally:
+        del vectors, ids, versions, quality, code_index
+
+    encoded = [code.encode('utf-8') for code in index_by_code]
+    bounds = np.zeros(len(encoded) + 1, dtype=np.int64)
+    bounds[1:] = np.cumsum([len(code) for code in encoded])
+    created_at = time.time()
+    with open(tmp_path, 'r+b') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, dimension, written, capacity, len(encoded), created_at))
+        f.seek(offsets['codes'])
+        f.write(bounds.tobytes())
+        f.write(b''.join(encoded))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+    return {
+        'path': path,
+        'count': written,
+        'capacity': capacity,
+        'employees': len(encoded),
+        'bytes': os.path.getsize(path),
+        'created_at': created_at
+    }
+
+
+def build_snapshot(path: Optional[str] = None, notify: bool = True) -> Dict[str, Any]:
+    """
+    Loader job: stream ACTIVE embeddings from face_embeddings into a new snapshot
+    and signal the workers (NOTIFY) to re-map it.
+    """
+    path = path or Config.GALLERY_SNAPSHOT_PATH
+    if not path:
+        raise ValueError("GALLERY_SNAPSHOT_PATH is not configured")
+
+    started = time.time()
+    with db_manager.get_connection() as conn:
+        # Count and rows from the same snapshot of the table
+        conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT count(*) AS count
+                    FROM face_embeddings fe
+                    JOIN employees e ON fe.employee_id = e.employee_code
+                    WHERE fe.status = 'ACTIVE' AND e.status = 'ACTIVE'
+                """)
+                count = int(cursor.fetchone()['count'])
+            # Server-side cursor: rows are streamed instead of fetched all at once
+            with conn.cursor(name='gallery_snapshot') as cursor:
+                cursor.itersize = 5000
+                cursor.execute("""
+                    SELECT fe.id, fe.employee_id, fe.vector, fe.quality_score,
+                           fe.xmin::text::bigint AS row_version
+                    FROM face_embeddings fe
+                    JOIN employees e ON fe.employee_id = e.employee_code
+                    WHERE fe.status = 'ACTIVE' AND e.status = 'ACTIVE'
+                    ORDER BY fe.employee_id, fe.id
+                """)
+                report = write_snapshot(path, cursor, count)
+            conn.commit()
+        finally:
+            conn.rollback()
+            conn.set_session(isolation_level='DEFAULT', readonly=False)
+
+    report['build_seconds'] = round(time.time() - started, 3)
+    if notify:
+        payload = json.dumps({'table': 'snapshot', 'op': 'SWAP', 'path': path})
+        db_manager.execute_query("SELECT pg_notify(%s, %s)", (Config.GALLERY_NOTIFY_CHANNEL, payload))
+    logger.info(f"Gallery snapshot written: {report['count']} embeddings, {report['bytes']} bytes -> {path}")
+    return report
+
+
+if __name__ == "__main__":
+    target = sys.argv[1] if len(sys.argv) > 1 else None
+    print(json.dumps(build_snapshot(target), indent=2))
@@ -3,7 +3,7 @@ API Client for communicating with Flask Face Recognition API
 """
 import requests
 import logging
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Iterator
 from io import BytesIO
 from PIL import Image
 import json
@@ -214,7 +214,7 @@ class APIClient:
         limit: int = 100
     ) -> List[Dict[str, Any]]:
         """
-        Get attendance logs
+        Get attendance logs (newest first, first page only)
         
         Args:
             employee_code: Filter by employee code (optional)
@@ -226,6 +226,30 @@ class APIClient:
         Returns:
             List of attendance log dictionaries
         """
+        return self.get_attendance_logs_page(
+            employee_code, device_code, date_from, date_to, limit
+        )['data']
+    
+    def get_attendance_logs_page(
+        self,
+        employee_code: str = None,
+        device_code: str = None,
+        date_from: str = None,
+        date_to: str = None,
+        limit: int = 100,
+        cursor: str = None
+    ) -> Dict[str, Any]:
+        """
+        Get one page of attendance logs
+        
+        Args:
+            employee_code, device_code, date_from, date_to: Filters as in get_attendance_logs
+            limit: Page size (default: 100)
+            cursor: next_cursor of the previous page (None for the first page)
+        
+        Returns:
+            {'data': [...], 'next_cursor': str or None when there are no more pages}
+        """
         params = {'limit': limit}
         
         if employee_code:
@@ -236,9 +260,37 @@ class APIClient:
             params['date_from'] = date_from
         if date_to:
             params['date_to'] = date_to
+        if cursor:
+            params['cursor'] = cursor
         
         result = self._make_request('GET', '/api/attendance/logs', params=params)
-        return result.get('data', [])
+        return {
+            'data': result.get('data', []),
+            'next_cursor': result.get('next_cursor')
+        }
+    
+    def iter_attendance_logs(
+        self,
+        employee_code: str = None,
+        device_code: str = None,
+        date_from: str = None,
+        date_to: str = None,
+        page_size: int = 100
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Iterate over all matching attendance logs, newest first
+        
+        Pages are requested lazily, only when the previous one is consumed.
+        """
+        cursor = None
+        while True:
+            page = self.get_attendance_logs_page(
+                employee_code, device_code, date_from, date_to, page_size, cursor
+            )
+            yield from page['data']
+            cursor = page['next_cursor']
+            if not cursor:
+                return
     
     def get_face_embeddings(self, employee_code: str = None) -> List[Dict[str, Any]]:
         """
@@ -0,0 +1,59 @@
+import io
+import math
+import logging
+from typing import Tuple
+import numpy as np
+import cv2
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# EXIF orientations that swap width and height (90 / 270 degree rotations)
+_TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+_EXIF_ORIENTATION_TAG = 0x0112
+
+
+def decode_image(image_data: bytes, max_side: int) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """
+    Decode an upload to an upright RGB uint8 array whose long side is at most max_side
+    Returns: (image_rgb, (original_width, original_height)) with the original size upright
+
+    JPEGs are decoded directly at the smallest DCT scale (1/2, 1/4, 1/8) that is
+    still at least max_side, so most of a large photo is never decoded; the rest
+    of the reduction is an area resize. EXIF orientation is applied.
+    """
+    image = Image.open(io.BytesIO(image_data))
+    width, height = image.size
+    orientation = image.getexif().get(_EXIF_ORIENTATION_TAG, 1)
+    original_size = (height, width) if orientation in _TRANSPOSED_ORIENTATIONS else (width, height)
+
+    long_side = max(width, height)
+    if image.format == 'JPEG' and long_side > max_side:
+        factor = max_side / long_side
+        # draft() keeps the decoded size >= the requested size in both dimensions
+        image.draft('RGB', (math.ceil(width * factor), math.ceil(height * factor)))
+
+    image = ImageOps.exif_transpose(image)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    image_rgb = np.array(image)
+
+    height, width = image_rgb.shape[:2]
+    if max(width, height) > max_side:
+        scale = max_side / max(width, height)
+        image_rgb = cv2.resize(image_rgb, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+    return image_rgb, original_size
+
+
+def detection_proxy(image_rgb: np.ndarray, size: int) -> Tuple[np.ndarray, float]:
+    """
+    Small copy of an image for face detection: long side at most `size` (0 = no proxy)
+    Returns: (proxy, scale) where proxy coordinates / scale = image coordinates
+    """
+    height, width = image_rgb.shape[:2]
+    if not size or max(width, height) <= size:
+        return image_rgb, 1.0
+    scale = size / max(width, height)
+    proxy = cv2.resize(image_rgb, (max(round(width * scale), 1), max(round(height * scale), 1)),
+                       interpolation=cv2.INTER_AREA)
+    return proxy, scale
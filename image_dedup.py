@@ -0,0 +1,82 @@
+import hashlib
+import threading
+import logging
+from typing import Optional, Dict, Any, Sequence
+from database import db_manager
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Run on every enroll: prepared once per connection
+# (char(64)[] keeps the comparison on the column type, so idx_face_embeddings_sha256 is used)
+FIND_BY_SHA256 = db_manager.prepare('face_embeddings_by_sha256', """
+    SELECT DISTINCT ON (sha256) id, sha256, employee_id
+    FROM face_embeddings
+    WHERE sha256 = ANY(%s::char(64)[]) AND status = 'ACTIVE'
+      AND model_name = %s AND model_version = %s
+    ORDER BY sha256, id
+""")
+
+
+def image_sha256(image_data: bytes) -> str:
+    """Content address of a raw upload (hash of the bytes as received, before any decoding)"""
+    return hashlib.sha256(image_data).hexdigest()
+
+
+class ImageDedup:
+    """
+    Lookup of stored embeddings by the sha256 of the raw upload.
+
+    Checked before decoding on enroll: an image that is already stored is
+    rejected instead of being extracted and uploaded again. Recognition does
+    not query it (a repeated probe is served by the embedding cache). Only rows
+    of the configured model (Config.FACE_MODEL_NAME / FACE_MODEL_VERSION) count.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._lookups = 0
+        self._hits = 0
+
+    @property
+    def enabled(self) -> bool:
+        return Config.IMAGE_DEDUP_ENABLED
+
+    def find(self, sha256: str) -> Optional[Dict[str, Any]]:
+        """Active embedding stored for this image, or None"""
+        return self.find_many([sha256]).get(sha256)
+
+    def find_many(self, hashes: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        """Active embeddings stored for these images, keyed by sha256"""
+        if not self.enabled or not hashes:
+            return {}
+        rows = db_manager.execute_prepared(
+            FIND_BY_SHA256, (list(set(hashes)), Config.FACE_MODEL_NAME, Config.FACE_MODEL_VERSION), fetch='all'
+        )
+        found = {row['sha256']: row for row in rows}
+        with self._lock:
+            self._lookups += len(hashes)
+            self._hits += sum(1 for sha256 in hashes if sha256 in found)
+        return found
+
+    def is_referenced(self, sha256: str, exclude_id: Optional[int] = None) -> bool:
+        """Whether a non-deleted embedding (other than exclude_id) still uses this image"""
+        row = db_manager.execute_one("""
+            SELECT 1 AS referenced FROM face_embeddings
+            WHERE sha256 = %s AND status != 'DELETED' AND id IS DISTINCT FROM %s
+            LIMIT 1
+        """, (sha256, exclude_id))
+        return row is not None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'lookups': self._lookups,
+                'hits': self._hits,
+                'hit_rate': round(self._hits / self._lookups, 4) if self._lookups else 0.0
+            }
+
+
+# Global image dedup instance
+image_dedup = ImageDedup()
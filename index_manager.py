@@ -0,0 +1,239 @@
+import math
+import time
+import json
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List
+import numpy as np
+from database import db_manager, VECTOR_OPCLASSES
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Advisory lock key so only one worker/host rebuilds at a time
+REBUILD_LOCK_KEY = 0x46434956  # 'FCIV'
+
+
+class IvfflatIndexManager:
+    """
+    Manage the IVFFlat index on face_embeddings.vector.
+
+    IVFFlat centroids are trained once at build time, so recall degrades as
+    enrollments accumulate. The manager records the row count at build time in
+    vector_index_state, and rebuilds the index concurrently (CREATE INDEX
+    CONCURRENTLY + swap) once the gallery has grown past
+    Config.IVFFLAT_REBUILD_GROWTH.
+    """
+
+    INDEX_NAME = 'idx_face_embeddings_vector_ivfflat'
+    BUILD_NAME = 'idx_face_embeddings_vector_ivfflat_new'
+
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+
+    @staticmethod
+    def lists_for_rows(row_count: int) -> int:
+        """pgvector guidance: rows / 1000 up to 1M rows, sqrt(rows) beyond"""
+        if row_count <= 1000000:
+            return max(1, row_count // 1000)
+        return int(math.sqrt(row_count))
+
+    @property
+    def opclass(self) -> str:
+        return VECTOR_OPCLASSES.get(Config.DISTANCE_METRIC, 'vector_l2_ops')
+
+    @property
+    def operator(self) -> str:
+        return '<=>' if Config.DISTANCE_METRIC == 'cosine' else '<->'
+
+    def active_row_count(self) -> int:
+        result = db_manager.execute_one(
+            "SELECT count(*) AS count FROM face_embeddings WHERE status = 'ACTIVE'"
+        )
+        return int(result['count'])
+
+    def get_state(self) -> Optional[Dict[str, Any]]:
+        query = """
+            SELECT index_name, index_type, lists, rows_at_build, built_at, report
+            FROM vector_index_state
+            WHERE index_name = %s
+        """
+        result = db_manager.execute_one(query, (self.INDEX_NAME,))
+        return dict(result) if result else None
+
+    def index_exists(self) -> bool:
+        result = db_manager.execute_one("SELECT to_regclass(%s) AS oid", (self.INDEX_NAME,))
+        return bool(result and result['oid'])
+
+    def drift(self, state: Optional[Dict[str, Any]] = None, row_count: Optional[int] = None) -> float:
+        """Relative growth of the gallery since the index was last trained"""
+        state = state or self.get_state()
+        row_count = self.active_row_count() if row_count is None else row_count
+        if not state:
+            return float('inf') if row_count else 0.0
+        built = max(int(state['rows_at_build']), 1)
+        return (row_count - built) / built
+
+    def status(self) -> Dict[str, Any]:
+        """Current index state, drift and last before/after report"""
+        state = self.get_state()
+        row_count = self.active_row_count()
+        drift = self.drift(state, row_count)
+        return {
+            'index_name': self.INDEX_NAME,
+            'index_exists': self.index_exists(),
+            'lists': state['lists'] if state else None,
+            'recommended_lists': self.lists_for_rows(row_count),
+            'rows_at_build': state['rows_at_build'] if state else None,
+            'built_at': state['built_at'].isoformat() if state else None,
+            'active_rows': row_count,
+            'drift': None if math.isinf(drift) else round(drift, 4),
+            'rebuild_threshold': Config.IVFFLAT_REBUILD_GROWTH,
+            'needs_rebuild': drift > Config.IVFFLAT_REBUILD_GROWTH,
+            'probes': Config.IVFFLAT_PROBES,
+            'last_report': state['report'] if state else None
+        }
+
+    @contextmanager
+    def _autocommit_connection(self):
+        """Pooled connection in autocommit mode (required by CREATE INDEX CONCURRENTLY)"""
+        with db_manager.get_connection() as conn:
+            conn.autocommit = True
+            try:
+                yield conn
+            finally:
+                conn.autocommit = False
+
+    def ensure_index(self):
+        """Create the IVFFlat index if it does not exist yet"""
+        if self.index_exists():
+            return
+        self.rebuild(force=True, measure=False)
+
+    def rebuild(self, force: bool = False, measure: bool = True) -> Dict[str, Any]:
+        """
+        Rebuild the index concurrently and swap it in.
+        Returns a report with recall/latency before and after the rebuild.
+        """
+        with self._autocommit_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT pg_try_advisory_lock(%s) AS locked", (REBUILD_LOCK_KEY,))
+                if not cursor.fetchone()['locked']:
+                    return {'rebuilt': False, 'reason': 'Rebuild already running in another worker'}
+                try:
+                    row_count = self.active_row_count()
+                    drift = self.drift(row_count=row_count)
+                    if not force and drift <= Config.IVFFLAT_REBUILD_GROWTH:
+                        return {'rebuilt': False, 'reason': 'Drift below threshold', 'drift': drift}
+
+                    before = self.measure() if measure and self.index_exists() else None
+                    lists = self.lists_for_rows(row_count)
+
+                    started = time.time()
+                    cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {self.BUILD_NAME};")
+                    cursor.execute(f"""
+                        CREATE INDEX CONCURRENTLY {self.BUILD_NAME}
+                        ON face_embeddings USING ivfflat (vector {self.opclass})
+                        WITH (lists = {int(lists)});
+                    """)
+                    # Swap atomically: the old index stays usable until this commits
+                    cursor.execute("BEGIN;")
+                    cursor.execute(f"DROP INDEX IF EXISTS {self.INDEX_NAME};")
+                    cursor.execute(f"ALTER INDEX {self.BUILD_NAME} RENAME TO {self.INDEX_NAME};")
+                    cursor.execute("COMMIT;")
+                    build_seconds = time.time() - started
+
+                    after = self.measure() if measure else None
+                    report = {
+                        'rebuilt': True,
+                        'lists': lists,
+                        'rows_at_build': row_count,
+                        'drift_before': None if math.isinf(drift) else round(drift, 4),
+                        'build_seconds': round(build_seconds, 3),
+                        'before': before,
+                        'after': after
+                    }
+                    cursor.execute("""
+                        INSERT INTO vector_index_state (index_name, index_type, lists, rows_at_build, built_at, report)
+                        VALUES (%s, 'ivfflat', %s, %s, now(), %s)
+                        ON CONFLICT (index_name) DO UPDATE
+                        SET lists = EXCLUDED.lists, rows_at_build = EXCLUDED.rows_at_build,
+                            built_at = EXCLUDED.built_at, report = EXCLUDED.report
+                    """, (self.INDEX_NAME, lists, row_count, json.dumps(report)))
+                    logger.info(f"IVFFlat index rebuilt: lists={lists}, rows={row_count}, {build_seconds:.1f}s")
+                    return report
+                finally:
+                    cursor.execute("SELECT pg_advisory_unlock(%s)", (REBUILD_LOCK_KEY,))
+
+    def measure(self, sample_size: int = None, k: int = 10, probes: int = None) -> Dict[str, Any]:
+        """
+        Recall@k and latency of the index against exact (sequential) search,
+        using a random sample of stored templates as probes.
+        """
+        sample_size = sample_size or Config.IVFFLAT_MEASURE_SAMPLE
+        probes = probes or Config.IVFFLAT_PROBES
+        samples = db_manager.execute_query(
+            "SELECT id, vector FROM face_embeddings WHERE status = 'ACTIVE' ORDER BY random() LIMIT %s",
+            (sample_size,), fetch=True
+        )
+        if not samples:
+            return {'samples': 0}
+
+        query = f"""
+            SELECT id FROM face_embeddings
+            WHERE status = 'ACTIVE'
+            ORDER BY vector {self.operator} %s::vector
+            LIMIT %s
+        """
+        recalls: List[float] = []
+        latencies: List[float] = []
+        for sample in samples:
+            started = time.perf_counter()
+            approx = db_manager.execute_with_settings(query, (sample['vector'], k),
+                                                      {'ivfflat.probes': probes})
+            latencies.append((time.perf_counter() - started) * 1000)
+            exact = db_manager.execute_with_settings(query, (sample['vector'], k),
+                                                     {'enable_indexscan': 'off'})
+            exact_ids = {row['id'] for row in exact}
+            if exact_ids:
+                recalls.append(len(exact_ids & {row['id'] for row in approx}) / len(exact_ids))
+
+        return {
+            'samples': len(samples),
+            'k': k,
+            'probes': probes,
+            'recall_at_k': round(float(np.mean(recalls)), 4) if recalls else None,
+            'latency_ms_p50': round(float(np.percentile(latencies, 50)), 3),
+            'latency_ms_p95': round(float(np.percentile(latencies, 95)), 3)
+        }
+
+    def maybe_rebuild(self) -> Optional[Dict[str, Any]]:
+        """Rebuild if the gallery has drifted past the threshold"""
+        try:
+            report = self.rebuild(force=False)
+            return report if report.get('rebuilt') else None
+        except Exception as e:
+            logger.error(f"IVFFlat auto-rebuild failed: {e}")
+            return None
+
+    def start_scheduler(self):
+        """Check drift every Config.IVFFLAT_CHECK_INTERVAL_SECONDS in a background thread"""
+        if self._thread is not None:
+            return
+
+        def run():
+            while not self._stop_event.wait(Config.IVFFLAT_CHECK_INTERVAL_SECONDS):
+                self.maybe_rebuild()
+
+        self._thread = threading.Thread(target=run, name='ivfflat-index-manager', daemon=True)
+        self._thread.start()
+
+    def stop_scheduler(self):
+        self._stop_event.set()
+        self._thread = None
+
+
+# Global IVFFlat index manager instance
+ivfflat_index_manager = IvfflatIndexManager()
@@ -0,0 +1,203 @@
+import os
+import time
+import queue
+import threading
+import logging
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Any, Callable, Optional
+import numpy as np
+import mediapipe as mp
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def _primary_detector():
+    return mp.solutions.face_detection.FaceDetection(
+        model_selection=1,  # 0 for close-range, 1 for full-range
+        min_detection_confidence=0.5
+    )
+
+
+def _fallback_detector():
+    # Close-range model with a lower threshold, used when the primary detector finds nothing
+    return mp.solutions.face_detection.FaceDetection(
+        model_selection=0,
+        min_detection_confidence=0.3
+    )
+
+
+def _face_mesh():
+    return mp.solutions.face_mesh.FaceMesh(
+        static_image_mode=True,
+        max_num_faces=1,
+        refine_landmarks=True,
+        min_detection_confidence=0.5,
+        min_tracking_confidence=0.5
+    )
+
+
+# Model name -> factory
+MODEL_FACTORIES: Dict[str, Callable[[], Any]] = {
+    'detector': _primary_detector,
+    'fallback_detector': _fallback_detector,
+    'face_mesh': _face_mesh
+}
+
+
+class ModelBundle:
+    """One primary detector, fallback detector and face mesh, used by one thread at a time"""
+
+    def __init__(self):
+        self.detector = MODEL_FACTORIES['detector']()
+        self.fallback_detector = MODEL_FACTORIES['fallback_detector']()
+        self.face_mesh = MODEL_FACTORIES['face_mesh']()
+
+    def close(self):
+        for model in (self.detector, self.fallback_detector, self.face_mesh):
+            model.close()
+
+
+class ModelPool:
+    """
+    Bounded pool of ModelBundles. MediaPipe graphs are not re-entrant, so a
+    thread checks out a whole bundle for one extraction and returns it after;
+    up to `size` extractions run concurrently. Bundles are built on demand.
+    """
+
+    def __init__(self, size: int, timeout: float):
+        self.size = max(1, size)
+        self.timeout = timeout
+        self._idle: 'queue.LifoQueue[ModelBundle]' = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._recent_waits = deque(maxlen=1000)
+
+    def _acquire(self) -> ModelBundle:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            build = self._created < self.size
+            if build:
+                self._created += 1
+        if build:
+            try:
+                bundle = ModelBundle()
+                logger.info(f"MediaPipe model bundle {self._created}/{self.size} loaded (pid {os.getpid()})")
+                return bundle
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self._timeouts += 1
+            raise TimeoutError(f"No MediaPipe model bundle available after {self.timeout}s")
+
+    @contextmanager
+    def checkout(self):
+        """Exclusive use of a bundle; waits (bounded) when all bundles are busy"""
+        started = time.perf_counter()
+        bundle = self._acquire()
+        waited = time.perf_counter() - started
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            self._recent_waits.append(waited)
+        try:
+            yield bundle
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._idle.put(bundle)
+
+    def warm_up(self, count: int = 1):
+        """Build `count` bundles up front so the first requests do not pay for it"""
+        for _ in range(min(count, self.size)):
+            with self._lock:
+                if self._created >= self.size:
+                    break
+                self._created += 1
+            try:
+                bundle = ModelBundle()
+            except Exception:
+                # Same rollback as _acquire: the slot can be built again later
+                with self._lock:
+                    self._created -= 1
+                raise
+            self._idle.put(bundle)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            waits_ms = np.array(self._recent_waits) * 1000
+            return {
+                'size': self.size,
+                'created': self._created,
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+                'checkouts': self._checkouts,
+                'timeouts': self._timeouts,
+                'wait_ms_avg': round(self._wait_total * 1000 / self._checkouts, 3) if self._checkouts else 0.0,
+                'wait_ms_p95': round(float(np.percentile(waits_ms, 95)), 3) if len(waits_ms) else 0.0,
+                'wait_ms_max': round(self._wait_max * 1000, 3)
+            }
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class ModelRegistry:
+    """
+    Long-lived MediaPipe graphs of the current worker process, held in a
+    ModelPool of Config.MEDIAPIPE_POOL_SIZE bundles. Graphs cannot be shared
+    across processes, so the pool is recreated after a fork.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pool: Optional[ModelPool] = None
+        self._pid = os.getpid()
+
+    @property
+    def pool(self) -> ModelPool:
+        if self._pool is None or self._pid != os.getpid():
+            with self._lock:
+                if self._pool is None or self._pid != os.getpid():
+                    self._pool = ModelPool(Config.MEDIAPIPE_POOL_SIZE, Config.MEDIAPIPE_POOL_TIMEOUT)
+                    self._pid = os.getpid()
+        return self._pool
+
+    def checkout(self):
+        """Context manager yielding a ModelBundle for exclusive use"""
+        return self.pool.checkout()
+
+    def warm_up(self, count: int = 1):
+        self.pool.warm_up(count)
+
+    def stats(self) -> Dict[str, Any]:
+        return self.pool.stats()
+
+    def close_all(self):
+        if self._pool is not None:
+            self._pool.close_all()
+            self._pool = None
+
+
+# Global MediaPipe model registry (one per worker process)
+model_registry = ModelRegistry()
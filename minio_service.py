@@ -70,10 +70,26 @@ class MinIOService:
         unique_id = str(uuid.uuid4())[:8]
         return f"employees/{employee_code}/faces/{timestamp}_{unique_id}.{file_extension}"
     
+    def content_object_name(self, sha256: str) -> str:
+        """Content-addressed object name: identical images share one object"""
+        return f"sha256/{sha256[:2]}/{sha256[2:4]}/{sha256}"
+    
+    def object_exists(self, object_name: str) -> bool:
+        """Check whether an object is already stored"""
+        try:
+            self.client.stat_object(self.bucket_name, object_name)
+            return True
+        except S3Error as e:
+            if e.code in ('NoSuchKey', 'NoSuchObject'):
+                return False
+            raise
+    
     def upload_image(self, image_data: bytes, employee_code: str, 
-                    content_type: str = "image/jpeg") -> Tuple[bool, str, Optional[str]]:
+                    content_type: str = "image/jpeg",
+                    object_name: Optional[str] = None) -> Tuple[bool, str, Optional[str]]:
         """
-        Upload image to MinIO
+        Upload image to MinIO (content-addressed unless `object_name` is given)
+        An object that already exists is not uploaded again
         Returns: (success, object_name, url)
         """
         if not Config.STORE_ORIGINAL_IMAGES:
@@ -81,8 +97,12 @@ class MinIOService:
         
         try:
             # Generate object name
-            file_extension = content_type.split('/')[-1] if '/' in content_type else 'jpg'
-            object_name = self.generate_object_name(employee_code, file_extension)
+            if not object_name:
+                object_name = self.content_object_name(hashlib.sha256(image_data).hexdigest())
+            
+            if self.object_exists(object_name):
+                logger.info(f"Image already stored, upload skipped: {object_name}")
+                return True, object_name, self.get_object_url(object_name)
             
             # Create image stream
             image_stream = io.BytesIO(image_data)
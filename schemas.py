@@ -59,6 +59,8 @@ class RecognitionResponseSchema(Schema):
     distance = fields.Float(allow_none=True)
     quality_score = fields.Float(allow_none=True)
     best_distance = fields.Float(allow_none=True)
+    margin = fields.Float(allow_none=True)
+    candidates = fields.List(fields.Dict(), allow_none=True)
 
 class ApiResponseSchema(Schema):
     success = fields.Boolean()
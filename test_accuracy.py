@@ -4,6 +4,9 @@ import requests
 import json
 import base64
 import os
+import sys
+import time
+import importlib
 
 def test_face_recognition_accuracy():
     """Test face recognition accuracy with sample data"""
@@ -82,5 +85,95 @@ def test_face_recognition_accuracy():
     print("   - Higher tolerance (0.5-0.6): More lenient, more false positives")
     print("   - Set FACE_RECOGNITION_TOLERANCE in environment variables")
 
+def _load_dataset(dataset_dir):
+    """{person: [image bytes, ...]} from dataset_dir/<person>/<image files>"""
+    dataset = {}
+    for person in sorted(os.listdir(dataset_dir)):
+        person_dir = os.path.join(dataset_dir, person)
+        if not os.path.isdir(person_dir):
+            continue
+        images = []
+        for name in sorted(os.listdir(person_dir)):
+            if name.lower().endswith(('.jpg', '.jpeg', '.png', '.webp')):
+                with open(os.path.join(person_dir, name), 'rb') as f:
+                    images.append(f.read())
+        if images:
+            dataset[person] = images
+    return dataset
+
+
+def _distance(a, b, metric):
+    import numpy as np
+    if metric == 'cosine':
+        return 1.0 - float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+    return float(np.linalg.norm(a - b))
+
+
+def _evaluate(service, dataset, metric, tolerance):
+    """Extract every image; enroll the first image per person and identify the others"""
+    started = time.perf_counter()
+    extracted = {person: [service.extract_face_embedding(image)[0] for image in images]
+                 for person, images in dataset.items()}
+    elapsed = time.perf_counter() - started
+    
+    gallery = {person: embeddings[0] for person, embeddings in extracted.items() if embeddings[0] is not None}
+    total_images = sum(len(images) for images in dataset.values())
+    detected = sum(embedding is not None for embeddings in extracted.values() for embedding in embeddings)
+    probes = correct = accepted = 0
+    genuine = []
+    for person, embeddings in extracted.items():
+        for embedding in embeddings[1:]:
+            probes += 1
+            if embedding is None or not gallery:
+                continue
+            distances = {other: _distance(embedding, template, metric) for other, template in gallery.items()}
+            best = min(distances, key=distances.get)
+            if best == person:
+                correct += 1
+                accepted += distances[best] <= tolerance
+            if person in distances:
+                genuine.append(distances[person])
+    return {
+        'ms_per_image': elapsed / total_images * 1000,
+        'detection_rate': detected / total_images,
+        'rank1_accuracy': correct / probes if probes else 0.0,
+        'accepted_rate': accepted / probes if probes else 0.0,
+        'genuine_distance_avg': sum(genuine) / len(genuine) if genuine else 0.0,
+        'probes': probes
+    }
+
+
+def test_dataset_accuracy(dataset_dir, service_module='face_service'):
+    """
+    Offline accuracy of the extraction pipeline on a labelled dataset
+    (dataset_dir/<person>/<images>), detecting on the full image vs on the
+    Config.DETECTION_PROXY_SIZE proxy. Needs the service dependencies and database settings.
+    """
+    # Measure extraction itself: in this process, without the embedding cache
+    os.environ['EXTRACTION_PROCESSES'] = '0'
+    os.environ['EMBEDDING_CACHE_BACKEND'] = 'none'
+    from config import Config
+    service = importlib.import_module(service_module).face_service
+    metric = 'cosine' if service_module == 'face_service_mediapipe' else Config.DISTANCE_METRIC
+    
+    dataset = _load_dataset(dataset_dir)
+    print(f"🧪 Dataset accuracy: {len(dataset)} people, "
+          f"{sum(len(images) for images in dataset.values())} images ({service_module})")
+    print("=" * 80)
+    print(f"{'detection':<22}{'ms/image':>10}{'detected':>10}{'rank-1':>10}{'accepted':>10}{'genuine dist':>14}")
+    
+    proxy_size = Config.DETECTION_PROXY_SIZE or 320
+    for label, size in (('full image', 0), (f'proxy {proxy_size} px', proxy_size)):
+        Config.DETECTION_PROXY_SIZE = size
+        result = _evaluate(service, dataset, metric, Config.FACE_RECOGNITION_TOLERANCE)
+        print(f"{label:<22}{result['ms_per_image']:>10.1f}{result['detection_rate']:>10.1%}"
+              f"{result['rank1_accuracy']:>10.1%}{result['accepted_rate']:>10.1%}"
+              f"{result['genuine_distance_avg']:>14.4f}")
+    print(f"\nProbes per run: {result['probes']} (first image per person is the enrolled template)")
+
 if __name__ == "__main__":
-    test_face_recognition_accuracy()
+    if len(sys.argv) > 1:
+        # python test_accuracy.py <dataset_dir> [face_service|face_service_mediapipe]
+        test_dataset_accuracy(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else 'face_service')
+    else:
+        test_face_recognition_accuracy()
@@ -0,0 +1,86 @@
+import base64
+from datetime import datetime, timezone, timedelta
+import pytest
+
+
+@pytest.fixture
+def logs(db):
+    """Attendance rows of two employees, several sharing a recognized_at; ids newest first"""
+    db.execute_query("INSERT INTO employees (employee_code, full_name) VALUES ('E1', 'An'), ('E2', 'Binh')")
+    base = datetime(2026, 10, 1, 8, 0, tzinfo=timezone.utc)
+    times = [base, base + timedelta(minutes=1), base + timedelta(minutes=1), base + timedelta(minutes=1),
+             base + timedelta(minutes=2), base + timedelta(minutes=3), base + timedelta(minutes=3)]
+    for index, recognized_at in enumerate(times):
+        db.execute_query("INSERT INTO attendance_logs (employee_code, recognized_at, device_code) "
+                         "VALUES (%s, %s, %s)", ('E1' if index % 2 else 'E2', recognized_at, 'kiosk-1'))
+    rows = db.execute_query("SELECT id, employee_code FROM attendance_logs "
+                            "ORDER BY recognized_at DESC, id DESC", fetch=True)
+    return rows
+
+
+def pages(client, limit: int, **params):
+    """Follow next_cursor to the end; returns the ids of every page"""
+    result = []
+    cursor = None
+    while True:
+        query = {'limit': limit, **params, **({'cursor': cursor} if cursor else {})}
+        body = client.get('/api/attendance/logs', query_string=query).get_json()
+        assert body['success'] and body['count'] == len(body['data'])
+        result.append([row['id'] for row in body['data']])
+        cursor = body['next_cursor']
+        if cursor is None:
+            return result
+
+
+def test_cursor_roundtrip():
+    from app import encode_log_cursor, decode_log_cursor
+    recognized_at = datetime(2026, 10, 1, 8, 0, 0, 123456, tzinfo=timezone(timedelta(hours=7)))
+    token = encode_log_cursor(recognized_at, 42)
+    assert '=' not in token and '/' not in token and '+' not in token
+    assert decode_log_cursor(token) == (recognized_at, 42)
+
+
+@pytest.mark.parametrize('token', [
+    'not a cursor!',
+    base64.urlsafe_b64encode(b'{"a": 1}').decode(),
+    base64.urlsafe_b64encode(b'["2026-10-01T08:00:00+00:00", "x"]').decode(),
+    base64.urlsafe_b64encode(b'["yesterday", 1]').decode(),
+    base64.urlsafe_b64encode(b'\xff\xfe').decode(),
+])
+def test_malformed_cursor_is_rejected(token):
+    from app import decode_log_cursor
+    with pytest.raises(ValueError, match='Invalid cursor'):
+        decode_log_cursor(token)
+
+
+def test_pages_cover_every_row_once_across_ties(client, logs):
+    expected = [row['id'] for row in logs]
+    for limit in (1, 2, 3, 7):
+        result = pages(client, limit)
+        assert [log_id for page in result for log_id in page] == expected
+        assert all(len(page) == limit for page in result[:-1])
+    # A last page exactly full has no next cursor
+    assert pages(client, 7) == [expected]
+
+
+def test_cursor_combines_with_filters(client, logs):
+    expected = [row['id'] for row in logs if row['employee_code'] == 'E1']
+    result = pages(client, 2, employee_code='E1', date_from='2026-10-01T08:01:00+00:00')
+    assert [log_id for page in result for log_id in page] == expected
+
+
+def test_rows_added_after_the_first_page_do_not_shift_later_pages(client, logs, db):
+    first = client.get('/api/attendance/logs', query_string={'limit': 3}).get_json()
+    db.execute_query("INSERT INTO attendance_logs (employee_code, recognized_at) VALUES ('E1', now())")
+    rest = client.get('/api/attendance/logs',
+                      query_string={'limit': 10, 'cursor': first['next_cursor']}).get_json()
+    ids = [row['id'] for row in first['data']] + [row['id'] for row in rest['data']]
+    assert ids == [row['id'] for row in logs]
+    assert rest['next_cursor'] is None
+
+
+def test_invalid_parameters_are_rejected(client, logs):
+    response = client.get('/api/attendance/logs', query_string={'cursor': 'garbage'})
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+    assert client.get('/api/attendance/logs', query_string={'limit': 0}).status_code == 400
@@ -0,0 +1,220 @@
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+import psycopg2
+import pytest
+from config import Config
+from attendance_partitions import (AttendancePartitionManager, add_months, MAINTENANCE_LOCK_KEY,
+                                   DEFAULT_PARTITION)
+
+
+@pytest.fixture
+def manager(db, monkeypatch):
+    """Partition manager on the test database; partitions and archives made by a test are dropped"""
+    monkeypatch.setattr(Config, 'TIMEZONE', 'UTC')
+    monkeypatch.setattr(Config, 'ATTENDANCE_PARTITIONS_AHEAD', 1)
+    monkeypatch.setattr(Config, 'ATTENDANCE_RETENTION_MONTHS', 0)
+    instance = AttendancePartitionManager()
+    before = {partition['name'] for partition in instance.partitions()}
+    db.execute_query("INSERT INTO employees (employee_code, full_name) VALUES ('E1', 'E1')")
+    yield instance
+    for partition in instance.partitions():
+        if partition['name'] not in before:
+            db.execute_query(f"DROP TABLE {partition['name']}")
+    db.execute_query(f"DROP SCHEMA IF EXISTS {Config.ATTENDANCE_ARCHIVE_SCHEMA} CASCADE")
+
+
+def log_at(db, recognized_at: str):
+    db.execute_query("INSERT INTO attendance_logs (employee_code, recognized_at) VALUES ('E1', %s)",
+                     (recognized_at,))
+
+
+def count(db, table: str) -> int:
+    return db.execute_one(f"SELECT count(*) AS n FROM {table}")['n']
+
+
+def test_add_months_carries_across_years():
+    assert add_months((2026, 12), 1) == (2027, 1)
+    assert add_months((2026, 1), -1) == (2025, 12)
+    assert add_months((2026, 3), -15) == (2024, 12)
+    assert add_months((2026, 11), 26) == (2029, 1)
+    assert add_months((2026, 5), 0) == (2026, 5)
+
+
+def test_partition_names_and_month_bounds(monkeypatch):
+    monkeypatch.setattr(Config, 'TIMEZONE', 'Asia/Ho_Chi_Minh')
+    manager = AttendancePartitionManager()
+    assert manager.partition_name((2026, 3)) == 'attendance_logs_y2026m03'
+    start = manager.month_start((2026, 3))
+    assert start == datetime(2026, 2, 28, 17, tzinfo=timezone.utc)
+    assert start.tzinfo == ZoneInfo('Asia/Ho_Chi_Minh')
+
+
+def test_overlapping_ranges_are_not_created(monkeypatch):
+    monkeypatch.setattr(Config, 'TIMEZONE', 'UTC')
+    manager = AttendancePartitionManager()
+    existing = [
+        {'name': DEFAULT_PARTITION, 'is_default': True, 'lower_bound': None, 'upper_bound': None},
+        # Legacy table: everything before March 2026
+        {'name': 'attendance_logs_legacy', 'is_default': False, 'lower_bound': None,
+         'upper_bound': manager.month_start((2026, 3))},
+        # Created in another timezone: overlaps the UTC months on both sides
+        {'name': 'attendance_logs_y2026m06', 'is_default': False,
+         'lower_bound': datetime(2026, 5, 31, 17, tzinfo=timezone.utc),
+         'upper_bound': datetime(2026, 6, 30, 17, tzinfo=timezone.utc)},
+    ]
+    # The overlap check answers before the cursor is used
+    for month in ((2025, 7), (2026, 2), (2026, 5), (2026, 6)):
+        assert manager._create_partition(None, month, existing) is False
+
+
+def test_maintain_creates_current_and_upcoming_months(manager):
+    report = manager.maintain()
+    assert report['maintained']
+    names = {partition['name'] for partition in manager.partitions()}
+    current = manager.current_month()
+    for offset in (0, 1):
+        assert manager.partition_name(add_months(current, offset)) in names
+
+    again = manager.maintain()
+    assert again['created'] == [] and again['archived'] == [] and again['dropped'] == []
+
+
+def test_rows_in_the_default_partition_are_moved_to_their_month(manager, db):
+    log_at(db, '2020-03-31T23:30:00+00:00')
+    log_at(db, '2020-03-01T00:00:00+00:00')
+    log_at(db, '2020-04-01T00:00:00+00:00')
+    assert count(db, DEFAULT_PARTITION) == 3
+
+    report = manager.maintain()
+    assert {'attendance_logs_y2020m03', 'attendance_logs_y2020m04'} <= set(report['created'])
+    assert count(db, DEFAULT_PARTITION) == 0
+    assert count(db, 'attendance_logs_y2020m03') == 2
+    assert count(db, 'attendance_logs_y2020m04') == 1
+    assert count(db, 'attendance_logs') == 3
+
+
+def test_retention_archives_or_drops_old_partitions(manager, db, monkeypatch):
+    log_at(db, '2020-03-15T00:00:00+00:00')
+    log_at(db, '2020-04-15T00:00:00+00:00')
+    manager.maintain()
+
+    monkeypatch.setattr(Config, 'ATTENDANCE_RETENTION_MONTHS', 12)
+    monkeypatch.setattr(Config, 'ATTENDANCE_RETENTION_ACTION', 'archive')
+    db.execute_query("ALTER TABLE attendance_logs DETACH PARTITION attendance_logs_y2020m04")
+    report = manager.maintain()
+    assert report['archived'] == ['attendance_logs_y2020m03']
+    assert count(db, f"{Config.ATTENDANCE_ARCHIVE_SCHEMA}.attendance_logs_y2020m03") == 1
+    assert count(db, 'attendance_logs') == 0
+
+    db.execute_query("ALTER TABLE attendance_logs ATTACH PARTITION attendance_logs_y2020m04 "
+                     "FOR VALUES FROM ('2020-04-01 00:00+00') TO ('2020-05-01 00:00+00')")
+    monkeypatch.setattr(Config, 'ATTENDANCE_RETENTION_ACTION', 'drop')
+    report = manager.maintain()
+    assert report['dropped'] == ['attendance_logs_y2020m04']
+    assert db.execute_one("SELECT to_regclass('attendance_logs_y2020m04') AS oid")['oid'] is None
+
+    current = manager.partition_name(manager.current_month())
+    assert current in {partition['name'] for partition in manager.partitions()}
+
+
+def test_maintenance_is_skipped_while_another_worker_holds_the_lock(manager, database_url):
+    other = psycopg2.connect(database_url)
+    try:
+        with other.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_lock(%s)", (MAINTENANCE_LOCK_KEY,))
+        report = manager.maintain()
+        assert report == {'maintained': False, 'reason': 'Maintenance already running in another worker'}
+        with other.cursor() as cursor:
+            # Released now, not whenever the closed session's backend exits
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (MAINTENANCE_LOCK_KEY,))
+    finally:
+        other.close()
+    assert manager.maintain()['maintained']
+
+
+def test_status_reports_bounds(manager):
+    manager.maintain()
+    status = manager.status()
+    assert status['partitioned'] and status['timezone'] == 'UTC'
+    current = manager.partition_name(manager.current_month())
+    partition = next(p for p in status['partitions'] if p['name'] == current)
+    assert partition['lower_bound'] == manager.month_start(manager.current_month()).isoformat()
+    assert status['last_report']['maintained']
+
+
+LEGACY_SCHEMA = """
+    CREATE TABLE attendance_logs (
+        id BIGSERIAL PRIMARY KEY,
+        employee_code VARCHAR(50) NOT NULL REFERENCES employees(employee_code) ON DELETE CASCADE,
+        recognized_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        device_code VARCHAR(64),
+        confidence REAL,
+        distance REAL,
+        quality_score REAL,
+        bbox INT4[4],
+        image_url TEXT,
+        source VARCHAR(32) DEFAULT 'RECOGNIZE' NOT NULL
+    );
+    CREATE INDEX idx_att_logs_emp_time ON attendance_logs(employee_code, recognized_at);
+    CREATE INDEX idx_att_logs_device_time ON attendance_logs(device_code, recognized_at);
+"""
+
+
+@pytest.fixture
+def legacy_install(manager, db):
+    """attendance_logs as created before partitioning, with rows; the partitioned table is rebuilt afterwards"""
+    from database import init_database
+    db.execute_query("DROP TABLE attendance_logs CASCADE")
+    db.execute_query(LEGACY_SCHEMA)
+    for recognized_at in ('2020-03-02T08:00:00+00:00', '2020-05-31T23:59:00+00:00', '2020-04-10T12:00:00+00:00'):
+        log_at(db, recognized_at)
+    # Imported with an explicit id: the sequence lags behind the table
+    db.execute_query("INSERT INTO attendance_logs (id, employee_code, recognized_at) "
+                     "VALUES (50, 'E1', '2020-01-15T00:00:00+00:00')")
+    yield init_database
+    db.execute_query("DROP TABLE IF EXISTS attendance_logs_legacy")
+    init_database()
+
+
+def test_existing_unpartitioned_table_is_attached_as_the_oldest_partition(legacy_install, manager, db):
+    legacy_install()
+
+    assert manager.is_partitioned()
+    legacy = next(p for p in manager.partitions() if p['name'] == 'attendance_logs_legacy')
+    assert legacy['lower_bound'] is None
+    assert legacy['upper_bound'] == manager.month_start((2020, 6))
+    rows = db.execute_query("SELECT id, recognized_at FROM attendance_logs ORDER BY id", fetch=True)
+    assert [row['id'] for row in rows] == [1, 2, 3, 50]
+    assert db.execute_one("""
+        SELECT array_agg(a.attname::text ORDER BY a.attname) AS columns
+        FROM pg_constraint c JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = ANY(c.conkey)
+        WHERE c.conrelid = 'attendance_logs_legacy'::regclass AND c.contype = 'p'
+    """)['columns'] == ['id', 'recognized_at']
+
+    # New ids continue after the legacy ones
+    log_at(db, '2020-05-01T00:00:00+00:00')
+    log_at(db, datetime.now(timezone.utc).isoformat())
+    ids = [row['id'] for row in db.execute_query("SELECT id FROM attendance_logs ORDER BY id", fetch=True)]
+    assert ids == [1, 2, 3, 50, 51, 52]
+    assert count(db, 'attendance_logs_legacy') == 5
+
+    # Restart: nothing left to migrate
+    legacy_install()
+    assert count(db, 'attendance_logs') == 6
+
+    # The sequence belongs to the parent: retiring the legacy partition keeps it
+    db.execute_query("DROP TABLE attendance_logs_legacy")
+    log_at(db, datetime.now(timezone.utc).isoformat())
+    assert db.execute_one("SELECT max(id) AS id FROM attendance_logs")['id'] == 53
+
+
+def test_renamed_but_unattached_table_is_repaired(legacy_install, db):
+    # Left by an upgrade whose attach failed: renamed, still keyed on id alone
+    db.execute_query("ALTER TABLE attendance_logs RENAME TO attendance_logs_legacy")
+    db.execute_query("ALTER INDEX idx_att_logs_emp_time RENAME TO idx_att_logs_legacy_emp_time")
+    db.execute_query("ALTER INDEX idx_att_logs_device_time RENAME TO idx_att_logs_legacy_device_time")
+    legacy_install()
+
+    assert count(db, 'attendance_logs') == 4
+    log_at(db, datetime.now(timezone.utc).isoformat())
+    assert db.execute_one("SELECT max(id) AS id FROM attendance_logs")['id'] == 51
@@ -0,0 +1,213 @@
+import os
+import json
+import threading
+import psycopg2
+import pytest
+from config import Config
+from attendance_writer import AttendanceWriter
+
+
+@pytest.fixture
+def employees(db):
+    db.execute_query("INSERT INTO employees (employee_code, full_name) VALUES ('E1', 'E1'), ('E2', 'E2')")
+    return db
+
+
+@pytest.fixture
+def make_writer(tmp_path, monkeypatch):
+    """Writers with a WAL in a temporary directory; no flusher thread, tests call flush()"""
+    monkeypatch.setattr(Config, 'ATTENDANCE_WAL_DIR', str(tmp_path / 'wal'))
+    monkeypatch.setattr(Config, 'ATTENDANCE_FLUSH_ROWS', 1000)
+    monkeypatch.setattr(Config, 'ATTENDANCE_MAX_BUFFERED_ROWS', 1000)
+    writers = []
+
+    def make() -> AttendanceWriter:
+        writer = AttendanceWriter()
+        monkeypatch.setattr(writer, '_ensure_thread', lambda: None)
+        writers.append(writer)
+        return writer
+
+    yield make
+    for writer in writers:
+        for batch in writer._pending:
+            writer._close_segment(batch, remove=False)
+        if writer._segment is not None:
+            writer._segment.close()
+
+
+def row(employee_code: str, confidence: float = 0.9) -> tuple:
+    return employee_code, 'kiosk-1', confidence, 0.3, 0.8, [1, 2, 3, 4], None, 'RECOGNIZE'
+
+
+def logged(db):
+    return db.execute_query("""
+        SELECT employee_code, device_code, confidence, bbox, recognized_at FROM attendance_logs ORDER BY id
+    """, fetch=True)
+
+
+def segments(writer):
+    return sorted(name for name in os.listdir(writer.wal_dir) if name.endswith('.wal'))
+
+
+def wal_rows(path: str):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def crash(writer):
+    """What a killed process leaves behind: segments on disk, locks released"""
+    if writer._segment is not None:
+        writer._segment.close()
+        writer._segment = None
+    for batch in writer._pending:
+        batch.segment.close()
+        batch.segment = None
+
+
+def test_buffered_rows_are_written_in_one_flush(employees, make_writer):
+    writer = make_writer()
+    writer.write_many([row('E1'), row('E2')])
+    writer.write('E1', 'kiosk-2', 0.7, 0.4, 0.6, None)
+
+    assert logged(employees) == []
+    assert len(segments(writer)) == 1
+    assert writer.flush() == 3
+
+    rows = logged(employees)
+    assert [(r['employee_code'], r['device_code'], r['bbox']) for r in rows] == [
+        ('E1', 'kiosk-1', [1, 2, 3, 4]), ('E2', 'kiosk-1', [1, 2, 3, 4]), ('E1', 'kiosk-2', None)
+    ]
+    assert segments(writer) == []
+    stats = writer.stats()
+    assert stats['written'] == 3 and stats['flushes'] == 1 and stats['buffered'] == 0
+
+
+def test_wal_is_replayed_after_a_crash(employees, make_writer):
+    writer = make_writer()
+    writer.write_many([row('E1'), row('E2')])
+    recognized_at = writer._rows[0][1]
+    crash(writer)
+
+    survivor = make_writer()
+    assert survivor.replay() == 2
+    assert survivor.flush() == 2
+    rows = logged(employees)
+    assert [r['employee_code'] for r in rows] == ['E1', 'E2']
+    assert rows[0]['recognized_at'] == recognized_at
+    assert segments(survivor) == []
+    assert survivor.stats()['replayed'] == 2
+
+
+def test_replay_skips_segments_of_live_writers(employees, make_writer):
+    live = make_writer()
+    live.write_many([row('E1')])
+    assert make_writer().replay() == 0
+    assert live.flush() == 1
+    assert [r['employee_code'] for r in logged(employees)] == ['E1']
+
+
+def test_replay_skips_a_torn_last_line(employees, make_writer):
+    writer = make_writer()
+    writer.write_many([row('E1'), row('E2')])
+    writer._segment.write('["E1", "2026-')
+    writer._segment.flush()
+    crash(writer)
+
+    survivor = make_writer()
+    assert survivor.replay() == 2
+    assert survivor.flush() == 2
+
+
+def test_rejected_rows_are_dropped_one_by_one(employees, make_writer):
+    writer = make_writer()
+    writer.write_many([row('E1'), row('GONE'), row('E2')])
+    assert writer.flush() == 2
+
+    assert [r['employee_code'] for r in logged(employees)] == ['E1', 'E2']
+    stats = writer.stats()
+    assert stats['dropped'] == 1 and stats['pending_rows'] == 0
+    assert segments(writer) == []
+
+
+def test_transient_failure_keeps_the_batch_for_retry(employees, make_writer, monkeypatch):
+    writer = make_writer()
+    writer.write_many([row('E1'), row('E2')])
+    insert = employees.execute_values
+
+    def outage(*args, **kwargs):
+        raise psycopg2.OperationalError('server closed the connection')
+
+    monkeypatch.setattr(employees, 'execute_values', outage)
+    assert writer.flush() == 0
+    stats = writer.stats()
+    assert stats['failed_flushes'] == 1 and stats['pending_rows'] == 2
+    assert 'server closed' in stats['last_error']
+    assert not writer._due()
+    assert len(segments(writer)) == 1
+
+    monkeypatch.setattr(employees, 'execute_values', insert)
+    assert writer.flush() == 2
+    assert len(logged(employees)) == 2 and segments(writer) == []
+
+
+def test_segment_is_rewritten_when_the_fallback_is_interrupted(employees, make_writer, monkeypatch):
+    writer = make_writer()
+    writer.write_many([row('E1'), row('GONE'), row('E2'), row('E1', 0.5)])
+    path = os.path.join(writer.wal_dir, segments(writer)[0])
+    insert = employees.execute_values
+    calls = []
+
+    def flaky(query, rows, **kwargs):
+        calls.append(len(rows))
+        # Batch rejected, then the one-by-one fallback loses the database at the third row
+        if len(calls) == 4:
+            raise psycopg2.OperationalError('server closed the connection')
+        return insert(query, rows, **kwargs)
+
+    monkeypatch.setattr(employees, 'execute_values', flaky)
+    assert writer.flush() == 0
+    assert calls == [4, 1, 1, 1]
+    assert [r['employee_code'] for r in logged(employees)] == ['E1']
+    # Only the rows not yet committed or dropped are left for replay
+    assert [line[0] for line in wal_rows(path)] == ['E2', 'E1']
+    assert writer.stats()['pending_rows'] == 2
+    assert not os.path.exists(path + '.tmp')
+
+    crash(writer)
+    survivor = make_writer()
+    assert survivor.replay() == 2
+    assert survivor.flush() == 2
+    assert [r['employee_code'] for r in logged(employees)] == ['E1', 'E2', 'E1']
+
+
+def test_overflow_drops_new_rows(employees, make_writer, monkeypatch):
+    monkeypatch.setattr(Config, 'ATTENDANCE_MAX_BUFFERED_ROWS', 3)
+    monkeypatch.setattr(Config, 'ATTENDANCE_OVERFLOW_POLICY', 'drop')
+    writer = make_writer()
+    for _ in range(5):
+        writer.write_many([row('E1')])
+
+    stats = writer.stats()
+    assert stats['buffered'] == 3 and stats['overflow_dropped'] == 2
+    assert len(wal_rows(os.path.join(writer.wal_dir, segments(writer)[0]))) == 3
+    assert writer.flush() == 3
+    writer.write_many([row('E2')])
+    assert writer.stats()['buffered'] == 1
+
+
+def test_overflow_blocks_until_a_flush_makes_room(employees, make_writer, monkeypatch):
+    monkeypatch.setattr(Config, 'ATTENDANCE_MAX_BUFFERED_ROWS', 2)
+    monkeypatch.setattr(Config, 'ATTENDANCE_OVERFLOW_POLICY', 'block')
+    writer = make_writer()
+    writer.write_many([row('E1'), row('E2')])
+
+    blocked = threading.Thread(target=writer.write_many, args=([row('E1', 0.5)],))
+    blocked.start()
+    blocked.join(0.3)
+    assert blocked.is_alive()
+
+    assert writer.flush() == 2
+    blocked.join(5)
+    assert not blocked.is_alive()
+    stats = writer.stats()
+    assert stats['buffered'] == 1 and stats['overflow_dropped'] == 0
@@ -0,0 +1,161 @@
+import threading
+import numpy as np
+import pytest
+import batch_scheduler
+from config import Config
+from batch_scheduler import MicroBatchScheduler, _bucket
+
+
+@pytest.fixture
+def blocks(monkeypatch):
+    """Probe blocks scored by the scheduler; each result echoes its probe's first value"""
+    scored = []
+
+    def fake_batch(block, metric='l2', k=1, ef_search=None, ivfflat_probes=None):
+        scored.append((block.shape[0], metric, k))
+        if np.isnan(block).any():
+            raise ValueError('bad probe')
+        return [[{'employee_id': f'E{int(row[0])}', 'metric': metric, 'k': k}] for row in block]
+
+    monkeypatch.setattr(batch_scheduler, 'search_employees_batch', fake_batch)
+    monkeypatch.setattr(Config, 'MICROBATCH_ENABLED', True)
+    monkeypatch.setattr(Config, 'MICROBATCH_MAX_WAIT_MS', 100)
+    monkeypatch.setattr(Config, 'MICROBATCH_MAX_SIZE', 8)
+    monkeypatch.setattr(Config, 'MICROBATCH_TIMEOUT', 5)
+    return scored
+
+
+def search_concurrently(scheduler, probes, **kwargs):
+    results = [None] * len(probes)
+    errors = [None] * len(probes)
+    barrier = threading.Barrier(len(probes))
+
+    def request(index):
+        barrier.wait()
+        try:
+            results[index] = scheduler.search_employees(probes[index], **kwargs)
+        except Exception as e:
+            errors[index] = e
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(len(probes))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return results, errors
+
+
+def test_bucket_rounds_up_to_power_of_two():
+    assert [_bucket(n) for n in (1, 2, 3, 4, 5, 8, 9)] == [1, 2, 4, 4, 8, 8, 16]
+
+
+def test_disabled_scheduler_calls_search_directly(monkeypatch):
+    calls = []
+    monkeypatch.setattr(Config, 'MICROBATCH_ENABLED', False)
+    monkeypatch.setattr(batch_scheduler, 'search_employees',
+                        lambda probe, **kwargs: calls.append(kwargs) or [{'employee_id': 'E1'}])
+    scheduler = MicroBatchScheduler()
+    assert scheduler.search_employees(np.zeros(4), metric='cosine', k=2) == [{'employee_id': 'E1'}]
+    assert calls[0]['metric'] == 'cosine' and calls[0]['k'] == 2
+    assert scheduler._thread is None
+
+
+def test_concurrent_requests_share_a_block(blocks):
+    scheduler = MicroBatchScheduler()
+    probes = [np.full(4, i, dtype=np.float32) for i in range(6)]
+    results, errors = search_concurrently(scheduler, probes)
+
+    assert errors == [None] * 6
+    assert [result[0]['employee_id'] for result in results] == [f'E{i}' for i in range(6)]
+    assert sum(size for size, _, _ in blocks) == 6
+    assert len(blocks) < 6
+    stats = scheduler.stats()
+    assert stats['enabled'] and stats['batches'] == len(blocks)
+    assert sum(bucket['requests'] for bucket in stats['buckets']) == 6
+
+
+def test_block_never_exceeds_max_size(blocks, monkeypatch):
+    monkeypatch.setattr(Config, 'MICROBATCH_MAX_SIZE', 3)
+    scheduler = MicroBatchScheduler()
+    results, errors = search_concurrently(scheduler, [np.full(4, i, dtype=np.float32) for i in range(7)])
+    assert errors == [None] * 7
+    assert max(size for size, _, _ in blocks) <= 3
+    assert sorted(result[0]['employee_id'] for result in results) == sorted(f'E{i}' for i in range(7))
+
+
+def test_different_parameters_are_scored_separately(blocks):
+    scheduler = MicroBatchScheduler()
+    probes = [np.full(4, i, dtype=np.float32) for i in range(4)]
+    results = [None] * 4
+    barrier = threading.Barrier(4)
+
+    def request(index):
+        barrier.wait()
+        metric = 'cosine' if index % 2 else 'l2'
+        results[index] = scheduler.search_employees(probes[index], metric=metric, k=index % 2 + 1)
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    for index, result in enumerate(results):
+        assert result[0]['metric'] == ('cosine' if index % 2 else 'l2')
+        assert result[0]['k'] == index % 2 + 1
+    assert {(metric, k) for _, metric, k in blocks} == {('l2', 1), ('cosine', 2)}
+
+
+def test_scoring_error_reaches_only_its_group(blocks):
+    scheduler = MicroBatchScheduler()
+    bad = np.full(4, np.nan, dtype=np.float32)
+    good = np.full(4, 1, dtype=np.float32)
+    results = [None, None]
+    errors = [None, None]
+    barrier = threading.Barrier(2)
+
+    def request(index, probe, metric):
+        barrier.wait()
+        try:
+            results[index] = scheduler.search_employees(probe, metric=metric)
+        except Exception as e:
+            errors[index] = e
+
+    threads = [threading.Thread(target=request, args=(0, bad, 'l2')),
+               threading.Thread(target=request, args=(1, good, 'cosine'))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert isinstance(errors[0], ValueError)
+    assert errors[1] is None and results[1][0]['employee_id'] == 'E1'
+
+
+def test_unscheduled_request_times_out(blocks, monkeypatch):
+    monkeypatch.setattr(Config, 'MICROBATCH_TIMEOUT', 0.2)
+    scheduler = MicroBatchScheduler()
+    # A dispatcher that never picks anything up
+    monkeypatch.setattr(scheduler, '_ensure_thread', lambda: None)
+    with pytest.raises(TimeoutError):
+        scheduler.search_employees(np.zeros(4))
+    assert scheduler.stats()['queued'] == 1
+
+
+def test_timed_out_probe_is_not_scored(blocks, monkeypatch):
+    monkeypatch.setattr(Config, 'MICROBATCH_TIMEOUT', 0.2)
+    scheduler = MicroBatchScheduler()
+    monkeypatch.setattr(scheduler, '_ensure_thread', lambda: None)
+    with pytest.raises(TimeoutError):
+        scheduler.search_employees(np.full(4, 1, dtype=np.float32))
+
+    # The dispatcher catches up with the abandoned probe and a live one
+    live = batch_scheduler._PendingProbe(np.full(4, 2, dtype=np.float32), ('l2', 1, None, None))
+    scheduler._queue.put(live)
+    scheduler._dispatch(scheduler._collect())
+
+    assert blocks == [(1, 'l2', 1)]
+    assert live.done.is_set() and live.result[0]['employee_id'] == 'E2'
+    stats = scheduler.stats()
+    assert stats['cancelled'] == 1 and stats['queued'] == 0
+    assert sum(bucket['requests'] for bucket in stats['buckets']) == 1
@@ -0,0 +1,165 @@
+import json
+import threading
+import pytest
+from config import Config
+from checkin_outbox import CheckinDispatcher, with_checkin_outbox
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, text: str = ''):
+        self.status_code = status_code
+        self.text = text
+
+
+class FakeSession:
+    """Records posted payloads; the status of a username is looked up in `statuses` (default 200)"""
+
+    def __init__(self, statuses=None, barrier=None):
+        self.statuses = statuses or {}
+        self.barrier = barrier
+        self.posted = []
+        self._lock = threading.Lock()
+
+    def post(self, url, json=None, timeout=None):
+        if self.barrier is not None:
+            # Every POST of the batch must be in flight at the same time
+            self.barrier.wait(timeout=5)
+        with self._lock:
+            self.posted.append(json)
+        status = self.statuses.get(json['username'], 200)
+        if isinstance(status, Exception):
+            raise status
+        return FakeResponse(status, 'rejected' if status != 200 else 'ok')
+
+
+@pytest.fixture
+def dispatcher(monkeypatch):
+    monkeypatch.setattr(Config, 'CHECKIN_ENABLED', True)
+    monkeypatch.setattr(Config, 'CHECKIN_BATCH_SIZE', 4)
+    monkeypatch.setattr(Config, 'CHECKIN_MAX_ATTEMPTS', 3)
+    monkeypatch.setattr(Config, 'CHECKIN_BACKOFF_BASE', 2)
+    monkeypatch.setattr(Config, 'CHECKIN_BACKOFF_MAX', 10)
+    instance = CheckinDispatcher()
+    yield instance
+    instance._executor.shutdown(wait=True)
+
+
+def queue_event(db, employee_code: str, **columns) -> int:
+    columns = {'employee_code': employee_code, 'payload': json.dumps({'username': employee_code}), **columns}
+    row = db.execute_one(f"""
+        INSERT INTO checkin_outbox ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})
+        RETURNING id
+    """, tuple(columns.values()))
+    return row['id']
+
+
+def event(db, event_id: int):
+    return db.execute_one("""
+        SELECT status, attempts, last_error, sent_at,
+               EXTRACT(EPOCH FROM next_attempt_at - now()) AS due_in
+        FROM checkin_outbox WHERE id = %s
+    """, (event_id,))
+
+
+def test_permanent_errors_are_4xx_except_timeout_and_rate_limit():
+    assert CheckinDispatcher._permanent('HTTP 400: bad request')
+    assert CheckinDispatcher._permanent('HTTP 404: not found')
+    assert not CheckinDispatcher._permanent('HTTP 408: timeout')
+    assert not CheckinDispatcher._permanent('HTTP 429: slow down')
+    assert not CheckinDispatcher._permanent('HTTP 503: unavailable')
+    assert not CheckinDispatcher._permanent('Connection refused')
+
+
+def test_backoff_doubles_with_jitter_up_to_max(dispatcher):
+    for attempts, expected in ((1, 2), (2, 4), (3, 8), (4, 10), (20, 10)):
+        for _ in range(50):
+            assert expected * 0.8 <= dispatcher._backoff(attempts) <= expected * 1.2
+
+
+def test_lease_covers_a_sequential_batch(monkeypatch):
+    monkeypatch.setattr(Config, 'CHECKIN_TIMEOUT', 5)
+    monkeypatch.setattr(Config, 'CHECKIN_BATCH_SIZE', 10)
+    assert CheckinDispatcher.lease_seconds() == 5 * 10 + 30
+
+
+def test_with_checkin_outbox_disabled_keeps_the_query(monkeypatch):
+    monkeypatch.setattr(Config, 'CHECKIN_ENABLED', False)
+    query = "INSERT INTO attendance_logs (employee_code) VALUES (%s)"
+    assert with_checkin_outbox(query) == query
+
+
+def test_attendance_insert_queues_one_event_per_employee(db, dispatcher):
+    db.execute_query("INSERT INTO employees (employee_code, full_name) VALUES ('E1', 'E1'), ('E2', 'E2')")
+    db.execute_query(with_checkin_outbox(
+        "INSERT INTO attendance_logs (employee_code) VALUES ('E1'), ('E1'), ('E2')"
+    ))
+    events = db.execute_query(
+        "SELECT employee_code, payload, status FROM checkin_outbox ORDER BY employee_code", fetch=True
+    )
+    assert [(row['employee_code'], row['payload'], row['status']) for row in events] == [
+        ('E1', {'username': 'E1'}, 'PENDING'), ('E2', {'username': 'E2'}, 'PENDING')
+    ]
+
+
+def test_batch_is_posted_concurrently_and_marked_sent(db, dispatcher):
+    ids = [queue_event(db, f'E{i}') for i in range(4)]
+    dispatcher._session = FakeSession(barrier=threading.Barrier(4))
+
+    assert dispatcher.dispatch_once() == 4
+    assert sorted(payload['username'] for payload in dispatcher._session.posted) == ['E0', 'E1', 'E2', 'E3']
+    for event_id in ids:
+        row = event(db, event_id)
+        assert row['status'] == 'SENT' and row['sent_at'] is not None and row['attempts'] == 1
+    assert dispatcher.dispatch_once() == 0
+
+
+def test_transient_failure_is_retried_with_backoff(db, dispatcher):
+    failing = queue_event(db, 'E1')
+    refused = queue_event(db, 'E2')
+    dispatcher._session = FakeSession({'E1': 503, 'E2': ConnectionError('refused')})
+
+    assert dispatcher.dispatch_once() == 2
+    for event_id in (failing, refused):
+        row = event(db, event_id)
+        assert row['status'] == 'PENDING' and row['attempts'] == 1
+        assert 2 * 0.8 - 1 <= row['due_in'] <= 2 * 1.2
+    assert event(db, failing)['last_error'].startswith('HTTP 503')
+    assert 'refused' in event(db, refused)['last_error']
+    # Not due yet
+    assert dispatcher.dispatch_once() == 0
+
+
+def test_permanent_failure_and_last_attempt_go_dead(db, dispatcher):
+    rejected = queue_event(db, 'E1')
+    exhausted = queue_event(db, 'E2', attempts=2)
+    dispatcher._session = FakeSession({'E1': 404, 'E2': 500})
+
+    assert dispatcher.dispatch_once() == 2
+    assert event(db, rejected)['status'] == 'DEAD' and event(db, rejected)['attempts'] == 1
+    assert event(db, exhausted)['status'] == 'DEAD' and event(db, exhausted)['attempts'] == 3
+    assert dispatcher._dead == 2
+
+
+def test_claimed_events_are_leased(db, dispatcher):
+    queue_event(db, 'E1')
+    claimed = dispatcher._claim()
+    assert len(claimed) == 1
+    # A second dispatcher does not see the event while the lease runs
+    assert dispatcher._claim() == []
+    assert event(db, claimed[0]['id'])['due_in'] > dispatcher.lease_seconds() - 5
+
+
+def test_prune_deletes_only_old_sent_events(db, dispatcher, monkeypatch):
+    monkeypatch.setattr(Config, 'CHECKIN_SENT_RETENTION_HOURS', 24)
+    old_sent = [queue_event(db, f'E{i}', status='SENT', created_at='2000-01-01') for i in range(5)]
+    recent_sent = queue_event(db, 'E8', status='SENT')
+    old_pending = queue_event(db, 'E9', created_at='2000-01-01')
+
+    assert dispatcher.prune(batch_size=2) == 5
+    remaining = {row['id'] for row in db.execute_query("SELECT id FROM checkin_outbox", fetch=True)}
+    assert remaining == {recent_sent, old_pending}
+    assert not remaining & set(old_sent)
+
+    monkeypatch.setattr(Config, 'CHECKIN_SENT_RETENTION_HOURS', 0)
+    db.execute_query("UPDATE checkin_outbox SET created_at = '2000-01-01', status = 'SENT'")
+    assert dispatcher.prune() == 0
@@ -0,0 +1,174 @@
+import time
+import threading
+import psycopg2
+import psycopg2.pool
+import pytest
+from database import ConnectionPool, PoolTimeout
+
+
+@pytest.fixture
+def make_pool(database_url):
+    """ConnectionPool factory against the test database; every pool is closed afterwards"""
+    pools = []
+
+    def make(minconn: int = 0, maxconn: int = 2, **kwargs) -> ConnectionPool:
+        pool = ConnectionPool(minconn, maxconn, database_url, **{'timeout': 5, **kwargs})
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.closeall()
+
+
+def backend_pid(conn) -> int:
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_backend_pid()")
+        pid = cursor.fetchone()[0]
+    conn.rollback()
+    return pid
+
+
+def test_minconn_is_opened_up_front(make_pool):
+    pool = make_pool(minconn=2, maxconn=4)
+    stats = pool.stats()
+    assert stats['open'] == 2 and stats['idle'] == 2 and stats['opened'] == 2
+
+
+def test_idle_connection_is_reused(make_pool):
+    pool = make_pool()
+    conn = pool.getconn()
+    pid = backend_pid(conn)
+    pool.putconn(conn)
+    again = pool.getconn()
+    assert again is conn and backend_pid(again) == pid
+    assert pool.stats()['opened'] == 1 and pool.stats()['checkouts'] == 2
+    pool.putconn(again)
+
+
+def test_exhausted_pool_times_out(make_pool):
+    pool = make_pool(maxconn=2, timeout=0.2)
+    held = [pool.getconn(), pool.getconn()]
+    started = time.monotonic()
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+    assert time.monotonic() - started >= 0.2
+    assert isinstance(PoolTimeout('x'), psycopg2.pool.PoolError)
+    stats = pool.stats()
+    assert stats['timeouts'] == 1 and stats['in_use'] == 2 and stats['open'] == 2
+    for conn in held:
+        pool.putconn(conn)
+
+
+def test_waiter_gets_the_returned_connection(make_pool):
+    pool = make_pool(maxconn=1)
+    conn = pool.getconn()
+    received = []
+    waiter = threading.Thread(target=lambda: received.append(pool.getconn()))
+    waiter.start()
+    time.sleep(0.2)
+    assert not received
+    pool.putconn(conn)
+    waiter.join(5)
+
+    assert received == [conn]
+    stats = pool.stats()
+    assert stats['waits'] == 1 and stats['wait_seconds_max'] >= 0.2
+    pool.putconn(conn)
+
+
+def test_concurrent_use_stays_within_maxconn(make_pool):
+    pool = make_pool(maxconn=3)
+    peak = []
+    errors = []
+
+    def work():
+        try:
+            for _ in range(5):
+                conn = pool.getconn()
+                peak.append(pool.stats()['in_use'])
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT pg_sleep(0.01)")
+                conn.commit()
+                pool.putconn(conn)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+
+    assert errors == []
+    assert max(peak) <= 3
+    stats = pool.stats()
+    assert stats['checkouts'] == 50 and stats['opened'] <= 3 and stats['in_use'] == 0
+
+
+def test_open_transaction_is_rolled_back_on_return(make_pool):
+    pool = make_pool(maxconn=1)
+    conn = pool.getconn()
+    with conn.cursor() as cursor:
+        cursor.execute("CREATE TEMP TABLE pool_probe (id int)")
+    pool.putconn(conn)
+    conn = pool.getconn()
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('pg_temp.pool_probe') AS probe")
+        assert cursor.fetchone()[0] is None
+    pool.putconn(conn)
+
+
+def test_closed_connection_is_dropped_on_return(make_pool):
+    pool = make_pool()
+    conn = pool.getconn()
+    conn.close()
+    pool.putconn(conn)
+    assert pool.stats()['open'] == 0
+    fresh = pool.getconn()
+    assert fresh is not conn and not fresh.closed
+    pool.putconn(fresh)
+
+
+def test_dead_idle_connection_is_replaced(make_pool, database_url):
+    pool = make_pool(check_interval=0)
+    conn = pool.getconn()
+    pid = backend_pid(conn)
+    pool.putconn(conn)
+
+    admin = psycopg2.connect(database_url)
+    try:
+        with admin.cursor() as cursor:
+            cursor.execute("SELECT pg_terminate_backend(%s)", (pid,))
+        admin.commit()
+    finally:
+        admin.close()
+    time.sleep(0.1)
+
+    fresh = pool.getconn()
+    assert fresh is not conn and backend_pid(fresh) != pid
+    assert pool.stats()['discarded'] == 1
+    pool.putconn(fresh)
+
+
+def test_connections_past_max_lifetime_are_recycled(make_pool):
+    pool = make_pool(max_lifetime=0.1)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    time.sleep(0.15)
+    fresh = pool.getconn()
+    assert fresh is not conn and conn.closed
+    assert pool.stats()['recycled'] == 1
+    time.sleep(0.15)
+    # Returned after its lifetime: closed instead of kept idle
+    pool.putconn(fresh)
+    assert fresh.closed and pool.stats()['recycled'] == 2
+
+
+def test_closed_pool_refuses_checkouts(make_pool):
+    pool = make_pool(minconn=1)
+    idle = pool._idle[0][0]
+    pool.closeall()
+    assert idle.closed
+    with pytest.raises(psycopg2.pool.PoolError):
+        pool.getconn()
@@ -0,0 +1,146 @@
+import numpy as np
+import pytest
+import embedding_cache as embedding_cache_module
+from config import Config
+from embedding_cache import CacheEntry, EmbeddingCache, MemoryCacheBackend
+from image_dedup import image_sha256
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = Clock()
+    monkeypatch.setattr(embedding_cache_module.time, 'time', fake)
+    return fake
+
+
+@pytest.fixture
+def cache(monkeypatch, clock):
+    monkeypatch.setattr(Config, 'EMBEDDING_CACHE_BACKEND', 'memory')
+    monkeypatch.setattr(Config, 'EMBEDDING_CACHE_TTL', 60)
+    monkeypatch.setattr(Config, 'EMBEDDING_CACHE_MAX_ENTRIES', 3)
+    return EmbeddingCache()
+
+
+class Extractor:
+    """Counts extracted images; an image of b'noface' has no face"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, images):
+        self.calls.append(list(images))
+        return [(None, None, 0.0) if image == b'noface' else
+                (np.full(4, len(image), dtype=np.float32), {'x': 1}, 0.9) for image in images]
+
+
+def test_entry_encode_roundtrip():
+    entry = CacheEntry(np.arange(4, dtype=np.float32), {'x': 1, 'y': 2}, 0.75, 'mediapipe', '2.0', 0.12, 123.5)
+    decoded = CacheEntry.decode(entry.encode())
+    assert np.array_equal(decoded.embedding, entry.embedding)
+    assert decoded.embedding.flags.writeable
+    assert (decoded.bbox, decoded.quality_score, decoded.model_name, decoded.model_version,
+            decoded.seconds, decoded.expires_at) == ({'x': 1, 'y': 2}, 0.75, 'mediapipe', '2.0', 0.12, 123.5)
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryCacheBackend(max_entries=2)
+    entry = CacheEntry(np.zeros(4, dtype=np.float32), None, 0.5, 'm', '1', 0.1, 0.0)
+    backend.set('a', entry, 60)
+    backend.set('b', entry, 60)
+    backend.get('a')
+    backend.set('c', entry, 60)
+
+    assert backend.get('b') is None
+    assert backend.get('a') is entry and backend.get('c') is entry
+    stats = backend.stats()
+    assert stats['entries'] == 2 and stats['evictions'] == 1 and stats['vectors_bytes'] == 2 * 4 * 4
+
+
+def test_repeated_images_are_extracted_once(cache):
+    extract = Extractor()
+    first = cache.get_or_extract_many([b'aa', b'bbb'], extract)
+    second = cache.get_or_extract_many([b'bbb', b'cccc', b'aa'], extract)
+
+    assert extract.calls == [[b'aa', b'bbb'], [b'cccc']]
+    assert np.array_equal(second[0][0], first[1][0]) and np.array_equal(second[2][0], first[0][0])
+    assert second[1][0][0] == 4
+    stats = cache.stats()
+    assert stats['hits'] == 2 and stats['misses'] == 3
+    assert stats['backend'] == 'memory'
+
+
+def test_cached_vectors_are_copies(cache):
+    extract = Extractor()
+    cache.get_or_extract(b'aa', lambda image: extract([image])[0])[0][:] = -1
+    assert cache.get(image_sha256(b'aa'))[0][0] == 2
+
+
+def test_entries_expire_after_ttl(cache, clock):
+    extract = Extractor()
+    cache.get_or_extract_many([b'aa'], extract)
+    clock.now += 59
+    cache.get_or_extract_many([b'aa'], extract)
+    assert len(extract.calls) == 1
+
+    clock.now += 2
+    cache.get_or_extract_many([b'aa'], extract)
+    assert len(extract.calls) == 2
+    assert cache.stats()['expired'] == 1
+
+
+def test_lru_bound_applies_to_the_cache(cache):
+    extract = Extractor()
+    cache.get_or_extract_many([b'a', b'bb', b'ccc', b'dddd'], extract)
+    cache.get_or_extract_many([b'a'], extract)
+    assert extract.calls[-1] == [b'a']
+    assert cache.stats()['entries'] == 3
+
+
+def test_images_without_a_face_are_not_cached(cache):
+    extract = Extractor()
+    cache.get_or_extract_many([b'noface'], extract)
+    cache.get_or_extract_many([b'noface'], extract)
+    assert len(extract.calls) == 2
+
+
+def test_model_change_never_serves_old_vectors(cache, monkeypatch):
+    extract = Extractor()
+    cache.get_or_extract_many([b'aa'], extract)
+    sha256 = image_sha256(b'aa')
+    entry = cache.backend.get(cache._key(sha256))
+    monkeypatch.setattr(Config, 'FACE_MODEL_VERSION', '2.0')
+    assert cache.get(sha256) is None
+
+    # An entry written under the new key by an older model is dropped as stale
+    cache.backend.set(cache._key(sha256), entry, 60)
+    assert cache.get(sha256) is None
+    assert cache.backend.get(cache._key(sha256)) is None
+
+
+def test_backend_errors_fall_back_to_extraction(cache, monkeypatch):
+    def broken(*args):
+        raise ConnectionError('cache down')
+
+    monkeypatch.setattr(cache.backend, 'get', broken)
+    monkeypatch.setattr(cache.backend, 'set', broken)
+    extract = Extractor()
+    results = cache.get_or_extract_many([b'aa'], extract)
+    assert results[0][0][0] == 2
+    assert cache.stats()['errors'] == 2
+
+
+def test_disabled_cache_always_extracts(monkeypatch):
+    monkeypatch.setattr(Config, 'EMBEDDING_CACHE_BACKEND', 'none')
+    cache = EmbeddingCache()
+    extract = Extractor()
+    cache.get_or_extract_many([b'aa'], extract)
+    cache.get_or_extract_many([b'aa'], extract)
+    assert not cache.enabled and len(extract.calls) == 2
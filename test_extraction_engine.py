@@ -0,0 +1,76 @@
+import os
+import time
+import numpy as np
+import pytest
+from config import Config
+from extraction_engine import ExtractionEngine, ExtractionUnavailable, in_extraction_worker
+
+
+class WorkerProbe:
+    """Stand-in face service imported by the children (module_name = this test module)"""
+
+    @staticmethod
+    def _extract_local(image_data: bytes):
+        if image_data == b'sleep':
+            time.sleep(5)
+        from database import db_manager
+        return np.frombuffer(image_data, dtype=np.uint8).astype(np.float32), {
+            'pid': os.getpid(),
+            'in_worker': in_extraction_worker(),
+            'config': (Config.EXTRACTION_PROCESSES, Config.EMBEDDING_CACHE_BACKEND, Config.MEDIAPIPE_POOL_SIZE),
+            'db_pool_open': db_manager._pool is not None
+        }, 1.0
+
+
+face_service = WorkerProbe()
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    monkeypatch.setattr(Config, 'EXTRACTION_PROCESSES', 2)
+    monkeypatch.setattr(Config, 'EXTRACTION_QUEUE_DEPTH', 4)
+    monkeypatch.setattr(Config, 'EXTRACTION_TIMEOUT', 30)
+    extraction_engine = ExtractionEngine(__name__)
+    yield extraction_engine
+    if extraction_engine._executor is not None:
+        extraction_engine._executor.shutdown(wait=True, cancel_futures=True)
+
+
+def test_extracts_in_child_processes_in_order(engine):
+    images = [bytes([index]) * 4 for index in range(6)]
+    results = engine.extract_many(images)
+    assert [int(embedding[0]) for embedding, _, _ in results] == list(range(6))
+
+    info = results[0][1]
+    assert info['pid'] != os.getpid() and info['in_worker']
+    assert not in_extraction_worker()
+    # Worker config applied in the child: it extracts locally, with one bundle and no DB pool
+    assert info['config'] == (0, 'none', 1)
+    assert not info['db_pool_open']
+    assert engine.stats()['completed'] == 6 and engine.stats()['in_flight'] == 0
+
+
+def test_every_worker_is_started_with_the_pool(engine):
+    engine.extract(b'x')
+    assert len(engine._executor._processes) == engine.processes
+
+
+def test_queue_full_is_rejected(engine):
+    engine._in_flight = engine.processes + engine.queue_depth
+    with pytest.raises(ExtractionUnavailable):
+        engine.extract(b'x')
+    assert engine.stats()['rejected'] == 1
+
+
+def test_timeout_releases_the_slot(engine):
+    # Workers started first: a spawn start-up alone can take longer than the timeout
+    engine.extract(b'warm')
+    engine.timeout = 0.5
+    with pytest.raises(ExtractionUnavailable):
+        engine.extract(b'sleep')
+    assert engine.stats()['timeouts'] == 1 and engine.stats()['in_flight'] == 0
+
+
+def test_disabled_without_processes(monkeypatch):
+    monkeypatch.setattr(Config, 'EXTRACTION_PROCESSES', 0)
+    assert not ExtractionEngine(__name__).enabled
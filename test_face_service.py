@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+face_recognition = pytest.importorskip('face_recognition')
+
+from config import Config
+from face_service import face_service
+
+
+@pytest.fixture
+def hog(monkeypatch):
+    """face_recognition.face_locations stand-in: records the image sizes, answers per size"""
+    calls = []
+    answers = {}
+
+    def face_locations(image_rgb, model='hog'):
+        calls.append(image_rgb.shape[:2])
+        return answers.get(max(image_rgb.shape[:2]), [])
+
+    monkeypatch.setattr(face_recognition, 'face_locations', face_locations)
+    monkeypatch.setattr(Config, 'DETECTION_PROXY_SIZE', 320)
+    monkeypatch.setattr(Config, 'DETECTION_FALLBACK_SIZE', 640)
+    return calls, answers
+
+
+def test_faces_found_on_the_proxy_map_to_the_image(hog):
+    calls, answers = hog
+    answers[320] = [(40, 200, 120, 120)]
+    locations = face_service._locate_faces(np.zeros((1440, 1920, 3), dtype=np.uint8))
+    assert calls == [(240, 320)]
+    assert locations == [(240, 1200, 720, 720)]
+
+
+def test_small_faces_fall_back_to_a_larger_proxy(hog):
+    calls, answers = hog
+    answers[640] = [(40, 200, 80, 160)]
+    locations = face_service._locate_faces(np.zeros((1440, 1920, 3), dtype=np.uint8))
+    assert calls == [(240, 320), (480, 640)]
+    assert locations == [(120, 600, 240, 480)]
+
+
+def test_small_images_are_searched_once_at_full_size(hog):
+    calls, answers = hog
+    assert face_service._locate_faces(np.zeros((240, 300, 3), dtype=np.uint8)) == []
+    assert calls == [(240, 300)]
+
+
+def test_locations_are_clipped_to_the_image(hog):
+    calls, answers = hog
+    answers[320] = [(-5, 330, 250, -2)]
+    assert face_service._locate_faces(np.zeros((1440, 1920, 3), dtype=np.uint8)) == [(0, 1920, 1440, 0)]
@@ -0,0 +1,329 @@
+import os
+import sys
+import json
+import time
+import subprocess
+import numpy as np
+import pytest
+from config import Config
+from gallery import FaceGallery, GalleryListener
+
+DIMENSION = 128
+
+
+def make_rows(count: int, employees: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(count, DIMENSION)).astype(np.float32)
+    rows = [{'id': index + 1, 'employee_id': f'E{index % employees:03d}', 'vector': vectors[index],
+             'quality_score': 0.5} for index in range(count)]
+    return rows, vectors
+
+
+def brute_force(vectors: np.ndarray, probe: np.ndarray) -> np.ndarray:
+    return np.linalg.norm(vectors - probe, axis=1)
+
+
+@pytest.fixture
+def gallery():
+    rows, vectors = make_rows(500, 50)
+    face_gallery = FaceGallery(storage='float32')
+    face_gallery.load_rows(rows)
+    return face_gallery, vectors
+
+
+def test_search_matches_brute_force(gallery):
+    face_gallery, vectors = gallery
+    probe = vectors[42] + 0.01
+    results = face_gallery.search(probe, k=5)
+
+    distances = brute_force(vectors, probe)
+    expected = np.argsort(distances)[:5] + 1
+    assert [result['face_id'] for result in results] == expected.tolist()
+    assert results[0]['employee_code'] == 'E042'
+    assert results[0]['distance'] == pytest.approx(distances[42], abs=1e-4)
+
+
+def test_cosine_metric(gallery):
+    face_gallery, vectors = gallery
+    probe = vectors[7] * 3.0
+    result = face_gallery.search(probe, metric='cosine')[0]
+    assert result['face_id'] == 8
+    assert result['distance'] == pytest.approx(0.0, abs=1e-5)
+
+
+def test_search_batch_equals_single_searches(gallery):
+    face_gallery, vectors = gallery
+    probes = vectors[:10] + 0.05
+    batch = face_gallery.search_batch(probes, k=3)
+    for probe, results in zip(probes, batch):
+        single = face_gallery.search(probe, k=3)
+        assert [result['face_id'] for result in results] == [result['face_id'] for result in single]
+        assert [result['distance'] for result in results] == pytest.approx([result['distance'] for result in single],
+                                                                           abs=1e-3)
+
+
+def test_search_employees_returns_best_template_per_employee(gallery):
+    face_gallery, vectors = gallery
+    probe = vectors[3]
+    results = face_gallery.search_employees(probe, k=3)
+
+    distances = brute_force(vectors, probe)
+    per_employee = {}
+    for index, distance in enumerate(distances):
+        code = f'E{index % 50:03d}'
+        per_employee[code] = min(per_employee.get(code, np.inf), distance)
+    expected = sorted(per_employee, key=per_employee.get)[:3]
+    assert [result['employee_code'] for result in results] == expected
+    assert len({result['employee_code'] for result in results}) == 3
+
+
+def test_remove_swaps_last_row_into_place(gallery):
+    face_gallery, vectors = gallery
+    assert face_gallery.remove(10)
+    assert not face_gallery.remove(10)
+    assert len(face_gallery) == 499
+
+    # The former last row (id 500) now lives in the freed row and is still found
+    assert face_gallery._row_by_id[500] == 9
+    assert face_gallery.search(vectors[499])[0]['face_id'] == 500
+    assert all(result['face_id'] != 10 for result in face_gallery.search(vectors[9], k=10))
+    for face_id, row in face_gallery._row_by_id.items():
+        assert face_gallery._ids[row] == face_id
+
+
+def test_upsert_replaces_vector_and_employee(gallery):
+    face_gallery, vectors = gallery
+    face_gallery.upsert(1, 'NEW', vectors[200] + 0.001)
+    assert len(face_gallery) == 500
+    result = face_gallery.search_employees(vectors[200], k=2)
+    assert {candidate['employee_code'] for candidate in result} == {'NEW', 'E000'}
+
+
+def test_remove_employee_frees_slot(gallery):
+    face_gallery, _ = gallery
+    assert face_gallery.remove_employee('E001') == 10
+    assert face_gallery.employee_count() == 49
+    assert 'E001' not in face_gallery._slot_by_code
+    face_gallery.upsert(10001, 'E999', np.ones(DIMENSION, dtype=np.float32))
+    assert face_gallery.employee_count() == 50
+
+
+def test_wrong_dimension_is_rejected(gallery):
+    face_gallery, _ = gallery
+    with pytest.raises(ValueError):
+        face_gallery.upsert(1, 'E000', np.ones(DIMENSION + 1, dtype=np.float32))
+
+
+def test_empty_gallery(monkeypatch):
+    monkeypatch.setattr(Config, 'GALLERY_LISTEN_ENABLED', False)
+    face_gallery = FaceGallery(storage='float32')
+    face_gallery.load_rows([])
+    assert face_gallery.search(np.zeros(DIMENSION, dtype=np.float32)) == []
+    assert face_gallery.search_employees(np.zeros(DIMENSION, dtype=np.float32)) == []
+
+
+def wait_for(condition, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return condition()
+
+
+def test_listener_applies_row_changes(db, enroll, monkeypatch):
+    monkeypatch.setattr(Config, 'GALLERY_LISTEN_ENABLED', True)
+    monkeypatch.setattr(Config, 'GALLERY_SNAPSHOT_PATH', '')
+    rows, vectors = make_rows(3, 3)
+    first = enroll('E000', vectors[0])
+    face_gallery = FaceGallery(storage='float32')
+    face_gallery.ensure_loaded()
+    try:
+        assert len(face_gallery) == 1
+
+        second = enroll('E001', vectors[1])
+        assert wait_for(lambda: second in face_gallery._row_by_id)
+        assert face_gallery.search(vectors[1])[0]['employee_code'] == 'E001'
+
+        db.execute_query("UPDATE face_embeddings SET status = 'INACTIVE' WHERE id = %s", (first,))
+        assert wait_for(lambda: first not in face_gallery._row_by_id)
+
+        db.execute_query("UPDATE employees SET status = 'INACTIVE' WHERE employee_code = 'E001'")
+        assert wait_for(lambda: len(face_gallery) == 0)
+    finally:
+        face_gallery.stop_listener()
+
+
+def test_listener_payloads_without_database():
+    rows, vectors = make_rows(20, 4)
+    face_gallery = FaceGallery(storage='float32')
+    face_gallery.load_rows(rows)
+    listener = GalleryListener(face_gallery)
+
+    listener._apply(json.dumps({'table': 'face_embeddings', 'op': 'DELETE', 'id': 5}))
+    assert 5 not in face_gallery._row_by_id
+    listener._apply(json.dumps({'table': 'employees', 'employee_code': 'E002', 'status': 'INACTIVE'}))
+    assert 'E002' not in face_gallery._slot_by_code
+    assert len(face_gallery) == 14
+    # Malformed payloads are logged and ignored
+    listener._apply('not json')
+    assert len(face_gallery) == 14
+
+
+def clustered_rows(employees: int, templates: int, seed: int = 8):
+    """Templates scattered tightly around one identity vector per employee"""
+    rng = np.random.default_rng(seed)
+    identities = rng.normal(size=(employees, DIMENSION)).astype(np.float32)
+    rows = []
+    for employee in range(employees):
+        for template in range(templates):
+            rows.append({'id': employee * templates + template + 1, 'employee_id': f'E{employee:03d}',
+                         'vector': identities[employee] + rng.normal(scale=0.1, size=DIMENSION).astype(np.float32),
+                         'quality_score': 0.5})
+    return rows, identities
+
+
+@pytest.fixture
+def prefilter(monkeypatch):
+    monkeypatch.setattr(Config, 'GALLERY_CENTROID_PREFILTER', True)
+    monkeypatch.setattr(Config, 'GALLERY_PREFILTER_MIN_TEMPLATES', 0)
+    monkeypatch.setattr(Config, 'GALLERY_CENTROID_SHORTLIST', 5)
+
+
+def test_prefilter_is_off_by_default():
+    """Two-stage search is approximate and has to be enabled explicitly"""
+    env = {key: value for key, value in os.environ.items() if key != 'GALLERY_CENTROID_PREFILTER'}
+    output = subprocess.run([sys.executable, '-c', 'from config import Config; print(Config.GALLERY_CENTROID_PREFILTER)'],
+                            env=env, capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert output.stdout.strip() == 'False'
+
+
+def test_prefilter_agrees_with_exhaustive_search(prefilter, monkeypatch):
+    rows, identities = clustered_rows(40, 5)
+    face_gallery = FaceGallery(storage='float32')
+    face_gallery.load_rows(rows)
+    assert face_gallery._use_prefilter(1)
+    probes = identities[:10] + 0.05
+
+    two_stage = face_gallery.search_employees_batch(probes, k=3)
+    monkeypatch.setattr(Config, 'GALLERY_CENTROID_PREFILTER', False)
+    exhaustive = face_gallery.search_employees_batch(probes, k=3)
+    for fast, exact in zip(two_stage, exhaustive):
+        assert [c['employee_code'] for c in fast] == [c['employee_code'] for c in exact]
+        assert [c['distance'] for c in fast] == pytest.approx([c['distance'] for c in exact], abs=1e-3)
+
+
+def test_prefilter_needs_more_employees_than_the_shortlist(prefilter):
+    rows, _ = clustered_rows(5, 2)
+    face_gallery = FaceGallery(storage='float32')
+    face_gallery.load_rows(rows)
+    assert not face_gallery._use_prefilter(1)
+
+
+def test_centroids_follow_upsert_and_remove(prefilter):
+    rows, identities = clustered_rows(10, 3)
+    face_gallery = FaceGallery(storage='float32')
+    face_gallery.load_rows(rows)
+    slot = face_gallery._slot_by_code['E000']
+    members = np.vstack([row['vector'] for row in rows[:3]])
+    assert np.allclose(face_gallery._centroids[slot], members.mean(axis=0), atol=1e-5)
+
+    face_gallery.remove(1)
+    assert np.allclose(face_gallery._centroids[slot], members[1:].mean(axis=0), atol=1e-5)
+    face_gallery.upsert(1000, 'E000', identities[5])
+    expected = np.vstack([members[1:], identities[5]]).mean(axis=0)
+    assert np.allclose(face_gallery._centroids[slot], expected, atol=1e-5)
+
+
+@pytest.fixture(params=['float16', 'int8'])
+def quantized(request, monkeypatch):
+    """Quantized gallery re-ranked against the exact vectors, and a float32 reference gallery"""
+    monkeypatch.setattr(Config, 'GALLERY_RERANK_CANDIDATES', 50)
+    rows, vectors = make_rows(1000, 100, seed=9)
+    compact = FaceGallery(storage=request.param)
+    compact.load_rows(rows)
+    compact.fetched = []
+
+    def fetch_exact(face_ids):
+        # Re-ranking must not query the database while holding the gallery lock
+        assert not compact._lock._is_owned()
+        compact.fetched.append(list(face_ids))
+        return {face_id: vectors[face_id - 1] for face_id in face_ids}
+
+    compact._fetch_exact = fetch_exact
+    reference = FaceGallery(storage='float32')
+    reference.load_rows(rows)
+    return compact, reference, vectors
+
+
+def test_quantized_storage_size(quantized):
+    compact, reference, _ = quantized
+    assert compact._vectors.nbytes * (4 if compact.storage == 'int8' else 2) == reference._vectors.nbytes
+
+
+def test_int8_quantization_error_is_bounded():
+    _, vectors = make_rows(200, 10)
+    face_gallery = FaceGallery(storage='int8')
+    face_gallery.load_rows([{'id': i + 1, 'employee_id': 'E', 'vector': v, 'quality_score': 0}
+                            for i, v in enumerate(vectors)])
+    decoded = face_gallery._dequantize(face_gallery._vectors[:200])
+    assert np.all(np.abs(decoded - vectors) <= face_gallery._scale / 2 + 1e-6)
+
+
+def test_reranked_results_equal_float32(quantized):
+    compact, reference, vectors = quantized
+    probes = vectors[:8] + np.random.default_rng(1).normal(scale=0.2, size=(8, DIMENSION)).astype(np.float32)
+    for fast, exact in zip(compact.search_batch(probes, k=3), reference.search_batch(probes, k=3)):
+        assert [r['face_id'] for r in fast] == [r['face_id'] for r in exact]
+        assert [r['distance'] for r in fast] == pytest.approx([r['distance'] for r in exact], abs=1e-3)
+    for fast, exact in zip(compact.search_employees_batch(probes, k=3),
+                           reference.search_employees_batch(probes, k=3)):
+        assert [c['employee_code'] for c in fast] == [c['employee_code'] for c in exact]
+
+
+def test_exact_vectors_are_cached(quantized):
+    compact, _, vectors = quantized
+    compact.search(vectors[0])
+    assert len(compact.fetched) == 1 and len(compact.fetched[0]) == 50
+    compact.search(vectors[0])
+    assert len(compact.fetched) == 1
+    assert len(compact._exact_cache) == 50
+
+
+def test_cache_is_bounded(quantized, monkeypatch):
+    compact, _, vectors = quantized
+    monkeypatch.setattr(Config, 'GALLERY_RERANK_CACHE_SIZE', 60)
+    compact.search_batch(vectors[:5])
+    assert len(compact._exact_cache) == 60
+
+
+def test_fetch_failure_falls_back_to_stored_vectors(quantized):
+    compact, reference, vectors = quantized
+
+    def failing(face_ids):
+        raise RuntimeError('database down')
+
+    compact._fetch_exact = failing
+    assert compact.search(vectors[3])[0]['face_id'] == reference.search(vectors[3])[0]['face_id']
+    assert len(compact._exact_cache) == 0
+
+
+def test_rows_changed_during_fetch(quantized):
+    """Swap-remove while the exact vectors are fetched: removed ids vanish, moved rows are found again"""
+    compact, _, vectors = quantized
+    nearest = [r['face_id'] for r in compact.search(vectors[10], k=3)]
+    compact._exact_cache.clear()
+    fetch_exact = compact._fetch_exact
+
+    def racing(face_ids):
+        compact.remove(nearest[0])
+        return fetch_exact(face_ids)
+
+    compact._fetch_exact = racing
+    results = compact.search(vectors[10], k=2)
+    assert [r['face_id'] for r in results] == nearest[1:]
+    for result in results:
+        assert compact._ids[compact._row_by_id[result['face_id']]] == result['face_id']
+    # Fetched while a row changed: not cached, it may predate the change
+    assert len(compact._exact_cache) == 0
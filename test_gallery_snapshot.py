@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+from config import Config
+from gallery import FaceGallery
+from gallery_snapshot import write_snapshot, read_snapshot, build_snapshot, HEADER
+
+DIMENSION = 128
+
+
+def make_rows(count: int, employees: int, seed: int = 10):
+    rng = np.random.default_rng(seed)
+    return [{'id': index + 1, 'employee_id': f'E{index % employees}', 'row_version': 100 + index,
+             'vector': rng.normal(size=DIMENSION).astype(np.float32), 'quality_score': 0.25}
+            for index in range(count)]
+
+
+@pytest.fixture
+def snapshot_path(tmp_path):
+    rows = make_rows(30, 4)
+    report = write_snapshot(str(tmp_path / 'gallery.snap'), iter(rows), len(rows), headroom=0.5)
+    return report, rows
+
+
+def test_round_trip(snapshot_path):
+    report, rows = snapshot_path
+    assert report['count'] == 30 and report['capacity'] == 64 and report['employees'] == 4
+    snapshot = read_snapshot(report['path'], mode='r')
+    assert snapshot.count == 30 and snapshot.dimension == DIMENSION
+    assert snapshot.ids[:30].tolist() == [row['id'] for row in rows]
+    assert snapshot.versions[:30].tolist() == [row['row_version'] for row in rows]
+    assert np.array_equal(snapshot.vectors[:30], np.vstack([row['vector'] for row in rows]))
+    assert [snapshot.codes[index] for index in snapshot.code_index[:30]] == [row['employee_id'] for row in rows]
+
+
+def test_rows_with_wrong_dimension_are_skipped(tmp_path):
+    rows = make_rows(3, 1)
+    rows[1]['vector'] = np.ones(3, dtype=np.float32)
+    report = write_snapshot(str(tmp_path / 'gallery.snap'), rows, 3)
+    assert report['count'] == 2
+
+
+def test_other_format_version_is_rejected(snapshot_path):
+    report, _ = snapshot_path
+    with open(report['path'], 'r+b') as f:
+        header = list(HEADER.unpack(f.read(HEADER.size)))
+        header[1] = 1
+        f.seek(0)
+        f.write(HEADER.pack(*header))
+    with pytest.raises(ValueError):
+        read_snapshot(report['path'])
+
+
+def test_gallery_maps_the_snapshot(snapshot_path, monkeypatch):
+    report, rows = snapshot_path
+    monkeypatch.setattr(FaceGallery, '_reconcile', lambda self: None)
+    mapped = FaceGallery(storage='float32')
+    mapped.load_snapshot(report['path'])
+    loaded = FaceGallery(storage='float32')
+    loaded.load_rows(rows)
+
+    assert mapped.stats()['snapshot']['shared_matrix']
+    probe = rows[7]['vector'] + 0.01
+    assert mapped.search_employees(probe, k=3) == loaded.search_employees(probe, k=3)
+    assert [r['face_id'] for r in mapped.search(probe, k=5)] == [r['face_id'] for r in loaded.search(probe, k=5)]
+
+
+def test_deltas_do_not_write_through_to_the_file(snapshot_path, monkeypatch):
+    report, rows = snapshot_path
+    monkeypatch.setattr(FaceGallery, '_reconcile', lambda self: None)
+    mapped = FaceGallery(storage='float32')
+    mapped.load_snapshot(report['path'])
+    mapped.remove(1)
+    mapped.upsert(999, 'NEW', np.zeros(DIMENSION, dtype=np.float32))
+
+    on_disk = read_snapshot(report['path'], mode='r')
+    assert on_disk.ids[:30].tolist() == [row['id'] for row in rows]
+    assert len(mapped) == 30 and 999 in mapped._row_by_id and 1 not in mapped._row_by_id
+
+
+def test_reconcile_applies_changes_made_after_the_build(db, enroll, tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'GALLERY_LISTEN_ENABLED', False)
+    rng = np.random.default_rng(11)
+    ids = [enroll(f'E{index % 2}', rng.normal(size=DIMENSION)) for index in range(4)]
+    path = str(tmp_path / 'gallery.snap')
+    assert build_snapshot(path, notify=False)['count'] == 4
+
+    updated = np.ones(DIMENSION, dtype=np.float32)
+    db.execute_query("UPDATE face_embeddings SET vector = %s WHERE id = %s", (updated, ids[0]))
+    db.execute_query("UPDATE face_embeddings SET status = 'INACTIVE' WHERE id = %s", (ids[1],))
+    added = enroll('E9', rng.normal(size=DIMENSION))
+
+    face_gallery = FaceGallery(storage='float32')
+    face_gallery.load_snapshot(path)
+    assert sorted(face_gallery._row_by_id) == sorted([ids[0], ids[2], ids[3], added])
+    assert np.allclose(face_gallery._vectors[face_gallery._row_by_id[ids[0]]], updated)
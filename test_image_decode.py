@@ -0,0 +1,125 @@
+import io
+import numpy as np
+import pytest
+from PIL import Image, JpegImagePlugin
+from config import Config
+from image_decode import decode_image, detection_proxy
+
+
+def encode(image: Image.Image, format: str = 'JPEG', orientation: int = 1) -> bytes:
+    buffer = io.BytesIO()
+    exif = Image.Exif()
+    if orientation != 1:
+        exif[0x0112] = orientation
+    image.save(buffer, format=format, exif=exif.tobytes() if orientation != 1 else b'')
+    return buffer.getvalue()
+
+
+def halves(width: int, height: int) -> Image.Image:
+    """Left half red, right half blue"""
+    pixels = np.zeros((height, width, 3), dtype=np.uint8)
+    pixels[:, :width // 2, 0] = 255
+    pixels[:, width // 2:, 2] = 255
+    return Image.fromarray(pixels)
+
+
+@pytest.fixture
+def draft_sizes(monkeypatch):
+    """Sizes a JPEG was actually decoded at (draft() requests of decode_image)"""
+    sizes = []
+    original = JpegImagePlugin.JpegImageFile.draft
+
+    def draft(self, mode, size):
+        result = original(self, mode, size)
+        sizes.append(self.size)
+        return result
+
+    monkeypatch.setattr(JpegImagePlugin.JpegImageFile, 'draft', draft)
+    return sizes
+
+
+def test_large_jpeg_is_decoded_at_reduced_scale(draft_sizes):
+    image_rgb, original_size = decode_image(encode(halves(4000, 3000)), max_side=900)
+
+    assert original_size == (4000, 3000)
+    assert image_rgb.shape == (675, 900, 3) and image_rgb.dtype == np.uint8
+    # 1/4 scale (1000 x 750) is the smallest DCT scale still covering 900 px
+    assert draft_sizes == [(1000, 750)]
+    assert image_rgb[300, 100, 0] > 200 and image_rgb[300, 800, 2] > 200
+
+
+def test_small_jpeg_is_decoded_at_full_size(draft_sizes):
+    image_rgb, original_size = decode_image(encode(halves(640, 480)), max_side=1280)
+    assert image_rgb.shape == (480, 640, 3)
+    assert original_size == (640, 480)
+    assert draft_sizes == []
+
+
+def test_exif_orientation_is_applied():
+    # Orientation 6: stored sideways, displayed rotated 90 degrees clockwise
+    image_rgb, original_size = decode_image(encode(halves(400, 200), orientation=6), max_side=1000)
+    assert image_rgb.shape == (400, 200, 3)
+    assert original_size == (200, 400)
+    top, bottom = image_rgb[50, 100], image_rgb[350, 100]
+    assert top[0] > 200 and top[2] < 50
+    assert bottom[2] > 200 and bottom[0] < 50
+
+
+def test_exif_orientation_with_reduced_scale():
+    image_rgb, original_size = decode_image(encode(halves(4000, 2000), orientation=8), max_side=500)
+    assert original_size == (2000, 4000)
+    assert image_rgb.shape == (500, 250, 3)
+
+
+def test_png_and_grayscale_are_resized_to_rgb():
+    gray = Image.fromarray(np.full((1000, 2000), 77, dtype=np.uint8))
+    image_rgb, original_size = decode_image(encode(gray, format='PNG'), max_side=500)
+    assert image_rgb.shape == (250, 500, 3)
+    assert original_size == (2000, 1000)
+    assert np.all(image_rgb == 77)
+
+
+def test_invalid_data_raises():
+    with pytest.raises(Exception):
+        decode_image(b'not an image', max_side=640)
+
+
+def test_detection_proxy_scale_maps_back_to_the_image():
+    image_rgb = np.zeros((1440, 1920, 3), dtype=np.uint8)
+    proxy, scale = detection_proxy(image_rgb, 320)
+    assert proxy.shape == (240, 320, 3)
+    assert scale == pytest.approx(1 / 6)
+    assert 300 / scale == pytest.approx(1800)
+
+
+def test_detection_proxy_keeps_small_images():
+    image_rgb = np.zeros((200, 300, 3), dtype=np.uint8)
+    for size in (0, 300, 640):
+        proxy, scale = detection_proxy(image_rgb, size)
+        assert proxy is image_rgb and scale == 1.0
+
+
+def test_detection_proxy_never_collapses_a_side():
+    proxy, _ = detection_proxy(np.zeros((2, 4000, 3), dtype=np.uint8), 100)
+    assert proxy.shape == (1, 100, 3)
+
+
+class NoFaceDetector:
+    """MediaPipe detector stand-in recording the image sizes it was given"""
+
+    def __init__(self):
+        self.shapes = []
+
+    def process(self, image_rgb):
+        self.shapes.append(image_rgb.shape)
+        return type('Results', (), {'detections': None})()
+
+
+def test_mediapipe_detects_on_the_proxy(monkeypatch):
+    from face_service_mediapipe import face_service
+    monkeypatch.setattr(Config, 'DETECTION_PROXY_SIZE', 320)
+    models = type('Models', (), {'detector': NoFaceDetector(), 'fallback_detector': NoFaceDetector()})()
+
+    assert face_service._extract_face_embedding(encode(halves(2400, 1800)), models) == (None, None, 0.0)
+    assert models.detector.shapes == [(240, 320, 3)]
+    assert models.fallback_detector.shapes == [(240, 320, 3)]
@@ -0,0 +1,84 @@
+import hashlib
+import numpy as np
+import pytest
+from config import Config
+from image_dedup import ImageDedup, image_sha256
+
+
+def store(db, enroll, image_data: bytes, employee_code: str = 'E1', **columns) -> int:
+    """Embedding row of an enrolled image (sha256 of its raw bytes)"""
+    face_id = enroll(employee_code, np.full(Config.EMBEDDING_DIMENSION, 0.5), quality_score=0.8)
+    columns = {'sha256': image_sha256(image_data), 'bbox': [10, 20, 30, 40], **columns}
+    db.execute_query(f"UPDATE face_embeddings SET {', '.join(f'{name} = %s' for name in columns)} WHERE id = %s",
+                     (*columns.values(), face_id))
+    return face_id
+
+
+def test_sha256_is_of_the_raw_bytes():
+    assert image_sha256(b'image') == hashlib.sha256(b'image').hexdigest()
+
+
+def test_disabled_dedup_finds_nothing(monkeypatch):
+    monkeypatch.setattr(Config, 'IMAGE_DEDUP_ENABLED', False)
+    dedup = ImageDedup()
+    assert dedup.find_many([image_sha256(b'image')]) == {}
+    assert dedup.stats()['lookups'] == 0
+
+
+def test_find_many_returns_active_rows_of_the_configured_model(db, enroll):
+    dedup = ImageDedup()
+    active = store(db, enroll, b'active')
+    store(db, enroll, b'deleted', status='DELETED')
+    store(db, enroll, b'other model', model_name='mediapipe')
+
+    hashes = [image_sha256(data) for data in (b'active', b'deleted', b'other model', b'unknown')]
+    found = dedup.find_many(hashes + [hashes[0]])
+    assert list(found) == [hashes[0]]
+    assert found[hashes[0]]['id'] == active
+    assert dedup.find(hashes[0])['employee_id'] == 'E1'
+    assert dedup.find(hashes[3]) is None
+
+    stats = dedup.stats()
+    assert stats['lookups'] == 7 and stats['hits'] == 3
+    assert stats['hit_rate'] == round(3 / 7, 4)
+
+
+def test_duplicate_rows_resolve_to_the_oldest(db, enroll):
+    first = store(db, enroll, b'same', employee_code='E1')
+    store(db, enroll, b'same', employee_code='E2')
+    assert ImageDedup().find(image_sha256(b'same'))['id'] == first
+
+
+def test_is_referenced_ignores_deleted_and_excluded_rows(db, enroll):
+    dedup = ImageDedup()
+    sha256 = image_sha256(b'image')
+    face_id = store(db, enroll, b'image')
+    assert dedup.is_referenced(sha256)
+    assert not dedup.is_referenced(sha256, exclude_id=face_id)
+    store(db, enroll, b'image', employee_code='E2', status='DELETED')
+    assert not dedup.is_referenced(sha256, exclude_id=face_id)
+
+
+def test_recognition_does_not_query_stored_images(monkeypatch):
+    import face_service_mediapipe
+    from embedding_cache import EmbeddingCache
+    from face_service_mediapipe import face_service
+    monkeypatch.setattr(Config, 'EMBEDDING_CACHE_BACKEND', 'memory')
+    monkeypatch.setattr(face_service_mediapipe, 'embedding_cache', EmbeddingCache())
+    monkeypatch.setattr(face_service_mediapipe.image_dedup, 'find_many',
+                        lambda hashes: pytest.fail('dedup lookup on the recognition path'))
+    extracted = []
+
+    def extract(images):
+        extracted.extend(images)
+        # Below the quality threshold: rejected before any gallery search
+        return [(np.ones(Config.EMBEDDING_DIMENSION, dtype=np.float32), None, 0.1) for _ in images]
+
+    monkeypatch.setattr(face_service, '_extract_many_uncached', extract)
+    monkeypatch.setattr(face_service, '_extract_uncached', lambda image_data: extract([image_data])[0])
+
+    assert 'quality too low' in face_service.recognize_face(b'probe')['message']
+    results = face_service.recognize_faces_batch([b'probe', b'other'])
+    assert all('quality too low' in result['message'] for result in results)
+    # The repeated probe came from the embedding cache
+    assert extracted == [b'probe', b'other']
@@ -0,0 +1,70 @@
+import math
+import numpy as np
+import psycopg2
+import pytest
+from config import Config
+from index_manager import IvfflatIndexManager, REBUILD_LOCK_KEY
+
+DIMENSION = 128
+
+
+@pytest.mark.parametrize('rows, lists', [(0, 1), (999, 1), (50000, 50), (1000000, 1000), (4000000, 2000)])
+def test_lists_for_rows(rows, lists):
+    assert IvfflatIndexManager.lists_for_rows(rows) == lists
+
+
+def test_drift(monkeypatch):
+    manager = IvfflatIndexManager()
+    monkeypatch.setattr(manager, 'get_state', lambda: None)
+    assert manager.drift({'rows_at_build': 100}, 150) == pytest.approx(0.5)
+    assert manager.drift({'rows_at_build': 100}, 80) == pytest.approx(-0.2)
+    # Never built: any row means a build is due
+    assert math.isinf(manager.drift(None, 10))
+    assert manager.drift(None, 0) == 0.0
+
+
+@pytest.fixture
+def manager(db):
+    def reset():
+        db.execute_query(f"DROP INDEX IF EXISTS {IvfflatIndexManager.INDEX_NAME}")
+        db.execute_query("DELETE FROM vector_index_state WHERE index_name = %s", (IvfflatIndexManager.INDEX_NAME,))
+    reset()
+    yield IvfflatIndexManager()
+    reset()
+
+
+def enroll_many(enroll, count: int, seed: int):
+    rng = np.random.default_rng(seed)
+    for index, vector in enumerate(rng.normal(size=(count, DIMENSION)).astype(np.float32)):
+        enroll(f'E{index % 10}', vector)
+
+
+def test_rebuild_records_state_and_waits_for_drift(manager, enroll, monkeypatch):
+    monkeypatch.setattr(Config, 'IVFFLAT_REBUILD_GROWTH', 0.5)
+    monkeypatch.setattr(Config, 'IVFFLAT_MEASURE_SAMPLE', 5)
+    enroll_many(enroll, 20, seed=1)
+
+    report = manager.rebuild()
+    assert report['rebuilt'] and report['rows_at_build'] == 20 and report['lists'] == 1
+    assert manager.index_exists()
+    assert manager.get_state()['rows_at_build'] == 20
+    assert report['after']['recall_at_k'] == 1.0
+
+    assert manager.rebuild() == {'rebuilt': False, 'reason': 'Drift below threshold', 'drift': 0.0}
+    enroll_many(enroll, 11, seed=2)
+    assert manager.status()['needs_rebuild']
+    assert manager.maybe_rebuild()['rows_at_build'] == 31
+
+
+def test_rebuild_skipped_while_another_session_holds_the_lock(manager, database):
+    conn = psycopg2.connect(Config.DATABASE_URL)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_lock(%s)", (REBUILD_LOCK_KEY,))
+        assert manager.rebuild(force=True)['rebuilt'] is False
+        assert not manager.index_exists()
+        with conn.cursor() as cursor:
+            # Released now, not whenever the closed session's backend exits
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (REBUILD_LOCK_KEY,))
+    finally:
+        conn.close()
@@ -0,0 +1,61 @@
+import io
+import numpy as np
+import pytest
+from face_service_mediapipe import face_service
+from gallery import FaceGallery
+
+MATCHES = [
+    {'employee_code': 'A', 'distance': 0.10},
+    {'employee_code': 'B', 'distance': 0.15},
+    {'employee_code': 'C', 'distance': 0.30},
+]
+
+
+def test_margin_and_candidates():
+    result = face_service._match_result(MATCHES, 0.9, top_k=3, margin_threshold=0.0)
+    assert result['success'] and result['employee_code'] == 'A'
+    assert result['margin'] == pytest.approx(0.05)
+    assert result['candidates'] == MATCHES
+
+
+def test_single_candidate_has_no_margin_and_no_candidate_list():
+    result = face_service._match_result(MATCHES[:1], 0.9, top_k=1, margin_threshold=0.0)
+    assert result['success'] and result['margin'] is None
+    assert 'candidates' not in result
+
+
+def test_ambiguous_match_is_rejected():
+    result = face_service._match_result(MATCHES, 0.9, margin_threshold=0.1)
+    assert not result['success']
+    assert result['message'].startswith('Ambiguous match')
+    assert result['distance'] == pytest.approx(0.10)
+
+
+def test_distance_above_tolerance_is_rejected(monkeypatch):
+    monkeypatch.setattr(face_service, 'tolerance', 0.05)
+    result = face_service._match_result(MATCHES, 0.9, margin_threshold=0.0)
+    assert not result['success'] and result['margin'] == pytest.approx(0.05)
+
+
+def test_margin_uses_second_distinct_employee():
+    """The runner-up is the best template of another employee, not a second template of the winner"""
+    rng = np.random.default_rng(7)
+    base = rng.normal(size=128).astype(np.float32)
+    other = rng.normal(size=128).astype(np.float32)
+    gallery = FaceGallery(storage='float32')
+    gallery.load_rows([
+        {'id': 1, 'employee_id': 'A', 'vector': base, 'quality_score': 0.9},
+        {'id': 2, 'employee_id': 'A', 'vector': base + 0.01, 'quality_score': 0.9},
+        {'id': 3, 'employee_id': 'B', 'vector': other, 'quality_score': 0.9},
+    ])
+    matches = gallery.search_employees(base, metric='cosine', k=2)
+    assert [match['employee_code'] for match in matches] == ['A', 'B']
+    result = face_service._match_result(matches, 0.9, top_k=2, margin_threshold=0.0)
+    assert result['margin'] == pytest.approx(matches[1]['distance'] - matches[0]['distance'])
+
+
+@pytest.mark.parametrize('params', [{'top_k': '0'}, {'margin_threshold': '-0.1'}])
+def test_invalid_parameters(client, params):
+    data = dict(params, images=[(io.BytesIO(b'x'), 'frame.jpg')])
+    response = client.post('/api/face/recognize/batch', data=data, content_type='multipart/form-data')
+    assert response.status_code == 400
@@ -0,0 +1,136 @@
+import threading
+import cv2
+import numpy as np
+import pytest
+import mediapipe_models
+from config import Config
+from mediapipe_models import ModelPool, ModelRegistry
+
+
+class FakeModel:
+    def __init__(self, built):
+        built.append(self)
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def built(monkeypatch):
+    """Models built by the factories (cheap fakes instead of MediaPipe graphs)"""
+    models = []
+    for name in mediapipe_models.MODEL_FACTORIES:
+        monkeypatch.setitem(mediapipe_models.MODEL_FACTORIES, name, lambda: FakeModel(models))
+    return models
+
+
+def blank_jpeg() -> bytes:
+    return cv2.imencode('.jpg', np.full((240, 320, 3), 128, dtype=np.uint8))[1].tobytes()
+
+
+def test_bundles_are_reused_across_checkouts(built):
+    pool = ModelPool(size=2, timeout=1)
+    for _ in range(10):
+        with pool.checkout() as bundle:
+            first = bundle
+    assert len(built) == 3
+    with pool.checkout() as bundle:
+        assert bundle is first
+
+
+def test_registry_rebuilds_its_pool_after_fork(built, monkeypatch):
+    registry = ModelRegistry()
+    pool = registry.pool
+    assert registry.pool is pool
+    monkeypatch.setattr(registry, '_pid', -1)
+    assert registry.pool is not pool
+
+
+def test_close_all_closes_idle_models(built):
+    pool = ModelPool(size=1, timeout=1)
+    pool.warm_up()
+    pool.close_all()
+    assert all(model.closed for model in built)
+
+
+def test_extraction_does_not_build_new_detectors():
+    """A failed detection (no face) goes through the fallback detector of the same bundle"""
+    from face_service_mediapipe import face_service
+    image = blank_jpeg()
+    face_service._extract_local(image)
+    created = face_service.models.stats()['created']
+    for _ in range(3):
+        assert face_service._extract_local(image) == (None, None, 0.0)
+    assert face_service.models.stats()['created'] == created
+
+
+def test_concurrent_checkouts_never_exceed_the_pool(built):
+    pool = ModelPool(size=3, timeout=5)
+    active = []
+    peak = []
+    lock = threading.Lock()
+    bundles = set()
+
+    def work():
+        with pool.checkout() as bundle:
+            with lock:
+                assert bundle not in active
+                active.append(bundle)
+                bundles.add(id(bundle))
+                peak.append(len(active))
+            threading.Event().wait(0.01)
+            with lock:
+                active.remove(bundle)
+
+    threads = [threading.Thread(target=work) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(peak) <= 3 and len(bundles) <= 3
+    stats = pool.stats()
+    assert stats['created'] <= 3 and stats['checkouts'] == 20 and stats['in_use'] == 0
+
+
+def test_checkout_times_out_when_every_bundle_is_busy(built):
+    pool = ModelPool(size=1, timeout=0.05)
+    with pool.checkout():
+        with pytest.raises(TimeoutError):
+            with pool.checkout():
+                pass
+    assert pool.stats()['timeouts'] == 1
+
+
+def test_failed_build_gives_the_slot_back(built, monkeypatch):
+    pool = ModelPool(size=1, timeout=0.05)
+
+    def broken():
+        raise RuntimeError('graph failed to load')
+
+    monkeypatch.setitem(mediapipe_models.MODEL_FACTORIES, 'face_mesh', broken)
+    with pytest.raises(RuntimeError):
+        pool.warm_up()
+    with pytest.raises(RuntimeError):
+        with pool.checkout():
+            pass
+    assert pool.stats()['created'] == 0
+
+    monkeypatch.setitem(mediapipe_models.MODEL_FACTORIES, 'face_mesh', lambda: FakeModel(built))
+    with pool.checkout():
+        assert pool.stats()['created'] == 1
+
+
+def test_warm_up_is_capped_by_the_pool_size(built):
+    pool = ModelPool(size=2, timeout=1)
+    threads = [threading.Thread(target=pool.warm_up, args=(2,)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert pool.stats()['created'] == 2 and pool.stats()['idle'] == 2
+
+
+def test_registry_pool_follows_config(built, monkeypatch):
+    monkeypatch.setattr(Config, 'MEDIAPIPE_POOL_SIZE', 4)
+    assert ModelRegistry().pool.size == 4
@@ -0,0 +1,91 @@
+import pytest
+from config import Config
+from database import StatementRegistry
+
+LOOKUP = """
+    SELECT employee_code, full_name FROM employees
+    WHERE employee_code = %s OR full_name = %s
+    ORDER BY employee_code
+"""
+
+
+@pytest.fixture
+def statement(db, monkeypatch):
+    """A registered lookup statement and two employees it can find"""
+    monkeypatch.setattr(Config, 'DB_PREPARED_STATEMENTS', True)
+    db.execute_query("INSERT INTO employees (employee_code, full_name) VALUES ('E1', 'Anna'), ('E2', 'Binh')")
+    return db.prepare('test_employee_lookup', LOOKUP)
+
+
+def server_statements(db):
+    """Statements PREPAREd on the connection the pool hands out next"""
+    with db.get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT name FROM pg_prepared_statements ORDER BY name")
+            names = [row['name'] for row in cursor.fetchall()]
+            conn.commit()
+            return names, set(conn.prepared)
+
+
+def test_placeholders_are_rewritten_to_positional_parameters():
+    registry = StatementRegistry()
+    name = registry.register('by_code', "SELECT * FROM t WHERE a = %s AND b IN (%s, %s) LIMIT 1")
+    assert name == 'by_code'
+    assert registry.query('by_code') == "SELECT * FROM t WHERE a = %s AND b IN (%s, %s) LIMIT 1"
+    assert registry._statements['by_code'][1] == "SELECT * FROM t WHERE a = $1 AND b IN ($2, $3) LIMIT 1"
+
+
+def test_statement_without_parameters_is_executed_without_arguments():
+    registry = StatementRegistry()
+    registry.register('all_rows', "SELECT 1")
+    executed = []
+    cursor = type('Cursor', (), {'execute': lambda self, query, params: executed.append((query, params))})()
+    registry.execute(cursor, 'all_rows')
+    registry.execute(cursor, 'all_rows', ('a', 2))
+    assert executed == [('EXECUTE all_rows', ()), ('EXECUTE all_rows (%s, %s)', ('a', 2))]
+
+
+def test_prepared_once_per_connection(db, statement):
+    first = db.execute_prepared(statement, ('E1', 'Binh'), fetch='all')
+    second = db.execute_prepared(statement, ('E2', 'nobody'), fetch='one')
+
+    assert [row['employee_code'] for row in first] == ['E1', 'E2']
+    assert second['full_name'] == 'Binh'
+    names, prepared = server_statements(db)
+    assert names.count(statement) == 1
+    assert statement in prepared
+
+
+def test_rowcount_without_fetch(db, statement):
+    db.prepare('test_rename_employee', "UPDATE employees SET full_name = %s WHERE employee_code = %s")
+    assert db.execute_prepared('test_rename_employee', ('Chi', 'E1')) == 1
+    assert db.execute_prepared(statement, ('x', 'Chi'), fetch='one')['employee_code'] == 'E1'
+
+
+def test_deallocated_statement_is_prepared_again(db, statement):
+    db.execute_prepared(statement, ('E1', ''), fetch='all')
+    with db.get_connection() as conn:
+        with conn.cursor() as cursor:
+            # What a pooler / DISCARD ALL does behind the application's back
+            cursor.execute("DEALLOCATE ALL")
+            conn.commit()
+        assert statement in conn.prepared
+
+    result = db.execute_prepared(statement, ('E2', ''), fetch='all')
+    assert [row['employee_code'] for row in result] == ['E2']
+    names, prepared = server_statements(db)
+    assert statement in names and statement in prepared
+
+
+def test_disabled_prepared_statements_run_the_plain_query(db, statement, monkeypatch):
+    monkeypatch.setattr(Config, 'DB_PREPARED_STATEMENTS', False)
+    with db.get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("DEALLOCATE ALL")
+            conn.commit()
+        conn.prepared.clear()
+
+    assert db.execute_prepared(statement, ('E1', ''), fetch='one')['full_name'] == 'Anna'
+    assert len(db.execute_prepared(statement, ('E1', 'Binh'), fetch='all')) == 2
+    names, _ = server_statements(db)
+    assert statement not in names
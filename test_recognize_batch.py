@@ -0,0 +1,73 @@
+import io
+import time
+import numpy as np
+import pytest
+from config import Config
+from gallery import face_gallery
+from face_service_mediapipe import face_service
+
+DIMENSION = 128
+
+
+@pytest.fixture
+def gallery(monkeypatch):
+    """Global gallery with three employees; attendance rows are captured instead of written"""
+    monkeypatch.setattr(Config, 'VECTOR_SEARCH_MODE', 'memory')
+    monkeypatch.setattr(Config, 'GALLERY_STORAGE', 'float32')
+    rng = np.random.default_rng(6)
+    vectors = rng.normal(size=(3, DIMENSION)).astype(np.float32)
+    face_gallery.load_rows([{'id': index + 1, 'employee_id': f'E{index}', 'vector': vector, 'quality_score': 0.9}
+                            for index, vector in enumerate(vectors)])
+    logged = []
+    monkeypatch.setattr(face_service, '_log_attendance_batch', logged.extend)
+    yield vectors, logged
+    face_gallery.load_rows([])
+
+
+def image_files(count: int, extension: str = 'jpg'):
+    return [(io.BytesIO(f'image-{index}'.encode()), f'frame{index}.{extension}') for index in range(count)]
+
+
+def test_results_follow_image_order(client, gallery, monkeypatch):
+    vectors, logged = gallery
+    extracted = {b'image-0': (vectors[2], None, 0.9), b'image-1': (None, None, 0.0), b'image-2': (vectors[0], None, 0.9)}
+    monkeypatch.setattr(face_service, 'extract_face_embeddings', lambda images: [extracted[image] for image in images])
+
+    response = client.post('/api/face/recognize/batch', data={'images': image_files(3), 'device_code': 'GATE-1'},
+                           content_type='multipart/form-data')
+    body = response.get_json()
+    assert response.status_code == 200 and body['count'] == 3
+    assert [result['employee_code'] for result in body['data']] == ['E2', None, 'E0']
+    assert [result['success'] for result in body['data']] == [True, False, True]
+    # One attendance row per recognized image, written together
+    assert [(row[0], row[1]) for row in logged] == [('E2', 'GATE-1'), ('E0', 'GATE-1')]
+
+
+@pytest.mark.parametrize('files, error', [
+    ([], 'No image files provided'),
+    (image_files(1, 'txt'), 'Invalid file'),
+    ([(io.BytesIO(b''), 'empty.jpg')], 'Empty image file'),
+])
+def test_rejected_requests(client, files, error):
+    response = client.post('/api/face/recognize/batch', data={'images': files}, content_type='multipart/form-data')
+    assert response.status_code == 400
+    assert error in response.get_json()['error']
+
+
+def test_too_many_images(client, monkeypatch):
+    monkeypatch.setattr(Config, 'BATCH_MAX_IMAGES', 2)
+    response = client.post('/api/face/recognize/batch', data={'images': image_files(3)},
+                           content_type='multipart/form-data')
+    assert response.status_code == 400
+
+
+def test_parallel_extraction_keeps_order(monkeypatch):
+    monkeypatch.setattr(face_service.extraction_engine, 'processes', 0)
+
+    def extract(image_data):
+        time.sleep(0.01 * (5 - int(image_data)))
+        return np.full(DIMENSION, int(image_data), dtype=np.float32), None, 1.0
+
+    monkeypatch.setattr(face_service, '_extract_local', extract)
+    results = face_service._extract_many_uncached([str(index).encode() for index in range(5)])
+    assert [int(embedding[0]) for embedding, _, _ in results] == [0, 1, 2, 3, 4]
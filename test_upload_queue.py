@@ -0,0 +1,179 @@
+import os
+import time
+import fcntl
+import hashlib
+import numpy as np
+import pytest
+import upload_queue as upload_queue_module
+from config import Config
+from upload_queue import ImageUploadQueue, UploadJob, pending_url, pending_object_name
+
+
+class FakeMinio:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.uploaded = []
+        self.deleted = []
+
+    def content_object_name(self, sha256: str) -> str:
+        return f"sha256/{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+    def upload_image(self, image_data, employee_code, content_type='image/jpeg', object_name=None):
+        if self.fail:
+            return False, object_name, None
+        self.uploaded.append((object_name, image_data))
+        return True, object_name, f"http://minio/{object_name}"
+
+    def delete_image(self, object_name):
+        self.deleted.append(object_name)
+        return True
+
+
+@pytest.fixture
+def minio(monkeypatch):
+    fake = FakeMinio()
+    monkeypatch.setattr(upload_queue_module, 'minio_service', fake)
+    return fake
+
+
+@pytest.fixture
+def uploads(minio, tmp_path, monkeypatch):
+    """Upload queue spooling to a temporary directory; workers are not started, tests call _process"""
+    monkeypatch.setattr(Config, 'UPLOAD_SPOOL_DIR', str(tmp_path / 'spool'))
+    monkeypatch.setattr(Config, 'UPLOAD_MEMORY_LIMIT_MB', 1)
+    monkeypatch.setattr(Config, 'UPLOAD_MAX_ATTEMPTS', 2)
+    monkeypatch.setattr(Config, 'UPLOAD_BACKOFF_BASE', 0.01)
+    instance = ImageUploadQueue()
+    monkeypatch.setattr(instance, '_ensure_threads', lambda: None)
+    return instance
+
+
+def spool_image(uploads, data: bytes = b'jpeg bytes', employee_code: str = 'E1') -> UploadJob:
+    return uploads.spool(data, employee_code, 'image/jpeg', hashlib.sha256(data).hexdigest())
+
+
+def enroll_pending(db, enroll, job: UploadJob) -> int:
+    face_id = enroll(job.employee_code, np.ones(Config.EMBEDDING_DIMENSION))
+    db.execute_query("UPDATE face_embeddings SET sha256 = %s, image_url = %s WHERE id = %s",
+                     (job.sha256, job.image_url, face_id))
+    return face_id
+
+
+def spool_files(uploads):
+    return sorted(os.listdir(uploads.spool_dir)) if os.path.isdir(uploads.spool_dir) else []
+
+
+def test_pending_url_roundtrip():
+    assert pending_object_name(pending_url('sha256/ab/cd/abcd')) == 'sha256/ab/cd/abcd'
+    assert pending_object_name('http://minio/sha256/ab') is None
+    assert pending_object_name(None) is None
+
+
+def test_spool_writes_bytes_and_metadata(uploads):
+    job = spool_image(uploads)
+    assert spool_files(uploads) == [f'{job.job_id}.bin', f'{job.job_id}.json']
+    with open(uploads._path(job.job_id, 'bin'), 'rb') as f:
+        assert f.read() == b'jpeg bytes'
+    assert job.image_url == 'pending://' + job.object_name
+
+    uploads.discard(job)
+    assert spool_files(uploads) == []
+
+
+def test_submit_keeps_bytes_in_memory_up_to_the_limit(uploads):
+    small = spool_image(uploads, b'a' * 1000)
+    large = spool_image(uploads, b'b' * (1024 * 1024))
+    uploads.submit(small)
+    uploads.submit(large)
+
+    assert small.data is not None and large.data is None
+    stats = uploads.stats()
+    assert stats['memory_bytes'] == 1000
+    assert stats['spooled_only'] == 1
+    assert stats['queued'] == 2 and stats['spool_jobs'] == 2
+
+
+def test_upload_replaces_the_pending_url(db, enroll, uploads, minio):
+    job = spool_image(uploads)
+    face_id = enroll_pending(db, enroll, job)
+    uploads.submit(job)
+    uploads._process(uploads._queue.get_nowait())
+
+    row = db.execute_one("SELECT image_url FROM face_embeddings WHERE id = %s", (face_id,))
+    assert row['image_url'] == f"http://minio/{job.object_name}"
+    assert minio.uploaded == [(job.object_name, b'jpeg bytes')]
+    assert spool_files(uploads) == []
+    stats = uploads.stats()
+    assert stats['uploaded'] == 1 and stats['memory_bytes'] == 0
+
+
+def test_spooled_only_job_is_read_back_from_disk(db, enroll, uploads, minio):
+    job = spool_image(uploads)
+    enroll_pending(db, enroll, job)
+    job.data = None
+    uploads.submit(job)
+    uploads._process(uploads._queue.get_nowait())
+
+    assert minio.uploaded == [(job.object_name, b'jpeg bytes')]
+    assert uploads.stats()['spooled_only'] == 0
+
+
+def test_orphaned_upload_is_deleted(db, uploads, minio):
+    job = spool_image(uploads)
+    uploads.submit(job)
+    uploads._process(uploads._queue.get_nowait())
+
+    assert minio.deleted == [job.object_name]
+    assert uploads.stats()['orphaned'] == 1
+    assert spool_files(uploads) == []
+
+
+def test_failed_upload_is_retried_then_kept_in_spool(db, enroll, uploads, minio):
+    minio.fail = True
+    job = spool_image(uploads)
+    enroll_pending(db, enroll, job)
+    uploads.submit(job)
+
+    uploads._process(uploads._queue.get_nowait())
+    assert uploads.stats()['retried'] == 1
+    # Re-queued by the backoff timer
+    retry = uploads._queue.get(timeout=2)
+    assert retry is job and retry.attempts == 1
+
+    uploads._process(retry)
+    stats = uploads.stats()
+    assert stats['failed'] == 1 and stats['last_error'] == 'MinIO upload failed'
+    assert stats['memory_bytes'] == 0
+    assert spool_files(uploads) == [f'{job.job_id}.bin', f'{job.job_id}.json']
+
+
+def test_entry_locked_by_another_process_is_skipped(uploads, minio):
+    job = spool_image(uploads)
+    uploads.submit(job)
+    with open(uploads._path(job.job_id, 'json')) as held:
+        # flock locks belong to the open file description, so a second open() conflicts
+        fcntl.flock(held, fcntl.LOCK_EX)
+        uploads._process(uploads._queue.get_nowait())
+
+    assert minio.uploaded == []
+    assert uploads.stats()['memory_bytes'] == 0
+    assert len(spool_files(uploads)) == 2
+
+
+def test_replay_queues_only_settled_entries(uploads, monkeypatch):
+    monkeypatch.setattr(Config, 'UPLOAD_REPLAY_MIN_AGE', 60)
+    old = spool_image(uploads, b'old')
+    young = spool_image(uploads, b'young')
+    stale = time.time() - 120
+    os.utime(uploads._path(old.job_id, 'json'), (stale, stale))
+    with open(os.path.join(uploads.spool_dir, 'broken.json'), 'w') as f:
+        f.write('{')
+    os.utime(os.path.join(uploads.spool_dir, 'broken.json'), (stale, stale))
+
+    assert uploads.replay() == 1
+    replayed = uploads._queue.get_nowait()
+    assert replayed.job_id == old.job_id and replayed.data is None
+    assert replayed.object_name == old.object_name and replayed.sha256 == old.sha256
+    assert uploads._queue.empty()
+    assert uploads.stats()['replayed'] == 1
+    assert young.job_id != replayed.job_id
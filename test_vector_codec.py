@@ -0,0 +1,48 @@
+import json
+import numpy as np
+import pytest
+from vector_codec import cast_vector, to_vector, encode_vector, VectorAdapter
+
+
+def test_cast_vector_decodes_pgvector_text():
+    vector = cast_vector('[0.5,-1,2.25]')
+    assert vector.dtype == np.float32
+    assert vector.tolist() == [0.5, -1.0, 2.25]
+    assert cast_vector(None) is None
+
+
+def test_encode_round_trip():
+    array = np.random.default_rng(0).normal(size=128).astype(np.float32)
+    assert np.array_equal(cast_vector(encode_vector(array)), array)
+
+
+@pytest.mark.parametrize('value', [
+    np.array([1.0, 2.0], dtype=np.float64),
+    ' [1,2] ',
+    [1, 2],
+])
+def test_to_vector_coerces_every_stored_form(value):
+    vector = to_vector(value)
+    assert vector.dtype == np.float32
+    assert vector.tolist() == [1.0, 2.0]
+
+
+def test_adapter_quotes_as_vector_literal():
+    assert VectorAdapter(np.array([1.5, 2.0])).getquoted() == b"'[1.5,2.0]'::vector"
+
+
+def test_database_round_trip(db):
+    array = np.random.default_rng(1).normal(size=128).astype(np.float32)
+    row = db.execute_one("SELECT %s AS vector, (%s <-> %s) AS distance", (array, array, array + 1))
+    assert isinstance(row['vector'], np.ndarray)
+    assert np.array_equal(row['vector'], array)
+    assert row['distance'] == pytest.approx(np.sqrt(128), rel=1e-5)
+
+
+def test_embedding_listing_is_json_serializable(db, enroll):
+    pytest.importorskip('face_recognition')
+    from face_service import face_service
+    enroll('E1', np.ones(128, dtype=np.float32))
+    listing = face_service.get_face_embeddings('E1')
+    assert len(listing) == 1 and 'vector' not in listing[0]
+    json.dumps(listing, default=str)
@@ -0,0 +1,78 @@
+import os
+import subprocess
+import sys
+import numpy as np
+import pytest
+from config import Config
+from database import vector_index_queries
+from vector_search import pgvector_search, search_employees_batch, _distinct_employees
+
+DIMENSION = 128
+
+
+def test_distinct_employees_keeps_best_template_per_employee():
+    matches = [
+        {'employee_code': 'A', 'distance': 0.1},
+        {'employee_code': 'A', 'distance': 0.2},
+        {'employee_code': 'B', 'distance': 0.3},
+        {'employee_code': 'C', 'distance': 0.4},
+    ]
+    assert _distinct_employees(matches, 2) == [
+        {'employee_code': 'A', 'distance': 0.1},
+        {'employee_code': 'B', 'distance': 0.3},
+    ]
+
+
+def test_unsupported_metric():
+    with pytest.raises(ValueError):
+        pgvector_search.search(np.zeros(DIMENSION, dtype=np.float32), metric='dot')
+
+
+def test_hnsw_index_only_for_hnsw_type(monkeypatch):
+    monkeypatch.setattr(Config, 'VECTOR_INDEX_TYPE', 'hnsw')
+    monkeypatch.setattr(Config, 'DISTANCE_METRIC', 'cosine')
+    queries = vector_index_queries()
+    assert len(queries) == 1
+    assert 'USING hnsw (vector vector_cosine_ops)' in queries[0]
+
+    monkeypatch.setattr(Config, 'VECTOR_INDEX_TYPE', 'none')
+    assert vector_index_queries() == []
+
+
+@pytest.mark.parametrize('mode, index_type', [('memory', 'none'), ('pgvector', 'hnsw')])
+def test_index_type_defaults_to_search_mode(mode, index_type):
+    env = {key: value for key, value in os.environ.items() if key != 'VECTOR_INDEX_TYPE'}
+    env.update(VECTOR_SEARCH_MODE=mode, VECTOR_INDEX_TYPE='')
+    output = subprocess.run([sys.executable, '-c', 'from config import Config; print(Config.VECTOR_INDEX_TYPE)'],
+                            env=env, capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert output.stdout.strip() == index_type
+
+
+def test_pgvector_search_matches_brute_force(db, enroll):
+    rng = np.random.default_rng(3)
+    vectors = rng.normal(size=(40, DIMENSION)).astype(np.float32)
+    ids = [enroll(f'E{index % 8}', vector) for index, vector in enumerate(vectors)]
+    # Inactive templates are never returned
+    db.execute_query("UPDATE face_embeddings SET status = 'INACTIVE' WHERE id = %s", (ids[0],))
+
+    probe = vectors[0] + 0.01
+    results = pgvector_search.search(probe, k=3, ef_search=100)
+    distances = np.linalg.norm(vectors - probe, axis=1)
+    distances[0] = np.inf
+    expected = [ids[index] for index in np.argsort(distances)[:3]]
+    assert [result['face_id'] for result in results] == expected
+    assert results[0]['distance'] == pytest.approx(distances[np.argmin(distances)], rel=1e-4)
+
+
+def test_pgvector_employee_search(db, enroll, monkeypatch):
+    monkeypatch.setattr(Config, 'VECTOR_SEARCH_MODE', 'pgvector')
+    rng = np.random.default_rng(4)
+    vectors = rng.normal(size=(30, DIMENSION)).astype(np.float32)
+    for index, vector in enumerate(vectors):
+        enroll(f'E{index % 3}', vector)
+
+    results = search_employees_batch(vectors[:2], k=3)
+    assert [candidate['employee_code'] for candidate in results[0]][0] == 'E0'
+    assert [candidate['employee_code'] for candidate in results[1]][0] == 'E1'
+    assert all(len({c['employee_code'] for c in candidates}) == 3 for candidates in results)
@@ -0,0 +1,308 @@
+import os
+import json
+import time
+import uuid
+import fcntl
+import queue
+import threading
+import logging
+from typing import List, Optional, Dict, Any
+from database import db_manager
+from config import Config
+from minio_service import minio_service
+from image_dedup import image_dedup
+
+logger = logging.getLogger(__name__)
+
+# image_url of an embedding whose image is still being uploaded
+PENDING_URL_PREFIX = 'pending://'
+
+
+def pending_url(object_name: str) -> str:
+    return PENDING_URL_PREFIX + object_name
+
+
+def pending_object_name(image_url: Optional[str]) -> Optional[str]:
+    """Object name of a pending image_url, None for a regular URL"""
+    if image_url and image_url.startswith(PENDING_URL_PREFIX):
+        return image_url[len(PENDING_URL_PREFIX):]
+    return None
+
+
+class UploadJob:
+    """One enrollment image waiting for upload; `data` is None when it only lives in the spool"""
+
+    __slots__ = ('job_id', 'object_name', 'employee_code', 'content_type', 'sha256',
+                 'size', 'data', 'attempts')
+
+    def __init__(self, job_id: str, object_name: str, employee_code: str, content_type: str,
+                 sha256: str, size: int, data: Optional[bytes] = None, attempts: int = 0):
+        self.job_id = job_id
+        self.object_name = object_name
+        self.employee_code = employee_code
+        self.content_type = content_type
+        self.sha256 = sha256
+        self.size = size
+        self.data = data
+        self.attempts = attempts
+
+    @property
+    def image_url(self) -> str:
+        """Placeholder stored in face_embeddings.image_url until the upload finishes"""
+        return pending_url(self.object_name)
+
+
+class ImageUploadQueue:
+    """
+    Background upload of enrollment images to MinIO.
+
+    save_face_embedding spools the image bytes to Config.UPLOAD_SPOOL_DIR,
+    inserts the embedding with a `pending://<object_name>` image_url and
+    submits the job; worker threads upload it and replace the placeholder
+    with the real URL. Bytes stay in memory up to Config.UPLOAD_MEMORY_LIMIT_MB,
+    beyond that workers read them back from the spool. Spooled jobs left by a
+    previous process are replayed on start().
+    """
+
+    def __init__(self):
+        self.spool_dir = Config.UPLOAD_SPOOL_DIR
+        self.workers = Config.UPLOAD_WORKERS
+        self.memory_limit = int(Config.UPLOAD_MEMORY_LIMIT_MB * 1024 * 1024)
+        self._queue: 'queue.Queue[UploadJob]' = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._pid = os.getpid()
+        self._memory_bytes = 0
+        self._spooled_only = 0
+        self._uploaded = 0
+        self._retried = 0
+        self._failed = 0
+        self._orphaned = 0
+        self._replayed = 0
+        self._last_error: Optional[str] = None
+
+    @property
+    def enabled(self) -> bool:
+        return Config.UPLOAD_ASYNC and minio_service is not None and Config.STORE_ORIGINAL_IMAGES
+
+    def _path(self, job_id: str, suffix: str) -> str:
+        return os.path.join(self.spool_dir, f"{job_id}.{suffix}")
+
+    def spool(self, image_data: bytes, employee_code: str, content_type: str, sha256: str) -> UploadJob:
+        """Write the image to the spool; call before inserting the embedding row"""
+        job = UploadJob(
+            job_id=uuid.uuid4().hex,
+            object_name=minio_service.content_object_name(sha256),
+            employee_code=employee_code,
+            content_type=content_type,
+            sha256=sha256,
+            size=len(image_data),
+            data=image_data
+        )
+        os.makedirs(self.spool_dir, exist_ok=True)
+        with open(self._path(job.job_id, 'bin'), 'wb') as f:
+            f.write(image_data)
+        # The metadata file is written last (atomically): it marks a complete spool entry
+        meta_path = self._path(job.job_id, 'json')
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump({
+                'object_name': job.object_name,
+                'employee_code': job.employee_code,
+                'content_type': job.content_type,
+                'sha256': job.sha256,
+                'size': job.size
+            }, f)
+        os.replace(meta_path + '.tmp', meta_path)
+        return job
+
+    def discard(self, job: UploadJob):
+        """Drop a spooled job whose embedding row was not inserted"""
+        for suffix in ('json', 'bin'):
+            try:
+                os.remove(self._path(job.job_id, suffix))
+            except FileNotFoundError:
+                pass
+
+    def submit(self, job: UploadJob):
+        """Queue a spooled job for upload (after its embedding row is committed)"""
+        self._ensure_threads()
+        with self._lock:
+            if job.data is not None and self._memory_bytes + job.size > self.memory_limit:
+                # Memory pressure: the worker reads the bytes back from the spool
+                job.data = None
+            if job.data is None:
+                self._spooled_only += 1
+            else:
+                self._memory_bytes += job.size
+        self._queue.put(job)
+
+    def start(self):
+        """Start the workers and replay jobs spooled by a previous process"""
+        if not self.enabled:
+            return
+        self._ensure_threads()
+        self.replay()
+
+    def replay(self) -> int:
+        """Queue spool entries older than Config.UPLOAD_REPLAY_MIN_AGE seconds"""
+        if not os.path.isdir(self.spool_dir):
+            return 0
+        # Younger entries may belong to another worker whose insert is not committed yet
+        cutoff = time.time() - Config.UPLOAD_REPLAY_MIN_AGE
+        replayed = 0
+        for name in sorted(os.listdir(self.spool_dir)):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.spool_dir, name)
+            try:
+                if os.path.getmtime(path) > cutoff:
+                    continue
+                with open(path) as f:
+                    meta = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping unreadable upload spool entry {name}: {e}")
+                continue
+            self.submit(UploadJob(job_id=name[:-len('.json')], **meta))
+            replayed += 1
+        if replayed:
+            with self._lock:
+                self._replayed += replayed
+            logger.info(f"Replayed {replayed} spooled image uploads")
+        return replayed
+
+    def _ensure_threads(self):
+        if not self._threads or self._pid != os.getpid():
+            with self._lock:
+                if not self._threads or self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                    self._pid = os.getpid()
+                    self._threads = [
+                        threading.Thread(target=self._run, name=f'image-upload-{i}', daemon=True)
+                        for i in range(self.workers)
+                    ]
+                    for thread in self._threads:
+                        thread.start()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._process(job)
+            except Exception as e:
+                logger.error(f"Image upload worker error for {job.object_name}: {e}")
+
+    def _process(self, job: UploadJob):
+        in_memory = job.data is not None
+        meta_path = self._path(job.job_id, 'json')
+        try:
+            meta = open(meta_path)
+        except FileNotFoundError:
+            # Already handled by another worker / process
+            self._release(job, in_memory)
+            return
+
+        with meta:
+            try:
+                # One uploader per spool entry across processes (replays of the same spool dir)
+                fcntl.flock(meta, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self._release(job, in_memory)
+                return
+            if os.fstat(meta.fileno()).st_nlink == 0:
+                self._release(job, in_memory)
+                return
+
+            error = self._upload(job)
+            if error is None:
+                self.discard(job)
+                self._release(job, in_memory)
+                return
+
+        job.attempts += 1
+        with self._lock:
+            self._last_error = error
+        if job.attempts >= Config.UPLOAD_MAX_ATTEMPTS:
+            # Left in the spool: retried on the next start
+            logger.error(f"Upload of {job.object_name} failed {job.attempts} times, kept in spool: {error}")
+            with self._lock:
+                self._failed += 1
+            self._release(job, in_memory)
+            return
+
+        with self._lock:
+            self._retried += 1
+        delay = min(Config.UPLOAD_BACKOFF_BASE * (2 ** (job.attempts - 1)), Config.UPLOAD_BACKOFF_MAX)
+        timer = threading.Timer(delay, self._queue.put, args=(job,))
+        timer.daemon = True
+        timer.start()
+
+    def _upload(self, job: UploadJob) -> Optional[str]:
+        """Upload the image and fill in its URL; returns None on success, else the error"""
+        try:
+            data = job.data
+            if data is None:
+                with open(self._path(job.job_id, 'bin'), 'rb') as f:
+                    data = f.read()
+            success, object_name, url = minio_service.upload_image(
+                data, job.employee_code, content_type=job.content_type, object_name=job.object_name
+            )
+            if not success:
+                return 'MinIO upload failed'
+
+            updated = db_manager.execute_query(
+                "UPDATE face_embeddings SET image_url = %s WHERE sha256 = %s AND image_url = %s",
+                (url or f"/files/{object_name}", job.sha256, job.image_url)
+            )
+            if updated == 0:
+                # The embedding was deleted (or never committed) meanwhile; the
+                # object is content-addressed, so keep it if another row uses it
+                if not image_dedup.is_referenced(job.sha256):
+                    minio_service.delete_image(object_name)
+                with self._lock:
+                    self._orphaned += 1
+            else:
+                with self._lock:
+                    self._uploaded += 1
+            return None
+        except Exception as e:
+            return str(e)
+
+    def _release(self, job: UploadJob, in_memory: bool):
+        with self._lock:
+            if in_memory:
+                self._memory_bytes -= job.size
+                job.data = None
+            else:
+                self._spooled_only -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Upload backlog of this worker and of the shared spool directory"""
+        spool_jobs = 0
+        spool_bytes = 0
+        if os.path.isdir(self.spool_dir):
+            for entry in os.scandir(self.spool_dir):
+                if entry.name.endswith('.bin'):
+                    spool_jobs += 1
+                    spool_bytes += entry.stat().st_size
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'workers': self.workers,
+                'queued': self._queue.qsize(),
+                'memory_bytes': self._memory_bytes,
+                'memory_limit_bytes': self.memory_limit,
+                'spooled_only': self._spooled_only,
+                'spool_dir': self.spool_dir,
+                'spool_jobs': spool_jobs,
+                'spool_bytes': spool_bytes,
+                'uploaded': self._uploaded,
+                'retried': self._retried,
+                'failed': self._failed,
+                'orphaned': self._orphaned,
+                'replayed': self._replayed,
+                'last_error': self._last_error
+            }
+
+
+# Global image upload queue instance
+upload_queue = ImageUploadQueue()
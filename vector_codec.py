@@ -0,0 +1,39 @@
+import numpy as np
+from psycopg2.extensions import ISQLQuote
+
+# pgvector wire format (text protocol): '[0.1,0.2,...]'
+
+
+def cast_vector(value, cursor=None):
+    """psycopg2 typecaster: decode pgvector text output straight into a float32 array"""
+    if value is None:
+        return None
+    return np.fromstring(value[1:-1], sep=',', dtype=np.float32)
+
+
+def to_vector(value) -> np.ndarray:
+    """Coerce a stored vector (decoded array, pgvector text or list) to float32"""
+    if isinstance(value, np.ndarray):
+        return value.astype(np.float32, copy=False)
+    if isinstance(value, str):
+        return cast_vector(value.strip())
+    return np.asarray(value, dtype=np.float32)
+
+
+def encode_vector(array) -> str:
+    """Encode an array in pgvector text format"""
+    return '[' + ','.join(map(repr, np.asarray(array, dtype=np.float32).tolist())) + ']'
+
+
+class VectorAdapter:
+    """psycopg2 adapter: pass numpy arrays as query parameters as '[...]'::vector"""
+
+    def __init__(self, array: np.ndarray):
+        self.array = array
+
+    def __conform__(self, proto):
+        if proto is ISQLQuote:
+            return self
+
+    def getquoted(self) -> bytes:
+        return f"'{encode_vector(self.array)}'::vector".encode('ascii')
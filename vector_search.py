@@ -0,0 +1,114 @@
+import logging
+from typing import List, Optional, Dict, Any
+import numpy as np
+from database import db_manager
+from config import Config
+from gallery import face_gallery
+
+logger = logging.getLogger(__name__)
+
+# pgvector distance operators per metric
+DISTANCE_OPERATORS = {
+    'l2': '<->',
+    'cosine': '<=>'
+}
+
+
+class PgVectorSearch:
+    """
+    Server-side nearest-neighbour search on face_embeddings.vector.
+    Uses the HNSW / IVFFlat index created by init_database() when the metric
+    matches Config.DISTANCE_METRIC, so only k rows are shipped back over the wire.
+    """
+
+    def search(self, probe: np.ndarray, metric: str = 'l2', k: int = 1,
+               ef_search: Optional[int] = None, probes: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Find the k nearest ACTIVE templates to a probe.
+        Returns a list of {face_id, employee_code, distance, quality_score}, closest first.
+        """
+        operator = DISTANCE_OPERATORS.get(metric)
+        if operator is None:
+            raise ValueError(f"Unsupported distance metric: {metric}")
+
+        probe = np.asarray(probe, dtype=np.float32)
+        query = f"""
+            SELECT fe.id AS face_id, fe.employee_id AS employee_code, fe.quality_score,
+                   fe.vector {operator} %s::vector AS distance
+            FROM face_embeddings fe
+            JOIN employees e ON fe.employee_id = e.employee_code
+            WHERE fe.status = 'ACTIVE' AND e.status = 'ACTIVE'
+            ORDER BY fe.vector {operator} %s::vector
+            LIMIT %s
+        """
+        if Config.VECTOR_INDEX_TYPE == 'ivfflat':
+            settings = {'ivfflat.probes': int(probes or Config.IVFFLAT_PROBES)}
+        else:
+            settings = {'hnsw.ef_search': max(int(ef_search or Config.HNSW_EF_SEARCH), k)}
+
+        rows = db_manager.execute_with_settings(query, (probe, probe, k), settings)
+        return [{
+            'face_id': row['face_id'],
+            'employee_code': row['employee_code'],
+            'distance': float(row['distance']),
+            'quality_score': float(row['quality_score'] or 0.0)
+        } for row in rows]
+
+
+def search_nearest(probe: np.ndarray, metric: str = 'l2', k: int = 1,
+                   ef_search: Optional[int] = None, probes: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Find the k nearest templates using the configured Config.VECTOR_SEARCH_MODE"""
+    if Config.VECTOR_SEARCH_MODE == 'pgvector':
+        return pgvector_search.search(probe, metric=metric, k=k, ef_search=ef_search, probes=probes)
+    return face_gallery.search(probe, metric=metric, k=k)
+
+
+def search_nearest_batch(probes: np.ndarray, metric: str = 'l2', k: int = 1,
+                         ef_search: Optional[int] = None,
+                         ivfflat_probes: Optional[int] = None) -> List[List[Dict[str, Any]]]:
+    """Find the k nearest templates for a block of probes (M x D)"""
+    if Config.VECTOR_SEARCH_MODE == 'pgvector':
+        return [pgvector_search.search(probe, metric=metric, k=k, ef_search=ef_search, probes=ivfflat_probes)
+                for probe in probes]
+    return face_gallery.search_batch(probes, metric=metric, k=k)
+
+
+def _distinct_employees(matches: List[Dict[str, Any]], k: int) -> List[Dict[str, Any]]:
+    """Keep the best template per employee from a closest-first template list"""
+    candidates = []
+    seen = set()
+    for match in matches:
+        if match['employee_code'] in seen:
+            continue
+        seen.add(match['employee_code'])
+        candidates.append({'employee_code': match['employee_code'], 'distance': match['distance']})
+        if len(candidates) == k:
+            break
+    return candidates
+
+
+def search_employees(probe: np.ndarray, metric: str = 'l2', k: int = 1,
+                     ef_search: Optional[int] = None, probes: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Find the k closest distinct employees.
+    Returns a list of {employee_code, distance}, closest first.
+    """
+    return search_employees_batch(np.asarray(probe, dtype=np.float32)[None, :], metric, k,
+                                  ef_search=ef_search, ivfflat_probes=probes)[0]
+
+
+def search_employees_batch(probes: np.ndarray, metric: str = 'l2', k: int = 1,
+                           ef_search: Optional[int] = None,
+                           ivfflat_probes: Optional[int] = None) -> List[List[Dict[str, Any]]]:
+    """Find the k closest distinct employees for a block of probes (M x D)"""
+    if Config.VECTOR_SEARCH_MODE == 'pgvector':
+        # Over-fetch templates so that k distinct employees are (very likely) present
+        fetch = k * Config.PGVECTOR_EMPLOYEE_OVERFETCH
+        return [_distinct_employees(pgvector_search.search(probe, metric=metric, k=fetch,
+                                                           ef_search=ef_search, probes=ivfflat_probes), k)
+                for probe in probes]
+    return face_gallery.search_employees_batch(probes, metric=metric, k=k)
+
+
+# Global pgvector search instance
+pgvector_search = PgVectorSearch()